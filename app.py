@@ -1,18 +1,42 @@
 import pandas as pd
-import re
 import requests
 import os
-import io
+import copy
+import functools
+import json
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from azure.identity import ClientSecretCredential
 import streamlit as st
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
-import openpyxl
-from openpyxl.styles import (PatternFill, Font, Alignment, Border, Side)
-from openpyxl.utils import get_column_letter
+
+import report_engine as engine
+import instrumentation
+import profiling
+from edit_journal import (
+    EditJournal, JournalDrainer, PENDING as JOURNAL_PENDING, SENT as JOURNAL_SENT, FAILED as JOURNAL_FAILED,
+    CONFLICT as JOURNAL_CONFLICT
+)
+from instrumentation import span, record_rows
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from report_engine import (
+    BUDGET_QUERY, REVENUE_CLASSES, CLASSIFICATION_ORDER,
+    get_financial_year_range, calculate_profit_metrics, fmt_currency, balance_sum, total_balance, add_balances,
+    build_excel_report, get_period_list, build_editor_pivot, editor_wide_frame, editor_page, EDITOR_DIMENSIONS,
+    apply_ledger_delta, ledger_cell_values, build_upsert_variables,
+    fetch_cells, ledger_cell_stamps, detect_conflicts, change_key, server_change, read_adjustments, validate_adjustments, adjustment_changes,
+    EXPORT_FORMATS, export_formats, export_file, ledger_export_frame, hierarchy_export_frame,
+    render_pnl_html, render_store_html,
+    select_periods, select_report_frame, store_comparison_periods,
+    build_aggregation_cube, hierarchy_from_cube, comparison_periods,
+    build_trend_data, TREND_TRANSFORMS, ALL_STORES_SERIES, scan_anomalies,
+    LedgerSearchIndex, search_hierarchy,
+    BRAND_NAMES, GROUP_LABEL, group_period_frame, build_consolidated_hierarchy,
+    fabric_reads
+)
+from dataset_cache import BrandDatasetCache, estimate_nbytes
+from session_memory import SessionFrameStore
 
 # =============================
 # ENVIRONMENT & CONFIG
@@ -107,394 +131,20 @@ st.markdown("""
 # =============================
 # AUTHENTICATION & API LOGIC
 # =============================
-@st.cache_resource
-def get_credential():
-    return ClientSecretCredential(
-        tenant_id=os.getenv("FABRIC_TENANT_ID"),
-        client_id=os.getenv("FABRIC_CLIENT_ID"),
-        client_secret=os.getenv("FABRIC_CLIENT_SECRET")
-    )
-
-def get_access_token():
-    credential = get_credential()
-    token = credential.get_token("https://api.fabric.microsoft.com/.default")
-    return token.token
-
-def run_graphql(query, variables=None):
-    endpoint = os.getenv("FABRIC_ENDPOINT")
-    headers = {
-        "Authorization": f"Bearer {get_access_token()}",
-        "Content-Type": "application/json"
-    }
-    payload = {"query": query, "variables": variables}
+def report_api_errors(fn, *args):
     try:
-        response = requests.post(endpoint, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        return fn(*args)
+    except engine.GraphQLError as e:
+        st.error(f"API Error: {str(e)}")
+        raise e
     except requests.exceptions.RequestException as e:
         st.error(f"API Error: {str(e)}")
         if hasattr(e, 'response') and e.response is not None:
             st.json(e.response.text)
         raise e
 
-# =============================
-# BRAND BASED QUERIES
-# =============================
-if st.session_state.get("brand") == "wed":
-
-    READ_QUERY = """
-    query {
-      executesp_wd_readData { id Ledger classification ContraName Store Balance Year MonthName Month FinancialYearMonth last_modified_at last_modified_user }
-    }
-    """
-
-    UPSERT_MUTATION = """
-    mutation upsertBalance($year: Int!, $monthName: String!, $store: String!, $balance: Float, $account_name: String!, $classification: String!, $partner_id_name: String!, $last_modified_at: DateTime, $last_modified_user: String) {
-      executesp_wd_upsertBalance(year: $year, monthName: $monthName, store: $store, balance: $balance, account_name: $account_name, classification: $classification, partner_id_name: $partner_id_name, last_modified_at: $last_modified_at, last_modified_user: $last_modified_user) { rows_affected }
-    }
-    """
-
-else:  # PRA (default)
-
-    READ_QUERY = """
-    query {
-      executesp_pr_readData { id account_name classification partner_id_name Store Balance Year MonthName Month FinancialYearMonth last_modified_at last_modified_user }
-    }
-    """
-
-    UPSERT_MUTATION = """
-    mutation upsertBalance($year: Int!, $monthName: String!, $store: String!, $balance: Float, $account_name: String!, $classification: String!, $partner_id_name: String!, $last_modified_at: DateTime, $last_modified_user: String) {
-      executesp_pr_upsertBalance(year: $year, monthName: $monthName, store: $store, balance: $balance, account_name: $account_name, classification: $classification, partner_id_name: $partner_id_name, last_modified_at: $last_modified_at, last_modified_user: $last_modified_user) { rows_affected }
-    }
-    """
-
-# =============================
-# HELPER FUNCTIONS
-# =============================
-def get_financial_year_range(df, year, start_month=4):
-    months = [(year, m) for m in range(start_month, 13)] + [(year + 1, m) for m in range(1, start_month)]
-    periods = []
-    for y, m in months:
-        period_sort = f"{y}-{str(m).zfill(2)}"
-        mask = (df['Year'] == y) & (df['Month'] == m)
-        if mask.any():
-            display = df.loc[mask, 'DisplayPeriod'].iloc[0]
-            periods.append({'sort': period_sort, 'display': display})
-    return periods
-
-def calculate_profit_metrics(df, periods, revenue_classes):
-    results = []
-    for period in periods:
-        period_data = df[df['DisplayPeriod'] == period]
-        revenue = period_data[period_data['classification'].isin(revenue_classes)]['Balance'].sum()
-        expenses = period_data[~period_data['classification'].isin(revenue_classes)]['Balance'].sum()
-        profit = revenue - expenses
-        results.append({
-            'DisplayPeriod': period,
-            'Revenue': revenue,
-            'Expenses': expenses,
-            'Profit': profit,
-            'Margin': (profit / revenue * 100) if revenue != 0 else 0
-        })
-    return pd.DataFrame(results)
-
-def fmt_currency(val):
-    if pd.isna(val) or val == 0: 
-        return "₹0"
-    
-    # 1. Format as integer string (No decimals)
-    main_part = f"{int(round(float(val)))}"
-    
-    # 2. Logic for Indian Thousand Separator (Lakhs/Crores)
-    if len(main_part) > 3:
-        # Separate the last 3 digits
-        last_three = main_part[-3:]
-        remaining = main_part[:-3]
-        
-        # Group the remaining digits in pairs (twos)
-        remaining = re.sub(r'(\d+?)(?=(\d{2})+(?!\d))', r'\1,', remaining)
-        main_part = remaining + ',' + last_three
-        
-    return f"₹{main_part}"
-
-# =============================
-# HIERARCHICAL DATA BUILDER
-# =============================
-def build_hierarchy_data(report_df, grouping_list, group_by='DisplayPeriod'):
-    """
-    Modified to support dynamic grouping (e.g., by Period or by Store).
-    
-    :param report_df: The source DataFrame
-    :param grouping_list: List of columns to show (e.g., selected_periods or unique_stores)
-    :param group_by_col: The column name in report_df to filter against (default 'DisplayPeriod')
-    """
-    hierarchy = {}
-    
-    classification_order = [
-        'Net Sales', 'Other Income', 'Cost of Goods Sold (COGS)', 'Employee cost',
-        'Rent and Utilities', 'Marketing and Advertisment', 'Admin Expenses',
-        'Logistics', 'Other Expenses', 'Finance cost', 'Supplier Payments',
-        'Purchase Expense', 'Depreciation'
-    ]
-    
-    unique_classifications = report_df['classification'].dropna().unique()
-    
-    def get_classification_order(cls):
-        try:
-            return classification_order.index(cls)
-        except ValueError:
-            return len(classification_order) + (sum(ord(c) for c in cls) if cls else 0)
-    
-    sorted_classifications = sorted(unique_classifications, key=get_classification_order)
-    
-    for classification in sorted_classifications:
-        cls_df = report_df[report_df['classification'] == classification]
-        cls_totals = {}
-        for item in grouping_list:
-            # Dynamically filter by the provided column name
-            cls_totals[item] = cls_df[cls_df[group_by] == item]['Balance'].sum()
-        
-        accounts = {}
-        for account in sorted(cls_df['account_name'].dropna().unique()):
-            acc_df = cls_df[cls_df['account_name'] == account]
-            acc_totals = {}
-            for item in grouping_list:
-                acc_totals[item] = acc_df[acc_df[group_by] == item]['Balance'].sum()
-            
-            partners = {}
-            for partner in sorted(acc_df['partner_id_name'].dropna().unique()):
-                prt_df = acc_df[acc_df['partner_id_name'] == partner]
-                prt_totals = {}
-                for item in grouping_list:
-                    prt_totals[item] = prt_df[prt_df[group_by] == item]['Balance'].sum()
-                partners[partner] = prt_totals
-            
-            accounts[account] = {'totals': acc_totals, 'partners': partners}
-        
-        hierarchy[classification] = {'totals': cls_totals, 'accounts': accounts}
-        
-    return hierarchy
-
-# =============================
-# EXCEL EXPORT WITH NATIVE GROUPING
-# =============================
-def build_excel_report(hierarchy, periods, store_filter="All", brand="pra", report_type="pnl", expand_all=False, open_classifications=None, open_accounts=None):
-    brand_name = "Prashanti" if brand == "pra" else "Wedtree"
-    if open_classifications is None: open_classifications = set()
-    if open_accounts is None: open_accounts = set()
-    
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "P&L Statement"
-
-    ws.sheet_properties.outlinePr.summaryBelow = False
-    
-    DARK_BLUE, MID_BLUE, LIGHT_BLUE, WHITE = "0F2044", "1A3A6B", "EEF2F9", "FFFFFF"
-    GREEN, RED, GREY = "059669", "E11D48", "64748B"
-    
-    def make_fill(hex_color): return PatternFill(start_color=hex_color, end_color=hex_color, fill_type="solid")
-    hair_border = Border(bottom=Side(style='hair', color='E2E8F0'))
-    
-    # --- Title Block ---
-    ws.merge_cells(f"A1:{get_column_letter(len(periods) + 3)}1")
-    title_cell = ws["A1"]
-    if report_type == "store":
-        title_cell.value = "Store Comparison Report"
-    else:
-        title_cell.value = "Profit & Loss Statement"
-    title_cell.font = Font(name="Calibri", bold=True, size=14, color=WHITE)
-    title_cell.fill = make_fill(DARK_BLUE)
-    title_cell.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[1].height = 30
-    
-    ws.merge_cells(f"A2:{get_column_letter(len(periods) + 3)}2")
-    sub_cell = ws["A2"]
-    if report_type == "store":
-        sub_cell.value = f"Brand: {brand_name}  |  Comparison View  |  Generated: {datetime.now().strftime('%d %b %Y, %H:%M')}"
-    else:
-        sub_cell.value = f"Brand: {brand_name}  |  Store: {store_filter}  |  Generated: {datetime.now().strftime('%d %b %Y, %H:%M')}"
-    sub_cell.font = Font(name="Calibri", size=9, color="B8D4F5")
-    sub_cell.fill = make_fill(MID_BLUE)
-    sub_cell.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[2].height = 18
-    ws.row_dimensions[3].height = 6
-    
-    # --- Headers ---
-    header_row = 4
-    headers = ["Account Hierarchy"] + list(periods) + ["Total"]
-    for col_idx, header in enumerate(headers, 1):
-        cell = ws.cell(row=header_row, column=col_idx, value=header)
-        cell.font = Font(name="Calibri", bold=True, size=9, color=WHITE)
-        cell.fill = make_fill(DARK_BLUE)
-        cell.alignment = Alignment(horizontal="right" if col_idx > 1 else "left", vertical="center", wrap_text=False)
-        cell.border = Border(bottom=Side(style='medium', color='FFFFFF'))
-    ws.row_dimensions[header_row].height = 24
-    
-    ws.column_dimensions['A'].width = 38
-    for col_idx in range(2, len(periods) + 2): ws.column_dimensions[get_column_letter(col_idx)].width = 15
-    ws.column_dimensions[get_column_letter(len(periods) + 2)].width = 15
-    
-    # --- Data Population with Outline Grouping ---
-    current_row = header_row + 1
-    
-    classification_order = [
-        'Net Sales',
-        'Other Income',
-        'Cost of Goods Sold (COGS)',
-        'Employee cost',
-        'Rent and Utilities',            
-        'Marketing and Advertisment',    
-        'Admin Expenses',
-        'Logistics',
-        'Other Expenses',
-        'Finance cost',
-        'Supplier Payments',            
-        'Purchase Expense',
-        'Depreciation'
-    ]
-    
-    def get_classification_order(cls):
-        try:
-            return classification_order.index(cls)
-        except ValueError:
-            return len(classification_order) + (sum(ord(c) for c in cls) if cls else 0)
-    
-    sorted_classifications = sorted(hierarchy.keys(), key=get_classification_order)
-    
-    for cls_name in sorted_classifications:
-        cls_data = hierarchy[cls_name]
-        cls_key = f"cls_{cls_name}"
-        is_cls_open = expand_all or (cls_key in open_classifications)
-        cls_total = sum(cls_data['totals'].values())
-        
-        # 1. Classification (Level 0 summary - no outline level)
-        cls_cell = ws.cell(row=current_row, column=1, value=f"  {cls_name}")
-        cls_cell.font = Font(name="Calibri", bold=True, size=10, color=DARK_BLUE)
-        cls_cell.fill = make_fill(LIGHT_BLUE)
-        cls_cell.alignment = Alignment(horizontal="left", vertical="center", indent=1)
-        cls_cell.border = Border(top=Side(style='thin', color='CBD5E1'), bottom=Side(style='thin', color='CBD5E1'))
-        
-        for col_idx, p in enumerate(periods, 2):
-            v = cls_data['totals'].get(p, 0)
-            cell = ws.cell(row=current_row, column=col_idx, value=v)
-            cell.number_format = '#,##0'
-            cell.font = Font(name="Calibri", bold=True, size=9, color=GREEN if v > 0 else RED if v < 0 else GREY)
-            cell.fill = make_fill(LIGHT_BLUE)
-            cell.alignment = Alignment(horizontal="right", vertical="center")
-            cell.border = Border(top=Side(style='thin', color='CBD5E1'), bottom=Side(style='thin', color='CBD5E1'))
-        
-        total_cell = ws.cell(row=current_row, column=len(periods) + 2, value=cls_total)
-        total_cell.number_format = '#,##0'
-        total_cell.font = Font(name="Calibri", bold=True, size=9, color=GREEN if cls_total > 0 else RED if cls_total < 0 else GREY)
-        total_cell.fill = make_fill(LIGHT_BLUE)
-        total_cell.alignment = Alignment(horizontal="right", vertical="center")
-        total_cell.border = Border(top=Side(style='thin', color='CBD5E1'), bottom=Side(style='thin', color='CBD5E1'))
-        ws.row_dimensions[current_row].height = 20
-        current_row += 1
-        
-        # Sort accounts alphabetically within each classification
-        for acc_name in sorted(cls_data['accounts'].keys()):
-            acc_data = cls_data['accounts'][acc_name]
-            acc_key = f"acc_{cls_name}__{acc_name}"
-            is_acc_open = expand_all or (acc_key in open_accounts)
-            acc_total = sum(acc_data['totals'].values())
-            
-            # 2. Account (Level 1 details inside Classification)
-            acc_cell = ws.cell(row=current_row, column=1, value=f"      {acc_name}")
-            acc_cell.font = Font(name="Calibri", bold=True, size=9, color="334155")
-            acc_cell.fill = make_fill(WHITE)
-            acc_cell.alignment = Alignment(horizontal="left", vertical="center", indent=3)
-            acc_cell.border = hair_border
-            
-            for col_idx, p in enumerate(periods, 2):
-                v = acc_data['totals'].get(p, 0)
-                cell = ws.cell(row=current_row, column=col_idx, value=v)
-                cell.number_format = '#,##0'
-                cell.font = Font(name="Calibri", bold=True, size=8, color=GREEN if v > 0 else RED if v < 0 else GREY)
-                cell.fill = make_fill(WHITE)
-                cell.alignment = Alignment(horizontal="right", vertical="center")
-                cell.border = hair_border
-            
-            acc_total_cell = ws.cell(row=current_row, column=len(periods) + 2, value=acc_total)
-            acc_total_cell.number_format = '#,##0'
-            acc_total_cell.font = Font(name="Calibri", bold=True, size=8, color=GREEN if acc_total > 0 else RED if acc_total < 0 else GREY)
-            acc_total_cell.fill = make_fill(WHITE)
-            acc_total_cell.alignment = Alignment(horizontal="right", vertical="center")
-            acc_total_cell.border = hair_border
-            
-            # ** EXCEL NATIVE GROUPING LOGIC **
-            ws.row_dimensions[current_row].outline_level = 1
-            if not is_cls_open:
-                ws.row_dimensions[current_row].hidden = True
-                
-            ws.row_dimensions[current_row].height = 18
-            current_row += 1
-            
-            # Sort partners alphabetically within each account
-            for partner_name in sorted(acc_data['partners'].keys()):
-                prt_totals = acc_data['partners'][partner_name]
-                prt_total = sum(prt_totals.values())
-                
-                # 3. Partner (Level 2 details inside Account)
-                prt_cell = ws.cell(row=current_row, column=1, value=f"            · {partner_name}")
-                prt_cell.font = Font(name="Calibri", size=8, color=GREY)
-                prt_cell.fill = make_fill(WHITE)
-                prt_cell.alignment = Alignment(horizontal="left", vertical="center", indent=5)
-                prt_cell.border = hair_border
-                
-                for col_idx, p in enumerate(periods, 2):
-                    v = prt_totals.get(p, 0)
-                    cell = ws.cell(row=current_row, column=col_idx, value=v)
-                    cell.number_format = '#,##0'
-                    cell.font = Font(name="Calibri", size=8, color=GREEN if v > 0 else RED if v < 0 else GREY)
-                    cell.fill = make_fill(WHITE)
-                    cell.alignment = Alignment(horizontal="right", vertical="center")
-                    cell.border = hair_border
-                
-                prt_total_cell = ws.cell(row=current_row, column=len(periods) + 2, value=prt_total)
-                prt_total_cell.number_format = '#,##0'
-                prt_total_cell.font = Font(name="Calibri", size=8, color=GREEN if prt_total > 0 else RED if prt_total < 0 else GREY)
-                prt_total_cell.fill = make_fill(WHITE)
-                prt_total_cell.alignment = Alignment(horizontal="right", vertical="center")
-                prt_total_cell.border = hair_border
-                
-                # ** EXCEL NATIVE GROUPING LOGIC **
-                ws.row_dimensions[current_row].outline_level = 2
-                if not is_cls_open or not is_acc_open:
-                    ws.row_dimensions[current_row].hidden = True
-                    
-                ws.row_dimensions[current_row].height = 16
-                current_row += 1
-    
-    # Grand Total
-    grand_totals = {p: sum(cls_data['totals'].get(p, 0) for cls_data in hierarchy.values()) for p in periods}
-    grand_total = sum(grand_totals.values())
-    
-    gt_cell = ws.cell(row=current_row, column=1, value="  GRAND TOTAL")
-    gt_cell.font = Font(name="Calibri", bold=True, size=11, color=WHITE)
-    gt_cell.fill = make_fill(DARK_BLUE)
-    gt_cell.alignment = Alignment(horizontal="left", vertical="center")
-    
-    for col_idx, p in enumerate(periods, 2):
-        cell = ws.cell(row=current_row, column=col_idx, value=grand_totals[p])
-        cell.number_format = '#,##0'
-        cell.font = Font(name="Calibri", bold=True, size=10, color=WHITE)
-        cell.fill = make_fill(DARK_BLUE)
-        cell.alignment = Alignment(horizontal="right", vertical="center")
-    
-    gt_total = ws.cell(row=current_row, column=len(periods) + 2, value=grand_total)
-    gt_total.number_format = '#,##0'
-    gt_total.font = Font(name="Calibri", bold=True, size=10, color=WHITE)
-    gt_total.fill = make_fill(DARK_BLUE)
-    gt_total.alignment = Alignment(horizontal="right", vertical="center")
-    ws.row_dimensions[current_row].height = 24
-    
-    ws.freeze_panes = "B5"
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
+def run_graphql(query, variables=None):
+    return report_api_errors(engine.run_graphql, query, variables)
 
 # =============================
 # PERSISTENT SESSION STATE
@@ -515,6 +165,8 @@ if "reset_editor" not in st.session_state: st.session_state.reset_editor = 0
 if "expand_all_mode" not in st.session_state: 
     st.session_state.expand_all_mode = False
 
+# State is updated before anything renders, so this run already reflects the toggle;
+# no need to pay for a second full rerun.
 params = st.query_params
 if "toggle_cls" in params:
     key = params["toggle_cls"]
@@ -524,14 +176,12 @@ if "toggle_cls" in params:
     else:
         st.session_state.open_classifications.add(key)
     del st.query_params["toggle_cls"]
-    st.rerun()
 
 if "toggle_acc" in params:
     key = params["toggle_acc"]
     if key in st.session_state.open_accounts: st.session_state.open_accounts.discard(key)
     else: st.session_state.open_accounts.add(key)
     del st.query_params["toggle_acc"]
-    st.rerun()
 
 # New separate session states for independent table control
 if "expand_pnl" not in st.session_state: 
@@ -584,6 +234,118 @@ if not st.session_state.logged_in:
         """, unsafe_allow_html=True)
     st.stop()
 
+# =============================
+# INSTRUMENTATION & DEBUG PANEL
+# =============================
+ADMIN_USERS = {u.strip().lower() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
+
+def is_admin():
+    return os.getenv("GL_DEBUG_PANEL") == "1" or st.session_state.get("logged_in_user", "").lower() in ADMIN_USERS
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+rerun_trace = instrumentation.start_trace(
+    session_id=current_session_id(),
+    user=st.session_state.get("logged_in_user"),
+    context={'brand': st.session_state.get("brand", "pra")}
+)
+
+# Widget keys whose values select what a rerun computes, saved with each profile
+FILTER_KEY_PREFIXES = ("insights_", "trend_", "anomaly_", "group_", "editor_", "budget_", "expand_")
+
+def filter_state():
+    return {key: value for key, value in sorted(st.session_state.to_dict().items())
+            if key.startswith(FILTER_KEY_PREFIXES) and isinstance(value, (str, int, float, bool))}
+
+def start_profiler():
+    """A sampling profiler for this rerun when GL_PROFILE=1 or an admin turned it on for the session."""
+    if profiling.profiling_enabled() or (is_admin() and st.session_state.get("profile_reruns", False)):
+        return profiling.SamplingProfiler().start()
+    return None
+
+def finish_profiler(profiler, trace):
+    if profiler is None or 'profile' in trace.context:
+        return
+    profiler.stop()
+    report = profiler.write_reports(trace.trace_id, dict(trace.context, user=trace.user, filters=filter_state()))
+    trace.context['profile'] = report['text']
+    st.session_state.last_profile = report
+
+rerun_profiler = start_profiler()
+
+def render_debug_panel():
+    finish_profiler(rerun_profiler, rerun_trace)
+    trace = instrumentation.finish_trace(rerun_trace)
+    if not is_admin() or "debug_panel_slot" not in globals():
+        return
+    with debug_panel_slot.container():
+        with st.expander("🛠️ Debug: Rerun Timing", expanded=False):
+            st.toggle("Profile reruns", key="profile_reruns", disabled=profiling.profiling_enabled(),
+                      help=f"Sample every rerun and fragment rerun of this session; reports go to {profiling.profile_dir()}/")
+            profile = st.session_state.get("last_profile")
+            if profile:
+                st.caption(f"Last profile: {profile['samples']} samples over {profile['duration_ms']:.0f} ms · {profile['text']}")
+                st.dataframe(pd.DataFrame(profile['top'][:10]), hide_index=True, width='stretch')
+            summary = trace.graphql_summary()
+            st.caption(f"Rerun {trace.trace_id} · {trace.to_dict()['duration_ms']:.0f} ms · "
+                       f"{summary['count']} Fabric call(s), {summary['total_ms']:.0f} ms, {summary['response_bytes'] / 1024:.0f} KiB")
+            if trace.spans:
+                st.dataframe(pd.DataFrame(trace.spans)[['name', 'duration_ms', 'start_ms', 'depth']], hide_index=True, width='stretch')
+            if trace.graphql_calls:
+                st.dataframe(pd.DataFrame(trace.graphql_calls), hide_index=True, width='stretch')
+            if trace.row_counts:
+                st.dataframe(pd.DataFrame(trace.row_counts), hide_index=True, width='stretch')
+            st.caption(f"Session memory: {session_frames.session_bytes(trace.session_id) / (1024 * 1024):.1f} MB · "
+                       f"all sessions {session_frames.total_bytes() / (1024 * 1024):.1f} MB · "
+                       f"brand cache {brand_cache.total_bytes() / (1024 * 1024):.1f} MB · "
+                       f"{fabric_reads.coalesced} coalesced Fabric read(s)")
+            sessions = session_frames.report()
+            if sessions:
+                st.dataframe(pd.DataFrame(sessions), hide_index=True, width='stretch')
+            history = instrumentation.recent_traces(session_id=trace.session_id)
+            st.download_button(
+                "⬇️ Export traces (JSONL)",
+                data="\n".join(json.dumps(t.to_dict(), default=str) for t in history),
+                file_name=f"gl_traces_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl",
+                mime="application/x-ndjson",
+                key="debug_export_traces",
+                width='stretch'
+            )
+
+def stop_rerun():
+    render_debug_panel()
+    st.stop()
+
+def panel_fragment(name, run_every=None):
+    """
+    st.fragment for a main-area panel: its own widgets rerun only the panel, not the
+    whole script. Those partial reruns get a trace of their own (shown in the debug
+    panel on the next full rerun), since the script-level trace has already finished.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            session_frames.touch(current_session_id())
+            trace = instrumentation.current_trace()
+            if trace is not None and trace.duration is None:
+                with span(f"panel:{name}"):
+                    return fn(*args, **kwargs)
+            trace = instrumentation.start_trace(
+                session_id=current_session_id(),
+                user=st.session_state.get("logged_in_user"),
+                context={'brand': st.session_state.get("brand", "pra"), 'fragment': name}
+            )
+            profiler = start_profiler()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                finish_profiler(profiler, trace)
+                instrumentation.finish_trace(trace)
+        return st.fragment(run, run_every=run_every)
+    return decorate
+
 # =============================
 # BRAND SELECTION (AFTER LOGIN)
 # =============================
@@ -597,6 +359,13 @@ brand_map = {
 
 reverse_brand_map = {v: k for k, v in brand_map.items()}
 
+# Financial Insights "Compare With" choices -> report_engine.PERIOD_COMPARISONS mode
+COMPARE_OPTIONS = {
+    "None": None,
+    "Prior Month (MoM)": "mom",
+    "Same Month Last Year (YoY)": "yoy"
+}
+
 # with st.sidebar:
 #     st.markdown("<h2 style='color:#0F2044; font-weight:700;'>Brand</h2>", unsafe_allow_html=True)
 
@@ -612,48 +381,157 @@ reverse_brand_map = {v: k for k, v in brand_map.items()}
 #         st.session_state.brand = selected_value
 #         st.rerun()
 
+# =============================
+# BRAND DATASET CACHE (PER-PROCESS LRU)
+# =============================
+@st.cache_resource
+def get_brand_cache():
+    return BrandDatasetCache(
+        max_entries=int(os.getenv("BRAND_CACHE_MAX_ENTRIES", "4")),
+        max_bytes=int(float(os.getenv("BRAND_CACHE_MAX_MB", "512")) * 1024 * 1024),
+        ttl=int(os.getenv("BRAND_CACHE_TTL", "300"))
+    )
+
+brand_cache = get_brand_cache()
+
+# =============================
+# SESSION MEMORY
+# =============================
+@st.cache_resource
+def get_session_frames():
+    budget_mb = os.getenv("SESSION_MEMORY_BUDGET_MB")
+    return SessionFrameStore(
+        idle_seconds=int(os.getenv("SESSION_IDLE_EVICT_SECONDS", "900")),
+        budget_bytes=int(float(budget_mb) * 1024 * 1024) if budget_mb else None,
+        min_idle_seconds=int(os.getenv("SESSION_MIN_IDLE_SECONDS", "60"))
+    )
+
+session_frames = get_session_frames()
+
+def session_frame(key):
+    return session_frames.get(current_session_id(), key)
+
+def set_session_frame(key, value):
+    session_frames.set(current_session_id(), key, value)
+
+def touch_session():
+    # Small session_state values (widget state, filters, pending edits) count towards the session too
+    state_bytes = sum(estimate_nbytes(v) for v in st.session_state.to_dict().values())
+    session_frames.touch(current_session_id(), st.session_state.get("logged_in_user"),
+                         pinned=bool(st.session_state.get("dirty")), state_bytes=state_bytes)
+
+# =============================
+# EDIT JOURNAL
+# =============================
+@st.cache_resource
+def get_edit_journal(_brand_cache):
+    # One journal and drainer per process; rows left by a previous process are replayed on start
+    journal = EditJournal()
+
+    def fold_applied(brand, changes):
+        # Drainer thread: edits reach the shared dataset only once Fabric has accepted them
+        try:
+            _brand_cache.apply_changes(brand, changes)
+        except Exception:
+            _brand_cache.invalidate(brand)
+
+    return journal, JournalDrainer(journal, on_applied=fold_applied).start()
+
+edit_journal, edit_drainer = get_edit_journal(brand_cache)
+
+def unsent_changes(brand):
+    """This user's saved edits that Fabric has not accepted yet, oldest first."""
+    rows = edit_journal.rows(brand=brand, user=st.session_state.get('logged_in_user'), statuses=(JOURNAL_PENDING,), limit=None)
+    return [engine.upsert_change(r['variables']) for r in rows]
+
 # =============================
 # DATA FETCHING
 # =============================
-@st.cache_data(ttl=300)
 def load_data(brand):
-    result = run_graphql(READ_QUERY)
-    data_key = "executesp_wd_readData" if brand == "wed" else "executesp_pr_readData"
-    items = result.get("data", {}).get(data_key, [])
-    df = pd.DataFrame(items)
-    if brand == "wed":
-        df = df.rename(columns={
-            "Ledger": "account_name",
-            "ContraName": "partner_id_name"
-        })
-    if not df.empty:
-        df['Balance'] = pd.to_numeric(df['Balance'], errors='coerce').fillna(0.0)
-        df['Year'] = pd.to_numeric(df['Year'], errors='coerce')
-        df['Month'] = pd.to_numeric(df['Month'], errors='coerce')
-        df['PeriodSort'] = df['Year'].astype(str) + "-" + df['Month'].astype(str).str.zfill(2)
-        df['DisplayPeriod'] = df['MonthName'] + " " + df['Year'].astype(str)
-    return df
+    return report_api_errors(engine.load_data, brand)
+
+# Financial Insights asks Fabric for pre-aggregated totals instead of summing the ledger rows here
+SERVER_AGGREGATES = os.getenv("GL_SERVER_AGGREGATES") == "1"
+
+def load_report_cube(brand, periods, store_filter, ledger):
+    if edit_journal.status_counts(brand=brand, user=st.session_state.get('logged_in_user')).get(JOURNAL_PENDING):
+        # Fabric has not seen all of this user's saved edits yet; the local rows already include them
+        with span("aggregate_local", brand=brand):
+            return build_aggregation_cube(select_report_frame(ledger, periods, store_filter))
+    return report_api_errors(engine.load_report_cube, brand, periods, store_filter, ledger)
+
+def load_group_frames():
+    # Every brand through the shared cache; the ones not cached yet are fetched concurrently
+    return report_api_errors(engine.load_brands, list(BRAND_NAMES),
+                             lambda brand: brand_cache.get_or_load(brand, engine.load_data))
+
+def dataset_source(brand):
+    # What a session's frames are built from: the shared dataset version and this user's journal
+    counts = edit_journal.status_counts(brand=brand, user=st.session_state.get('logged_in_user'))
+    return brand_cache.handle(brand), tuple(sorted(counts.items()))
+
+def load_session_frames(brand):
+    """
+    This session's frames: the shared cached dataset plus this user's saved edits still
+    queued for Fabric. Those stay on a session-local handle until the drainer has sent
+    them and folded them into the shared dataset.
+    """
+    with span("load_data", brand=brand):
+        raw_df = brand_cache.get_or_load(brand, load_data)
+    source = dataset_source(brand)
+    handle = source[0]
+    unsent = unsent_changes(brand)
+    if unsent:
+        with span("unsent_edits", changes=len(unsent)):
+            raw_df, handle = brand_cache.local_version(handle, raw_df, unsent)
+    st.session_state.dataset_handle = handle
+    st.session_state.dataset_source = source
+    set_session_frame('original_df', raw_df.copy())
+    set_session_frame('current_df', raw_df.copy())
+    st.session_state.current_brand = brand
+    st.session_state.dirty = False
 
 with st.spinner("Synchronizing with Microsoft Fabric..."):
     if "current_brand" not in st.session_state:
         st.session_state.current_brand = None
 
+    touch_session()
+    if st.session_state.current_brand == st.session_state.brand and session_frame('current_df') is None:
+        # Frames were reclaimed while this session sat idle: rehydrate from the shared cache
+        instrumentation.set_context(rehydrated=True)
+        st.session_state.current_brand = None
+    elif st.session_state.current_brand == st.session_state.brand and not st.session_state.get("dirty"):
+        source = dataset_source(st.session_state.brand)
+        if source[0] is not None and source != st.session_state.get("dataset_source"):
+            # Another session's save, one of this user's edits being sent or failing, or a reload moved
+            # the dataset on: follow it, so this session keeps sharing its aggregates. A session with
+            # unsaved grid edits stays on its own load.
+            instrumentation.set_context(refreshed=True)
+            st.session_state.current_brand = None
+
     if st.session_state.current_brand != st.session_state.brand:
-        raw_df = load_data(st.session_state.brand)
-        st.session_state.original_df = raw_df.copy()
-        st.session_state.current_df = raw_df.copy()
-        st.session_state.current_brand = st.session_state.brand
-        st.session_state.dirty = False
+        load_session_frames(st.session_state.brand)
 
-df = st.session_state.current_df.copy()
-unique_periods = df[['PeriodSort', 'DisplayPeriod']].drop_duplicates().sort_values('PeriodSort', ascending=False)
-period_list = unique_periods['DisplayPeriod'].tolist()
+with span("session_copy"):
+    df = session_frame('current_df').copy()
+record_rows("ledger", len(df))
+period_list = get_period_list(df)
 
 if df.empty:
     st.warning("No data retrieved from the database.")
-    st.stop()
-
-REVENUE_CLASSES = ['Net Sales', 'Other Income']
+    stop_rerun()
+
+def dataset_derived(key, builder):
+    """Memoise `builder()` on this session's dataset version; `key` holds only the filter parameters."""
+    return brand_cache.derived(st.session_state.dataset_handle, key, builder)
+
+def ledger_search_index():
+    # Account/partner name index, shared by every session on the same dataset version
+    with span("search_index"):
+        return dataset_derived(
+            ('search',),
+            lambda: LedgerSearchIndex(df)
+        )
 
 # =============================
 # SIDEBAR NAVIGATION (ENHANCED UI ALIGNMENT)
@@ -693,7 +571,7 @@ with st.sidebar:
     # -----------------------------
     # NAVIGATION
     # -----------------------------
-    view_options = ["📈 Financial Insights", "✏️ Ledger Editor"]
+    view_options = ["📈 Financial Insights", "📉 Trend Explorer", "🔎 Anomaly Scan", "🏢 Group P&L", "✏️ Ledger Editor"]
     # Hide Budget vs Actual for WED
     if st.session_state.brand == "pra":
         view_options.append("💰 Budget vs Actual")
@@ -701,7 +579,8 @@ with st.sidebar:
     view_mode = st.radio(
         "Navigation",
         view_options,
-        label_visibility="collapsed"
+        label_visibility="collapsed",
+        key="view_mode"
     )
     st.markdown("<hr>", unsafe_allow_html=True)
 
@@ -711,14 +590,14 @@ with st.sidebar:
         date_range_type = st.radio(
             "Range Type",
             ["📅 Single/Multiple Months", "📆 Financial Year"],
-            horizontal=True
+            horizontal=True,
+            key="insights_range_type"
         )
 
         if date_range_type == "📅 Single/Multiple Months":
-            base_period = st.selectbox("Base Period", period_list)
-            num_comparisons = st.number_input("Previous Periods", min_value=0, max_value=12, value=3)
-            base_idx = period_list.index(base_period)
-            selected_periods = period_list[base_idx: min(base_idx + num_comparisons + 1, len(period_list))]
+            base_period = st.selectbox("Base Period", period_list, key="insights_base_period")
+            num_comparisons = st.number_input("Previous Periods", min_value=0, max_value=12, value=3, key="insights_num_comparisons")
+            selected_periods = select_periods(period_list, base_period, num_comparisons)
 
         else:
             available_years = sorted(df['Year'].dropna().unique(), reverse=True)
@@ -732,9 +611,48 @@ with st.sidebar:
 
         store_filter = st.selectbox(
             "🏢 Store",
-            ["All"] + sorted(df['Store'].dropna().astype(str).unique())
+            ["All"] + sorted(df['Store'].dropna().astype(str).unique()),
+            key="insights_store"
         )
 
+        compare_label = st.selectbox("Compare With", list(COMPARE_OPTIONS), key="insights_compare")
+        compare = COMPARE_OPTIONS[compare_label]
+
+    # 🔎 ANOMALY SCAN FILTERS
+    elif view_mode == "🔎 Anomaly Scan":
+        st.markdown("<h2>🔎 Scan Settings</h2>", unsafe_allow_html=True)
+        anomaly_z = st.number_input("Z-Score Threshold", min_value=1.0, max_value=10.0, value=3.0, step=0.5, key="anomaly_z")
+        anomaly_jump = st.number_input("MoM / YoY Jump (%)", min_value=10, max_value=1000, value=100, step=10, key="anomaly_jump")
+        anomaly_min_amount = st.number_input("Minimum Amount (₹)", min_value=0, value=10000, step=5000, key="anomaly_min_amount")
+        anomaly_store = st.selectbox("🏢 Store", ["All"] + sorted(df['Store'].dropna().astype(str).unique()), key="anomaly_store")
+        anomaly_class = st.selectbox("Class", ["All"] + sorted(df['classification'].dropna().astype(str).unique()), key="anomaly_class")
+
+    # 🏢 GROUP P&L FILTERS
+    elif view_mode == "🏢 Group P&L":
+        st.markdown("<h2>📊 Report Filters</h2>", unsafe_allow_html=True)
+        with st.spinner("Loading all brands..."), span("group_load"):
+            group_frames = load_group_frames()
+        group_periods_df = group_period_frame(group_frames)
+        group_period_list = get_period_list(group_periods_df)
+
+        group_range_type = st.radio(
+            "Range Type",
+            ["📅 Single/Multiple Months", "📆 Financial Year"],
+            horizontal=True,
+            key="group_range_type"
+        )
+        if group_range_type == "📅 Single/Multiple Months":
+            group_base_period = st.selectbox("Base Period", group_period_list, key="group_base_period")
+            group_num_comparisons = st.number_input("Previous Periods", min_value=0, max_value=12, value=0, key="group_num_comparisons")
+            group_periods = select_periods(group_period_list, group_base_period, group_num_comparisons)
+        else:
+            group_years = sorted(group_periods_df['Year'].dropna().unique(), reverse=True)
+            group_year = st.selectbox("Financial Year (Apr–Mar)", group_years, key="group_year")
+            group_fy_periods = get_financial_year_range(group_periods_df, group_year, start_month=4)
+            group_periods = [p['display'] for p in group_fy_periods]
+            if group_fy_periods:
+                st.info(f"{len(group_periods)} periods: {group_fy_periods[0]['display']} → {group_fy_periods[-1]['display']}")
+
     # ✏️ LEDGER EDITOR
     elif view_mode == "✏️ Ledger Editor":
 
@@ -785,10 +703,15 @@ with st.sidebar:
 
         if editor_selected_periods:
             editor_filtered_df = df[df['DisplayPeriod'].isin(editor_selected_periods)].copy()
+            record_rows("editor_period_filter", len(editor_filtered_df))
 
             if editor_store_filter != "All":
                 editor_filtered_df = editor_filtered_df[editor_filtered_df['Store'] == editor_store_filter]
 
+            editor_search = st.text_input("🔍 Search", key="editor_search", placeholder="Account or partner name")
+            if editor_search.strip():
+                editor_filtered_df = editor_filtered_df[editor_filtered_df.index.isin(ledger_search_index().row_labels(editor_search))]
+
             if not editor_filtered_df.empty:
                 editor_class = st.selectbox(
                     "Class",
@@ -819,11 +742,15 @@ with st.sidebar:
                         if editor_partner != "All":
                             editor_filtered_df = editor_filtered_df[editor_filtered_df['partner_id_name'] == editor_partner]
 
-            st.session_state.editor_filtered_df = editor_filtered_df
+            record_rows("editor_filtered", len(editor_filtered_df))
+            set_session_frame('editor_filtered_df', editor_filtered_df)
             st.session_state.editor_selected_periods = editor_selected_periods
             st.session_state.editor_store_filter = editor_store_filter
+            # Everything that selects editor_filtered_df out of the dataset, for keying its pivot
+            st.session_state.editor_filter_key = (tuple(editor_selected_periods), editor_store_filter, editor_search.strip()) + tuple(
+                st.session_state.get(key, "All") for key in ("editor_class", "editor_account", "editor_partner"))
         else:
-            st.session_state.editor_filtered_df = pd.DataFrame()
+            set_session_frame('editor_filtered_df', pd.DataFrame())
             st.session_state.editor_selected_periods = []
             st.warning("No periods selected.")
 
@@ -844,12 +771,173 @@ with st.sidebar:
         st.session_state.logged_in_user = ""
         st.query_params.clear()
         st.cache_data.clear()
+        brand_cache.invalidate()
+        session_frames.drop(current_session_id())
         st.rerun()
 
+    debug_panel_slot = st.empty()
+
 # =============================
 # MAIN CONTENT
 # =============================
 st.markdown(f'<div class="main-header">💠 {view_mode.split(" ", 1)[1]}</div>', unsafe_allow_html=True)
+instrumentation.set_context(view_mode=view_mode)
+
+# =============================
+# FLAT FILE EXPORTS
+# =============================
+def flat_export_popover(key, exports):
+    """
+    CSV / Parquet downloads for analysts. Each file is only generated when its button
+    is clicked, streamed to a temporary file in chunks.
+
+    :param exports: list of (button label, file name stem, frame builder)
+    """
+    with st.popover("⬇️ CSV", width='stretch'):
+        fmt = st.radio("Format", export_formats(), horizontal=True, key=f"{key}_format", format_func=str.upper)
+        for i, (label, stem, build_frame) in enumerate(exports):
+            st.download_button(
+                label=label,
+                data=lambda build_frame=build_frame, fmt=fmt: export_file(build_frame(), fmt),
+                file_name=f"{stem}_{datetime.now().strftime('%Y%m%d')}.{fmt}",
+                mime=EXPORT_FORMATS[fmt],
+                key=f"{key}_{i}",
+                on_click="ignore",
+                width='stretch'
+            )
+
+# =============================
+# SAVING EDITS
+# =============================
+def harvest_editor_edits(edits, editor_df):
+    """
+    Fold the last rendered editor page's edits into `edits`, keyed by ledger cell:
+    {(store, classification, account, partner, period): {'new_value', 'old_value'}}.
+    """
+    widget_key = st.session_state.get('editor_widget_key')
+    widget_state = st.session_state.get(widget_key) if widget_key else None
+    row_keys = st.session_state.get('editor_page_keys', [])
+    if not widget_state:
+        return
+    harvested = []
+    for row_idx, changed_cols in widget_state.get("edited_rows", {}).items():
+        if row_idx >= len(row_keys):
+            continue
+        for period, new_val in changed_cols.items():
+            if period in EDITOR_DIMENSIONS or period == 'Total':
+                continue
+            try:
+                value = float(str(new_val).replace(',', '').replace('₹', ''))
+            except ValueError:
+                continue
+            cell = tuple(row_keys[row_idx]) + (period,)
+            if cell in edits:
+                edits[cell]['new_value'] = value
+            else:
+                harvested.append((cell, value))
+    if harvested:
+        # Remember the cell values the edits replace, so other views can preview them as deltas
+        changes = [{'store': c[0], 'classification': c[1], 'account': c[2], 'partner': c[3], 'period': c[4]} for c, _ in harvested]
+        for (cell, value), old_value in zip(harvested, ledger_cell_values(editor_df, changes)):
+            edits[cell] = {'new_value': value, 'old_value': old_value}
+
+def journal_changes(changes, base_stamps=None, checked=True):
+    """
+    Stamp `changes` and write them to the edit journal for the background drainer.
+
+    :param base_stamps: per change, the cell's `last_modified_at` the edit was made against
+    :param checked: False if Fabric couldn't be read to check for conflicting edits first
+    """
+    if not changes:
+        return
+    modified_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    user = st.session_state.get('logged_in_user', 'Unknown')
+    for change in changes:
+        change['last_modified_at'], change['last_modified_user'] = modified_at, user
+    # Journal first; the drainer sends in the background and retries until Fabric accepts each row
+    st.session_state.last_save_batch = edit_journal.enqueue(
+        st.session_state.brand, user, [build_upsert_variables(c, modified_at, user) for c in changes], base_stamps, checked)
+    edit_drainer.wake()
+
+def save_changes(changes):
+    """
+    Save `changes` as one journal batch. Cells changed on the server since this load are
+    held back in `save_conflicts` and take the server's value locally. If Fabric can't be
+    read, everything is journaled unchecked and the drainer checks before sending.
+    """
+    with span("save", changes=len(changes)):
+        # This user's unsent edits already re-stamped their cells locally, while Fabric still
+        # has the stamps they were made against
+        unsent = edit_journal.unsent_base_stamps(st.session_state.brand, st.session_state.get('logged_in_user', 'Unknown'))
+        loaded = session_frame('current_df')
+        base_stamps = {change_key(c): stamp for c, stamp in zip(changes, ledger_cell_stamps(loaded, changes))}
+        base_stamps.update((key, stamp) for key, stamp in unsent.items() if key in base_stamps)
+
+        # Only the edited cells are re-read, to catch edits made elsewhere since this load
+        try:
+            server_cells = fetch_cells(st.session_state.brand, changes)
+        except Exception as e:
+            # An outage must not lose the save: the drainer runs the same check once Fabric answers
+            journal_changes(changes, [base_stamps[change_key(c)] for c in changes], checked=False)
+            apply_saved_changes(changes)
+            st.session_state.save_conflicts = []
+            st.session_state.unchecked_save_error = str(e)
+            return
+        conflicts = detect_conflicts(loaded, server_cells, changes, loaded_stamps=base_stamps)
+        conflict_keys = {change_key(c) for c in conflicts}
+        to_save = [c for c in changes if change_key(c) not in conflict_keys]
+        journal_changes(to_save, [base_stamps[change_key(c)] for c in to_save])
+
+        # Conflicting cells take the server's value locally and wait for the user's decision
+        refreshed = [server_change(c) for c in conflicts]
+        apply_saved_changes(to_save, refreshed)
+        st.session_state.save_conflicts = conflicts
+
+def apply_saved_changes(saved, refreshed=()):
+    """
+    Show a save in this session. `refreshed` (cells as Fabric holds them) goes into the
+    shared cached dataset; the journaled `saved` edits stay with this user's sessions
+    until the drainer has sent them.
+    """
+    brand = st.session_state.brand
+    if refreshed:
+        brand_cache.apply_changes(brand, list(refreshed))
+    if brand_cache.handle(brand) is not None:
+        load_session_frames(brand)
+        return
+    # The shared copy was evicted meanwhile; patch this session's frames rather than refetch mid-save
+    patched_df, _ = brand_cache.local_version(None, session_frame('current_df'), list(saved) + list(refreshed))
+    set_session_frame('original_df', patched_df.copy())
+    set_session_frame('current_df', patched_df.copy())
+    st.session_state.dataset_handle = None
+
+# =============================
+# PENDING EDIT PREVIEW
+# =============================
+def pending_changes():
+    if st.session_state.get("pending_changes_brand") != st.session_state.brand:
+        return []
+    return st.session_state.get("pending_changes", [])
+
+def previewing_pending_edits():
+    return bool(pending_changes()) and st.session_state.get("preview_pending_edits", False)
+
+def with_pending_edits(hierarchy):
+    """A copy of `hierarchy` with unsaved Ledger Editor edits applied as O(depth) deltas."""
+    if not previewing_pending_edits():
+        return hierarchy
+    changes = pending_changes()
+    preview = copy.deepcopy(hierarchy)
+    for change in changes:
+        apply_ledger_delta(preview, change['store'], change['classification'], change['account'],
+                           change['partner'], change['period'], change['new_value'] - change.get('old_value', 0.0))
+    return preview
+
+def view_derived(key, builder):
+    """`dataset_derived` for renders and exports of a hierarchy, which stay private to the session while it previews unsaved edits."""
+    if previewing_pending_edits():
+        return builder()
+    return dataset_derived(key, builder)
 
 # =============================
 # FINANCIAL INSIGHTS VIEW
@@ -857,545 +945,764 @@ st.markdown(f'<div class="main-header">💠 {view_mode.split(" ", 1)[1]}</div>',
 if view_mode == "📈 Financial Insights":
     if not selected_periods:
         st.info("ℹ️ No periods selected or available.")
-        st.stop()
+        stop_rerun()
+
+    insights_key = (tuple(selected_periods), store_filter)
+    # Periods the cube must cover: the selection plus the reference periods of the comparison
+    cube_periods = list(selected_periods)
+    if compare:
+        cube_periods += [p for p in comparison_periods(selected_periods, compare) if p not in cube_periods]
+
+    def ledger_cube():
+        # Classification/account/partner/store/period sums shared by both hierarchies: the whole
+        # dataset summed locally, or just the periods needed and the store summed by Fabric
+        with span("aggregation_cube"):
+            if SERVER_AGGREGATES:
+                return dataset_derived(
+                    ('server_cube', tuple(cube_periods), store_filter),
+                    lambda: load_report_cube(st.session_state.brand, cube_periods, store_filter, df)
+                )
+            return dataset_derived(
+                ('cube',),
+                lambda: build_aggregation_cube(df)
+            )
 
-    report_df = df[df['DisplayPeriod'].isin(selected_periods)].copy()
-    if store_filter != "All": report_df = report_df[report_df['Store'] == store_filter]
+    with span("filter"):
+        if SERVER_AGGREGATES:
+            # KPIs and the chart only need classification totals per period, which the cube rows carry
+            report_df = ledger_cube().reset_index()
+            if compare:
+                report_df = report_df[report_df['DisplayPeriod'].isin(selected_periods)]
+        else:
+            report_df = select_report_frame(df, selected_periods, store_filter)
+    record_rows("report_filtered", len(report_df))
+    instrumentation.set_context(periods=len(selected_periods), store_filter=store_filter)
 
     if report_df.empty:
         st.info("ℹ️ No data available for the selected filters.")
-        st.stop()
-
-    # --- KPI CARDS ---
-    latest_period = selected_periods[0]
-    latest_data = report_df[report_df['DisplayPeriod'] == latest_period]
-    total_revenue = latest_data[latest_data['classification'].isin(REVENUE_CLASSES)]['Balance'].sum()
-    total_expenses = latest_data[~latest_data['classification'].isin(REVENUE_CLASSES)]['Balance'].sum()
-    net_profit = total_revenue - total_expenses
-    profit_margin = (net_profit / total_revenue * 100) if total_revenue != 0 else 0
-
-    cols = st.columns(4)
-    kpi_configs = [
-        (cols[0], "bg-revenue", "REVENUE", fmt_currency(total_revenue), f"{abs((total_expenses/total_revenue*100) if total_revenue!=0 else 0):.1f}% OPEX"),
-        (cols[1], "bg-expense", "EXPENSES", fmt_currency(total_expenses), f"{abs((total_expenses/total_revenue*100) if total_revenue!=0 else 0):.1f}% of Rev"),
-        (cols[2], "bg-profit", "NET PROFIT", fmt_currency(net_profit), f"{abs((total_expenses/total_revenue*100) if total_revenue!=0 else 0):.1f}% Margin"),
-        (cols[3], "bg-margin", "MARGIN", f"{profit_margin:.1f}%", f"{latest_period[:3]}")
-    ]
-    for col, bg_class, title, value, sub in kpi_configs:
-        col.markdown(f"""
-        <div class="kpi-container {bg_class}">
-            <div class="kpi-title">{title}</div>
-            <div class="kpi-value">{value}</div>
-            <div><span class="kpi-sub">{sub}</span></div>
-        </div>
-        """, unsafe_allow_html=True)
-
-    st.write("<br>", unsafe_allow_html=True)
+        stop_rerun()
+    if pending_changes():
+        st.toggle(f"Include {len(pending_changes())} unsaved Ledger Editor edit(s)", key="preview_pending_edits")
+    search_query = st.text_input("🔍 Search accounts and partners", key="insights_search",
+                                 placeholder="Type part of an account or partner name").strip()
+
+    def searched(hierarchy):
+        # Only the nodes matching the search, expanded; exports keep the full statement
+        if not search_query:
+            return hierarchy
+        with span("search", query_len=len(search_query)):
+            return search_hierarchy(hierarchy, ledger_search_index().search(search_query, limit=None))
+
+    @panel_fragment("insights")
+    def insights_panel(report_df, selected_periods, store_filter, insights_key, search_query, compare):
+        # --- KPI CARDS ---
+        latest_period = selected_periods[0]
+        latest_data = report_df[report_df['DisplayPeriod'] == latest_period]
+        total_revenue = total_balance(latest_data[latest_data['classification'].isin(REVENUE_CLASSES)])
+        total_expenses = total_balance(latest_data[~latest_data['classification'].isin(REVENUE_CLASSES)])
+        net_profit = add_balances(total_revenue, -total_expenses)
+        profit_margin = (net_profit / total_revenue * 100) if total_revenue != 0 else 0
+
+        cols = st.columns(4)
+        kpi_configs = [
+            (cols[0], "bg-revenue", "REVENUE", fmt_currency(total_revenue), f"{abs((total_expenses/total_revenue*100) if total_revenue!=0 else 0):.1f}% OPEX"),
+            (cols[1], "bg-expense", "EXPENSES", fmt_currency(total_expenses), f"{abs((total_expenses/total_revenue*100) if total_revenue!=0 else 0):.1f}% of Rev"),
+            (cols[2], "bg-profit", "NET PROFIT", fmt_currency(net_profit), f"{abs((total_expenses/total_revenue*100) if total_revenue!=0 else 0):.1f}% Margin"),
+            (cols[3], "bg-margin", "MARGIN", f"{profit_margin:.1f}%", f"{latest_period[:3]}")
+        ]
+        for col, bg_class, title, value, sub in kpi_configs:
+            col.markdown(f"""
+            <div class="kpi-container {bg_class}">
+                <div class="kpi-title">{title}</div>
+                <div class="kpi-value">{value}</div>
+                <div><span class="kpi-sub">{sub}</span></div>
+            </div>
+            """, unsafe_allow_html=True)
 
-    # --- CHART ---
-    profit_df = calculate_profit_metrics(report_df, selected_periods, REVENUE_CLASSES)
-    fig = go.Figure()
-    fig.add_trace(go.Bar(x=profit_df['DisplayPeriod'], y=profit_df['Revenue'], name='Revenue', marker_color='#0AB370', opacity=0.8))
-    fig.add_trace(go.Bar(x=profit_df['DisplayPeriod'], y=profit_df['Expenses'], name='Expenses', marker_color='#F43F5E', opacity=0.8))
-    fig.add_trace(go.Scatter(x=profit_df['DisplayPeriod'], y=profit_df['Profit'], mode='lines+markers', name='Net Profit', line=dict(color='#2563EB', width=3, shape='spline'), marker=dict(size=8, color='#1D4ED8'), yaxis='y'))
-    fig.update_layout(title=dict(text='<b>Revenue, Expenses & Net Profit</b>', font=dict(size=18, color='#0F2044')), barmode='group', plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', margin=dict(l=40, r=40, t=50, b=40), yaxis=dict(gridcolor='#E2E8F0', title='Amount (₹)', tickformat='₹,.0f'), xaxis=dict(showline=True, linecolor='#CBD5E1', tickfont=dict(size=10)), hovermode='x unified', legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1, bgcolor='rgba(255,255,255,0.9)', font=dict(size=10)))
-    st.plotly_chart(fig, width='stretch')
+        st.write("<br>", unsafe_allow_html=True)
 
-    st.markdown("---")
-    
-    hierarchy = build_hierarchy_data(report_df, selected_periods)
-
-    col1, col2 = st.columns([3, 2])
-    with col1:
-        st.markdown("### 📋 P&L Statement")
-    with col2:
-        export_col1, export_col2, export_col3 = st.columns([1, 1, 1])
-        with export_col1:
-            if st.button("⊞ Expand All", key="pnl_expand_btn", width='stretch'):
-                st.session_state.expand_pnl = True  
-                st.rerun()
-        with export_col2:
-            if st.button("Collapse All", key="pnl_collapse_btn", width='stretch'):
-                st.session_state.expand_pnl = False 
-                st.rerun()
-        with export_col3:
-            brand_name = reverse_brand_map.get(st.session_state.brand, "Unknown")
-
-            excel_file = build_excel_report(
-                hierarchy=hierarchy, 
-                periods=selected_periods, 
-                store_filter=store_filter,
-                brand=st.session_state.brand,
-                expand_all=st.session_state.get('expand_pnl', False),
-                open_classifications=st.session_state.open_classifications,
-                open_accounts=st.session_state.open_accounts
+        # --- CHART ---
+        with span("profit_metrics"):
+            profit_df = dataset_derived(
+                ('profit',) + insights_key,
+                lambda: calculate_profit_metrics(report_df, selected_periods, REVENUE_CLASSES)
             )
+        with span("chart"):
+            fig = go.Figure()
+            fig.add_trace(go.Bar(x=profit_df['DisplayPeriod'], y=profit_df['Revenue'], name='Revenue', marker_color='#0AB370', opacity=0.8))
+            fig.add_trace(go.Bar(x=profit_df['DisplayPeriod'], y=profit_df['Expenses'], name='Expenses', marker_color='#F43F5E', opacity=0.8))
+            fig.add_trace(go.Scatter(x=profit_df['DisplayPeriod'], y=profit_df['Profit'], mode='lines+markers', name='Net Profit', line=dict(color='#2563EB', width=3, shape='spline'), marker=dict(size=8, color='#1D4ED8'), yaxis='y'))
+            fig.update_layout(title=dict(text='<b>Revenue, Expenses & Net Profit</b>', font=dict(size=18, color='#0F2044')), barmode='group', plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', margin=dict(l=40, r=40, t=50, b=40), yaxis=dict(gridcolor='#E2E8F0', title='Amount (₹)', tickformat='₹,.0f'), xaxis=dict(showline=True, linecolor='#CBD5E1', tickfont=dict(size=10)), hovermode='x unified', legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1, bgcolor='rgba(255,255,255,0.9)', font=dict(size=10)))
+            st.plotly_chart(fig, width='stretch')
+
+        st.markdown("---")
+
+        with span("hierarchy_pnl"):
+            hierarchy = dataset_derived(
+                ('pnl',) + insights_key + (compare,),
+                lambda: hierarchy_from_cube(ledger_cube(), selected_periods, periods=selected_periods, store_filter=store_filter,
+                                            scope={'periods': selected_periods, 'store': store_filter}, compare=compare)
+            )
+        hierarchy = with_pending_edits(hierarchy)
+
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            st.markdown("### 📋 P&L Statement")
+        with col2:
+            export_col1, export_col2, export_col3, export_col4 = st.columns([1, 1, 1, 1])
+            with export_col1:
+                if st.button("⊞ Expand All", key="pnl_expand_btn", width='stretch'):
+                    st.session_state.expand_pnl = True
+            with export_col2:
+                if st.button("Collapse All", key="pnl_collapse_btn", width='stretch'):
+                    st.session_state.expand_pnl = False
+            with export_col3:
+                brand_name = reverse_brand_map.get(st.session_state.brand, "Unknown")
+
+                with span("excel_pnl"):
+                    expand_pnl = st.session_state.get('expand_pnl', False)
+                    excel_file = view_derived(
+                        ('excel_pnl',) + insights_key + (compare, expand_pnl, tuple(sorted(st.session_state.open_classifications)),
+                                                         tuple(sorted(st.session_state.open_accounts))),
+                        lambda: build_excel_report(
+                            hierarchy=hierarchy, 
+                            periods=selected_periods, 
+                            store_filter=store_filter,
+                            brand=st.session_state.brand,
+                            expand_all=expand_pnl,
+                            open_classifications=st.session_state.open_classifications,
+                            open_accounts=st.session_state.open_accounts
+                        ).getvalue()
+                    )
             
-            st.download_button(
-                label="📥 Export",
-                data=excel_file,
-                file_name=f"{brand_name}_PnL_Statement_{store_filter}_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                type="primary",
-                key="pnl_export_main_btn", 
-                use_container_width=True
+                st.download_button(
+                    label="📥 Export",
+                    data=excel_file,
+                    file_name=f"{brand_name}_PnL_Statement_{store_filter}_{datetime.now().strftime('%Y%m%d')}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    type="primary",
+                    key="pnl_export_main_btn", 
+                    use_container_width=True
+                )
+            with export_col4:
+                flat_export_popover("pnl_flat", [
+                    ("P&L totals", f"{brand_name}_PnL_Totals_{store_filter}", lambda: hierarchy_export_frame(hierarchy)),
+                    ("GL rows", f"{brand_name}_GL_Rows_{store_filter}",
+                     lambda: ledger_export_frame(select_report_frame(df, selected_periods, store_filter)))
+                ])
+
+        # ==========================================
+        # HIGH-PERFORMANCE HTML/CSS GRID TABLE
+        # ==========================================
+        with span("html_pnl"):
+            focus = st.session_state.get('insights_focus')
+            focus = focus[:3] + focus[4:] if focus else None
+            expand_all = bool(search_query) or st.session_state.get('expand_pnl', False)
+            st.markdown(view_derived(
+                ('html_pnl',) + insights_key + (compare, search_query, expand_all, focus),
+                lambda: render_pnl_html(searched(hierarchy), selected_periods, expand_all=expand_all, focus=focus)
+            ), unsafe_allow_html=True)
+        st.write("<br>", unsafe_allow_html=True)
+        st.markdown("---")
+
+    @panel_fragment("store_comparison")
+    def store_comparison_panel(selected_periods, store_filter, insights_key, search_query):
+        # 1. Prepare Data for Store Comparison
+        # Full FY (12 months) aggregates every month per store, otherwise only the base period.
+        # Both come straight off the shared cube, with no re-filtered copy of the ledger rows.
+        comp_periods, display_period_label = store_comparison_periods(selected_periods)
+        with span("hierarchy_store"):
+            store_hierarchy = dataset_derived(
+                ('store',) + insights_key,
+                lambda: hierarchy_from_cube(ledger_cube(), group_by='Store', periods=comp_periods, store_filter=store_filter,
+                                            scope={'periods': comp_periods, 'store': store_filter})
             )
+        relevant_stores = list(store_hierarchy.columns)
+        store_hierarchy = with_pending_edits(store_hierarchy)
+
+        # 2. UI Header & Independent Buttons
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            st.markdown(f"### 🏪 Store Comparison ({display_period_label})")
+        with col2:
+            s_exp1, s_exp2, s_exp3, s_exp4 = st.columns([1, 1, 1, 1])
+            with s_exp1:
+                if st.button("⊞ Expand All", key="btn_store_expand", width='stretch'):
+                    st.session_state.expand_store = True
+            with s_exp2:
+                if st.button("Collapse All", key="btn_store_collapse", width='stretch'):
+                    st.session_state.expand_store = False
+            with s_exp3:
+                brand_name = reverse_brand_map.get(st.session_state.brand, "Unknown")
+
+                with span("excel_store"):
+                    expand_store = st.session_state.get('expand_store', False)
+                    store_excel = view_derived(
+                        ('excel_store',) + insights_key + (expand_store,),
+                        lambda: build_excel_report(
+                            hierarchy=store_hierarchy, 
+                            periods=relevant_stores, 
+                            store_filter="Comparison", 
+                            report_type="store",
+                            expand_all=expand_store
+                        ).getvalue()
+                    )
+                st.download_button(
+                    label="📥 Export",
+                    type="primary",
+                    data=store_excel,
+                    file_name=f"{brand_name}_Store_Comparison_{display_period_label}_{datetime.now().strftime('%Y%m%d')}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key="btn_store_export",
+                    use_container_width=True
+                )
+            with s_exp4:
+                flat_export_popover("store_flat", [
+                    ("Store totals", f"{brand_name}_Store_Totals_{display_period_label}", lambda: hierarchy_export_frame(store_hierarchy)),
+                    ("GL rows", f"{brand_name}_GL_Rows_{display_period_label}",
+                     lambda: ledger_export_frame(select_report_frame(df, comp_periods, store_filter)))
+                ])
+
+        # 3. Render Table with Independent State
+        with span("html_store"):
+            focus = st.session_state.get('insights_focus')
+            focus = focus[:4] if focus and focus[4] in comp_periods else None
+            expand_all = bool(search_query) or st.session_state.expand_store
+            st.markdown(view_derived(
+                ('html_store',) + insights_key + (search_query, expand_all, focus),
+                lambda: render_store_html(searched(store_hierarchy), relevant_stores, expand_all=expand_all, focus=focus)
+            ), unsafe_allow_html=True)
+
+    insights_panel(report_df, selected_periods, store_filter, insights_key, search_query, compare)
+    store_comparison_panel(selected_periods, store_filter, insights_key, search_query)
 
-    # ==========================================
-    # HIGH-PERFORMANCE HTML/CSS GRID TABLE
-    # ==========================================
-    num_periods = len(selected_periods)
-    grid_template = f"350px repeat({num_periods}, minmax(130px, 1fr)) minmax(140px, 1fr)"
+# ===========================
+# TREND EXPLORER VIEW
+# ===========================
+elif view_mode == "📉 Trend Explorer":
+    # Rolling, YTD and margin series for the whole history are built once per dataset
+    with span("trend_metrics"):
+        trends = dataset_derived(
+            ('trends',),
+            lambda: build_trend_data(df)
+        )
+    if not trends['store']:
+        st.info("ℹ️ No dated ledger rows to chart.")
+        stop_rerun()
+
+    @panel_fragment("trends")
+    def trend_panel(trends):
+        st.markdown("### 📉 Trend Explorer")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            dimension = st.radio("Series", ["Store", "Classification"], horizontal=True, key="trend_dimension")
+        metrics = trends['store'] if dimension == "Store" else trends['classification']
+        with col2:
+            metric = st.selectbox("Metric", list(metrics), key=f"trend_metric_{dimension}")
+        with col3:
+            transform = st.selectbox("View", TREND_TRANSFORMS, key="trend_transform")
+
+        frame = metrics[metric][transform]
+        columns = [str(c) for c in frame.columns]
+        default = [c for c in columns if c != ALL_STORES_SERIES] if dimension == "Store" else columns
+        series = st.multiselect(dimension, columns, default=default, key=f"trend_series_{dimension}")
+
+        years = sorted(frame.index.year.unique().tolist())
+        if len(years) > 1:
+            first_year, last_year = st.select_slider("Years", options=years, value=(years[0], years[-1]), key="trend_years")
+            frame = frame[(frame.index.year >= first_year) & (frame.index.year <= last_year)]
+
+        if not series:
+            st.info("ℹ️ Select at least one series to chart.")
+            return
+
+        # Scattergl draws through WebGL, which stays responsive with dozens of lines over many years
+        with span("trend_chart", series=len(series), points=len(frame) * len(series)):
+            fig = go.Figure()
+            for name in series:
+                fig.add_trace(go.Scattergl(x=frame.index, y=frame[name].to_numpy(), mode='lines', name=name))
+            is_margin = metric == 'Margin %'
+            fig.update_layout(title=dict(text=f'<b>{metric} · {transform}</b>', font=dict(size=18, color='#0F2044')), plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', margin=dict(l=40, r=40, t=50, b=40), height=560, yaxis=dict(gridcolor='#E2E8F0', title='Margin (%)' if is_margin else 'Amount (₹)', tickformat=',.1f' if is_margin else '₹,.0f'), xaxis=dict(showline=True, linecolor='#CBD5E1', tickfont=dict(size=10)), hovermode='closest', legend=dict(font=dict(size=10)))
+            st.plotly_chart(fig, width='stretch')
+
+    trend_panel(trends)
 
-    pnl_open_attr = "open" if st.session_state.expand_pnl else ""
-    
-    html_parts = []
-    html_parts.append(f"""
-    <style>
-    .pnl-container {{ width: 100%; overflow-x: auto; border: 1px solid #CBD5E1; border-radius: 8px; background: #FFFFFF; padding-bottom: 10px; }}
-    .pnl-table-wrapper {{ min-width: 100%; width: max-content; display: flex; flex-direction: column; }}
-    .pnl-row {{ 
-        display: grid; 
-        grid-template-columns: {grid_template}; 
-        border-bottom: 1px solid #E2E8F0; 
-        align-items: center; 
-        transition: background 0.2s; 
-        width: 100%;
-        background-color: inherit;
-    }}
-    .pnl-row:hover {{ background-color: #F8FAFC; }}
-    .pnl-header {{ background-color: #0F2044 !important; color: white; font-weight: bold; position: sticky; top: 0; z-index: 10; font-size: 12px; letter-spacing: 0.5px; }}
-    .pnl-cell {{ padding: 10px 12px; white-space: nowrap; font-size: 13px; }}
-    .pnl-cell:first-child {{ 
-        position: sticky; 
-        left: 0; 
-        background-color: inherit; 
-        z-index: 5; 
-        border-right: 1px solid #E2E8F0; 
-        overflow: hidden;
-        text-overflow: ellipsis;
-        white-space: nowrap;
-    }}
-    .pnl-header .pnl-cell:first-child {{ background-color: #0F2044; z-index: 15; }}
-    .align-right {{ text-align: right; }}
-    .val-pos {{ color: #059669; font-weight: 600; font-family: 'DM Mono', monospace; }}
-    .val-neg {{ color: #E11D48; font-weight: 600; font-family: 'DM Mono', monospace; }}
-    .val-tot {{ color: #0F2044; font-weight: 800; font-family: 'DM Mono', monospace; background: #EEF2F9; border-radius: 4px; padding: 3px 6px; display: inline-block; }}
-    .lvl-1 {{ font-weight: 700; color: #0F2044; background: #F1F5F9; cursor: pointer; }}
-    .lvl-2 {{ font-weight: 600; color: #334155; background: #FFFFFF; cursor: pointer; }}
-    .lvl-3 {{ color: #64748B; background: #FFFFFF; }}
-    details > summary {{ list-style: none; outline: none; }}
-    details > summary::-webkit-details-marker {{ display: none; }}
-    .arrow {{ display: inline-block; width: 18px; font-size: 11px; transition: transform 0.2s; color: #64748B; margin-right: 4px; }}
-    details[open] > summary .arrow {{ transform: rotate(90deg); color: #0F2044; }}
-    </style>
-    
-    <div class='pnl-container'>
-        <div class='pnl-table-wrapper'>
-    """)
-
-    html_parts.append("<div class='pnl-row pnl-header'>")
-    html_parts.append("<div class='pnl-cell'>PARTICULARS</div>")
-    for p in selected_periods:
-        short_p = p[:3] + " " + p[-2:]
-        html_parts.append(f"<div class='pnl-cell align-right'>{short_p.upper()}</div>")
-    html_parts.append("<div class='pnl-cell align-right'>TOTAL</div></div>")
-
-    # FIX: Use pnl specific state
-    pnl_open_attr = "open" if st.session_state.get('expand_pnl', False) else ""
-
-    for cls_name, cls_data in hierarchy.items():
-        html_parts.append(f"<details {pnl_open_attr}><summary class='pnl-row lvl-1'>")
-        html_parts.append(f"<div class='pnl-cell' title='{cls_name.upper()}'><span class='arrow'>▶</span> 📂 {cls_name.upper()}</div>")
-        for p in selected_periods:
-            v = cls_data['totals'].get(p, 0)
-            color_cls = "val-pos" if v >= 0 else "val-neg"
-            html_parts.append(f"<div class='pnl-cell align-right {color_cls}'>{fmt_currency(v)}</div>")
-        
-        cls_tot = sum(cls_data['totals'].values())
-        html_parts.append(f"<div class='pnl-cell align-right'><span class='val-tot'>{fmt_currency(cls_tot)}</span></div>")
-        html_parts.append("</summary>")
-
-        for acc_name, acc_data in cls_data['accounts'].items():
-            html_parts.append(f"<details {pnl_open_attr}><summary class='pnl-row lvl-2'>")
-            html_parts.append(f"<div class='pnl-cell' title='{acc_name}' style='padding-left: 28px;'><span class='arrow'>▶</span> 📄 {acc_name}</div>")
-            for p in selected_periods:
-                v = acc_data['totals'].get(p, 0)
-                color_cls = "val-pos" if v >= 0 else "val-neg"
-                html_parts.append(f"<div class='pnl-cell align-right {color_cls}'>{fmt_currency(v)}</div>")
-            
-            acc_tot = sum(acc_data['totals'].values())
-            color_cls = "val-pos" if acc_tot >= 0 else "val-neg"
-            html_parts.append(f"<div class='pnl-cell align-right {color_cls}' style='font-weight: 800;'>{fmt_currency(acc_tot)}</div>")
-            html_parts.append("</summary>")
-
-            for partner_name, prt_totals in acc_data['partners'].items():
-                html_parts.append("<div class='pnl-row lvl-3'>")
-                html_parts.append(f"<div class='pnl-cell' title='{partner_name}' style='padding-left: 65px;'>• {partner_name}</div>")
-                for p in selected_periods:
-                    v = prt_totals.get(p, 0)
-                    color_cls = "val-pos" if v >= 0 else "val-neg"
-                    html_parts.append(f"<div class='pnl-cell align-right {color_cls}'>{fmt_currency(v)}</div>")
-                
-                prt_tot = sum(prt_totals.values())
-                color_cls = "val-pos" if prt_tot >= 0 else "val-neg"
-                html_parts.append(f"<div class='pnl-cell align-right {color_cls}'>{fmt_currency(prt_tot)}</div>")
-                html_parts.append("</div>")
-
-            html_parts.append("</details>") 
-        html_parts.append("</details>") 
-
-    html_parts.append("</div></div>") 
-    st.markdown("".join(html_parts), unsafe_allow_html=True)
-    st.write("<br>", unsafe_allow_html=True)
-    st.markdown("---")
-
-    # 1. Prepare Data for Store Comparison
-    # Check if a full year is selected (Assuming 12 months = Full FY)
-    is_full_fy = len(selected_periods) >= 12 
-
-    if is_full_fy:
-        # IF FULL FY: Use all data (this aggregates all 12 months per store)
-        comp_df = report_df.copy()
-        display_period_label = "Financial Year"
-    else:
-        # ELSE: Use only the first selected month (Base Period)
-        base_period = selected_periods[0]
-        comp_df = report_df[report_df['DisplayPeriod'] == base_period].copy()
-        display_period_label = base_period
-
-    relevant_stores = sorted(comp_df['Store'].unique().tolist())
-    store_hierarchy = build_hierarchy_data(comp_df, relevant_stores, group_by='Store')
-
-    # 2. UI Header & Independent Buttons
-    col1, col2 = st.columns([3, 2])
-    with col1:
-        st.markdown(f"### 🏪 Store Comparison ({display_period_label})")
-    with col2:
-        s_exp1, s_exp2, s_exp3 = st.columns([1, 1, 1])
-        with s_exp1:
-            if st.button("⊞ Expand All", key="btn_store_expand", width='stretch'):
-                st.session_state.expand_store = True
+# ===========================
+# ANOMALY SCAN VIEW
+# ===========================
+elif view_mode == "🔎 Anomaly Scan":
+    # One vectorised pass over every series' full history; rescanned whenever the dataset changes
+    with span("anomaly_scan"):
+        anomalies = dataset_derived(
+            ('anomalies', anomaly_z, anomaly_jump, anomaly_min_amount),
+            lambda: scan_anomalies(df, z_threshold=anomaly_z, jump_threshold=anomaly_jump / 100, min_amount=anomaly_min_amount)
+        )
+    if anomaly_store != "All":
+        anomalies = anomalies[anomalies['Store'] == anomaly_store]
+    if anomaly_class != "All":
+        anomalies = anomalies[anomalies['classification'] == anomaly_class]
+    record_rows("anomalies", len(anomalies))
+
+    if anomalies.empty:
+        st.info("ℹ️ No anomalies found with the current settings.")
+        stop_rerun()
+
+    def open_anomaly(row, target):
+        # Runs before the next rerun, so the sidebar widgets pick these values up
+        partner = row['partner_id_name'] if pd.notna(row['partner_id_name']) else "All"
+        account = row['account_name'] if pd.notna(row['account_name']) else "All"
+        if target == "insights":
+            st.session_state.view_mode = "📈 Financial Insights"
+            st.session_state.insights_range_type = "📅 Single/Multiple Months"
+            st.session_state.insights_base_period = row['DisplayPeriod']
+            st.session_state.insights_store = row['Store']
+            st.session_state.insights_focus = (row['classification'], row['account_name'], row['partner_id_name'],
+                                               row['Store'], row['DisplayPeriod'])
+        else:
+            st.session_state.view_mode = "✏️ Ledger Editor"
+            st.session_state.editor_range_type = "📅 Single/Multiple Months"
+            st.session_state.editor_base_period = row['DisplayPeriod']
+            st.session_state.editor_store = row['Store']
+            st.session_state.editor_class = row['classification']
+            st.session_state.editor_account = account
+            st.session_state.editor_partner = partner
+
+    @panel_fragment("anomalies")
+    def anomaly_panel(anomalies):
+        st.markdown("### 🔎 Anomaly Scan")
+        cols = st.columns(3)
+        cols[0].metric("Flagged Cells", f"{len(anomalies):,}")
+        cols[1].metric("Series Affected", f"{len(anomalies.drop_duplicates(subset=['Store', 'classification', 'account_name', 'partner_id_name'])):,}")
+        cols[2].metric("Largest Impact", fmt_currency(anomalies['Impact'].iloc[0]))
+
+        shown = anomalies.head(500)
+        event = st.dataframe(
+            shown.drop(columns=['PeriodSort']),
+            hide_index=True,
+            width='stretch',
+            height=480,
+            on_select="rerun",
+            selection_mode="single-row",
+            key="anomaly_table",
+            column_config={
+                'Store': st.column_config.TextColumn("Store"),
+                'classification': st.column_config.TextColumn("Class"),
+                'account_name': st.column_config.TextColumn("Account"),
+                'partner_id_name': st.column_config.TextColumn("Partner"),
+                'DisplayPeriod': st.column_config.TextColumn("Period"),
+                **{c: st.column_config.NumberColumn(c, format="₹%.0f") for c in ['Balance', 'Expected', 'MoM', 'YoY', 'Impact']},
+                'Z-Score': st.column_config.NumberColumn("Z-Score", format="%.1f"),
+                'MoM %': st.column_config.NumberColumn("MoM %", format="%.0f%%"),
+                'YoY %': st.column_config.NumberColumn("YoY %", format="%.0f%%")
+            }
+        )
+        if len(anomalies) > len(shown):
+            st.caption(f"Showing the {len(shown)} largest of {len(anomalies):,} flagged cells.")
+
+        if not event.selection.rows:
+            st.caption("Select a row to open it in the P&L or the Ledger Editor.")
+            return
+        row = shown.iloc[event.selection.rows[0]]
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("📈 Open in P&L", key="anomaly_open_pnl", width='stretch', on_click=open_anomaly, args=(row, "insights")):
                 st.rerun()
-        with s_exp2:
-            if st.button("Collapse All", key="btn_store_collapse", width='stretch'):
-                st.session_state.expand_store = False
+        with col2:
+            if st.button("✏️ Open in Ledger Editor", key="anomaly_open_editor", width='stretch', on_click=open_anomaly, args=(row, "editor")):
                 st.rerun()
-        with s_exp3:
-            brand_name = reverse_brand_map.get(st.session_state.brand, "Unknown")
-
-            store_excel = build_excel_report(
-                hierarchy=store_hierarchy, 
-                periods=relevant_stores, 
-                store_filter="Comparison", 
-                report_type="store",
-                expand_all=st.session_state.get('expand_store', False)
-            )
-            st.download_button(
-                label="📥 Export",
-                type="primary",
-                data=store_excel,
-                file_name=f"{brand_name}_Store_Comparison_{display_period_label}_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                key="btn_store_export",
-                use_container_width=True
-            )
 
-    # 3. Render Table with Independent State
-    # FIX: Use store specific state
-    store_open_attr = "open" if st.session_state.expand_store else ""
+    anomaly_panel(anomalies)
 
-    num_stores = len(relevant_stores)
-    store_grid_template = f"350px repeat({num_stores}, 150px) 150px"
+# ===========================
+# GROUP P&L VIEW
+# ===========================
+elif view_mode == "🏢 Group P&L":
+    if not group_periods:
+        st.info("ℹ️ No periods selected or available.")
+        stop_rerun()
+
+    def brand_cube(brand, frame):
+        # Same cache entry the brand's own Financial Insights view uses
+        return brand_cache.derived(brand_cache.handle(brand), ('cube',), lambda: build_aggregation_cube(frame))
+
+    with span("group_cubes"):
+        group_cubes = {brand: brand_cube(brand, frame) for brand, frame in group_frames.items() if not frame.empty}
+    instrumentation.set_context(periods=len(group_periods), brands=len(group_cubes))
+    group_handles = tuple(brand_cache.handle(brand) for brand in group_cubes)
+
+    def group_derived(key, builder):
+        # Memoised on every brand's dataset version, stored with the first brand's entry
+        if not group_handles or None in group_handles:
+            return builder()
+        return brand_cache.derived(group_handles[0], key + group_handles[1:], builder)
+
+    @panel_fragment("group_pnl")
+    def group_pnl_panel(group_cubes, group_periods):
+        period_label = group_periods[0] if len(group_periods) == 1 else f"{group_periods[-1]} → {group_periods[0]}"
+        group_key = tuple(group_periods)
+        with span("hierarchy_group"):
+            group_hierarchy = group_derived(
+                ('group_pnl', group_key),
+                lambda: build_consolidated_hierarchy(group_cubes, group_periods, scope={'periods': group_periods, 'store': "All"})
+            )
+        brand_columns = group_hierarchy.columns
+
+        # --- KPI CARDS (group totals across brands) ---
+        total_revenue = add_balances(*(v for c in REVENUE_CLASSES if c in group_hierarchy for v in group_hierarchy[c]['totals'].values()))
+        total_expenses = add_balances(*group_hierarchy.grand_totals.values(), -total_revenue)
+        net_profit = add_balances(total_revenue, -total_expenses)
+        profit_margin = (net_profit / total_revenue * 100) if total_revenue != 0 else 0
+        cols = st.columns(4)
+        kpi_configs = [
+            (cols[0], "bg-revenue", "GROUP REVENUE", fmt_currency(total_revenue), f"{len(brand_columns)} brands"),
+            (cols[1], "bg-expense", "GROUP EXPENSES", fmt_currency(total_expenses), f"{abs((total_expenses/total_revenue*100) if total_revenue!=0 else 0):.1f}% of Rev"),
+            (cols[2], "bg-profit", "GROUP NET PROFIT", fmt_currency(net_profit), period_label),
+            (cols[3], "bg-margin", "GROUP MARGIN", f"{profit_margin:.1f}%", period_label)
+        ]
+        for col, bg_class, title, value, sub in kpi_configs:
+            col.markdown(f"""
+            <div class="kpi-container {bg_class}">
+                <div class="kpi-title">{title}</div>
+                <div class="kpi-value">{value}</div>
+                <div><span class="kpi-sub">{sub}</span></div>
+            </div>
+            """, unsafe_allow_html=True)
+        st.write("<br>", unsafe_allow_html=True)
+
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            st.markdown(f"### 🏢 Consolidated P&L ({period_label})")
+        with col2:
+            g_exp1, g_exp2, g_exp3 = st.columns([1, 1, 1])
+            with g_exp1:
+                if st.button("⊞ Expand All", key="btn_group_expand", width='stretch'):
+                    st.session_state.expand_group = True
+            with g_exp2:
+                if st.button("Collapse All", key="btn_group_collapse", width='stretch'):
+                    st.session_state.expand_group = False
+            with g_exp3:
+                with span("excel_group"):
+                    expand_group = st.session_state.get('expand_group', False)
+                    group_excel = group_derived(
+                        ('excel_group', group_key, expand_group),
+                        lambda: build_excel_report(
+                            hierarchy=group_hierarchy,
+                            periods=brand_columns,
+                            store_filter=period_label,
+                            brand=GROUP_LABEL,
+                            report_type="group",
+                            expand_all=expand_group
+                        ).getvalue()
+                    )
+                st.download_button(
+                    label="📥 Export",
+                    type="primary",
+                    data=group_excel,
+                    file_name=f"{GROUP_LABEL}_Consolidated_PnL_{period_label}_{datetime.now().strftime('%Y%m%d')}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key="btn_group_export",
+                    use_container_width=True
+                )
 
-    store_html = []
-    store_html.append(f"""
-    <style>
-    /* Container handles the scroll */
-    .store-container {{ width: 100%; overflow-x: auto; border: 1px solid #CBD5E1; border-radius: 8px; background: #FFFFFF; padding-bottom: 10px; }}
-    
-    /* Wrapper guarantees background stretches 100% */
-    .store-table-wrapper {{ min-width: 100%; width: max-content; display: flex; flex-direction: column; }}
-    
-    /* Rows span exactly the wrapper's width */
-    .store-row {{ 
-        display: grid; 
-        grid-template-columns: {store_grid_template}; 
-        border-bottom: 1px solid #E2E8F0; 
-        align-items: center; 
-        transition: background 0.2s; 
-        width: 100%;
-        background-color: inherit;
-    }}
-    .store-row:hover {{ background-color: #F8FAFC; }}
-    
-    /* Header styling */
-    .store-header {{ background-color: #0F2044 !important; color: white; font-weight: bold; position: sticky; top: 0; z-index: 10; font-size: 12px; letter-spacing: 0.5px; }}
-    .store-cell {{ padding: 10px 12px; white-space: nowrap; font-size: 13px; }}
-    
-    /* Sticky first column fix: background-color must be solid, not inherit, to prevent overlap */
-    .store-cell:first-child {{ 
-        position: sticky; 
-        left: 0; 
-        background-color: #FFFFFF; 
-        z-index: 5; 
-        border-right: 1px solid #E2E8F0; 
-        overflow: hidden;
-        text-overflow: ellipsis;
-        white-space: nowrap;
-    }}
-    .store-header .store-cell:first-child {{ background-color: #0F2044; z-index: 15; }}
-    
-    .align-right {{ text-align: right; }}
-    
-    /* Value Typography */
-    .val-pos {{ color: #059669; font-weight: 600; font-family: 'DM Mono', monospace; }}
-    .val-neg {{ color: #E11D48; font-weight: 600; font-family: 'DM Mono', monospace; }}
-    .val-tot {{ color: #0F2044; font-weight: 800; font-family: 'DM Mono', monospace; background: #EEF2F9; border-radius: 4px; padding: 3px 6px; display: inline-block; }}
-    
-    /* Hierarchical Styling */
-    .lvl-1 {{ font-weight: 700; color: #0F2044; background: #F1F5F9; cursor: pointer; }}
-    .lvl-2 {{ font-weight: 600; color: #334155; background: #FFFFFF; cursor: pointer; }}
-    .lvl-3 {{ color: #64748B; background: #FFFFFF; }}
-    
-    /* Accordion Details/Summary Reset */
-    details > summary {{ list-style: none; outline: none; }}
-    details > summary::-webkit-details-marker {{ display: none; }}
-    .arrow {{ display: inline-block; width: 18px; font-size: 11px; transition: transform 0.2s; color: #64748B; margin-right: 4px; }}
-    details[open] > summary .arrow {{ transform: rotate(90deg); color: #0F2044; }}
-    </style>
-    
-    <div class='store-container'>
-        <div class='store-table-wrapper'>
-    """)
-
-    store_html.append("<div class='store-row store-header'><div class='store-cell'>PARTICULARS</div>")
-    for s in relevant_stores:
-        store_html.append(f"<div class='store-cell align-right'>{s.upper()}</div>")
-    store_html.append("<div class='store-cell align-right'>TOTAL</div></div>")
-
-    for cls_name, cls_data in store_hierarchy.items():
-        store_html.append(f"<details {store_open_attr}><summary class='store-row lvl-1'>")
-        store_html.append(f"<div class='store-cell'><span class='arrow'>▶</span> 📂 {cls_name.upper()}</div>")
-        for s in relevant_stores:
-            v = cls_data['totals'].get(s, 0)
-            store_html.append(f"<div class='store-cell align-right {'val-pos' if v >= 0 else 'val-neg'}'>{fmt_currency(v)}</div>")
-        store_html.append(f"<div class='store-cell align-right'><span class='val-tot'>{fmt_currency(sum(cls_data['totals'].values()))}</span></div>")
-        store_html.append("</summary>")
-
-        for acc_name, acc_data in cls_data['accounts'].items():
-            store_html.append(f"<details {store_open_attr}><summary class='store-row lvl-2'>")
-            store_html.append(f"<div class='store-cell' style='padding-left: 28px;'><span class='arrow'>▶</span> 📄 {acc_name}</div>")
-            for s in relevant_stores:
-                v = acc_data['totals'].get(s, 0)
-                store_html.append(f"<div class='store-cell align-right {'val-pos' if v >= 0 else 'val-neg'}'>{fmt_currency(v)}</div>")
-            store_html.append(f"<div class='store-cell align-right' style='font-weight: 800;'>{fmt_currency(sum(acc_data['totals'].values()))}</div>")
-            store_html.append("</summary>")
-
-            for partner_name, prt_totals in acc_data['partners'].items():
-                store_html.append("<div class='store-row lvl-3'>")
-                store_html.append(f"<div class='store-cell' style='padding-left: 65px;'>• {partner_name}</div>")
-                for s in relevant_stores:
-                    v = prt_totals.get(s, 0)
-                    store_html.append(f"<div class='store-cell align-right {'val-pos' if v >= 0 else 'val-neg'}'>{fmt_currency(v)}</div>")
-                store_html.append(f"<div class='store-cell align-right'>{fmt_currency(sum(prt_totals.values()))}</div>")
-                store_html.append("</div>")
-
-            store_html.append("</details>") 
-        store_html.append("</details>") 
-
-    store_html.append("</div></div>")
-    st.markdown("".join(store_html), unsafe_allow_html=True)
+        with span("html_group"):
+            expand_group = st.session_state.get('expand_group', False)
+            st.markdown(group_derived(
+                ('html_group', group_key, expand_group),
+                lambda: render_store_html(group_hierarchy, brand_columns, expand_all=expand_group)
+            ), unsafe_allow_html=True)
+
+    group_pnl_panel(group_cubes, group_periods)
 
 # ===========================
 # LEDGER EDITOR VIEW
 # ===========================
 elif view_mode == "✏️ Ledger Editor":
-    if not hasattr(st.session_state, 'editor_filtered_df') or st.session_state.editor_filtered_df.empty:
+    if session_frame('editor_filtered_df') is None or session_frame('editor_filtered_df').empty:
         st.info("ℹ️ Please select periods and filters in the sidebar to view/edit data.")
-        st.stop()
+        stop_rerun()
     
     if "reset_editor" not in st.session_state:
         st.session_state.reset_editor = 0
 
-    editor_df = st.session_state.editor_filtered_df
-    editor_periods = st.session_state.editor_selected_periods
-    editor_store = st.session_state.editor_store_filter
+    @panel_fragment("ledger_editor")
+    def ledger_editor_panel():
+        editor_df = session_frame('editor_filtered_df')
+        if editor_df is None:
+            # Reclaimed while idle; a full rerun rebuilds it from the sidebar filters
+            st.rerun()
+        editor_periods = st.session_state.editor_selected_periods
+        editor_store = st.session_state.editor_store_filter
     
-    filter_summary = f"**Current View:** {len(editor_periods)} period(s): {', '.join(editor_periods)}"
-    if editor_store != "All":
-        filter_summary += f" | Store: {editor_store}"
-    st.markdown(filter_summary)
+        filter_summary = f"**Current View:** {len(editor_periods)} period(s): {', '.join(editor_periods)}"
+        if editor_store != "All":
+            filter_summary += f" | Store: {editor_store}"
+        st.markdown(filter_summary)
     
-    st.markdown("Double-click any period balance to edit. Changes will be reflected in the aggregated total.")
+        st.markdown("Double-click any period balance to edit. Changes will be reflected in the aggregated total.")
 
-    dimension_columns = ['Store', 'classification', 'account_name', 'partner_id_name']
-    
-    if editor_df.empty:
-        st.warning("No records found for the selected filters.")
-    else:
-        pivot_df = editor_df.groupby(dimension_columns + ['DisplayPeriod'], as_index=False)['Balance'].sum()
-        
-        pivot_df = pivot_df.pivot_table(
-            index=dimension_columns,
-            columns='DisplayPeriod',
-            values='Balance',
-            aggfunc='sum',
-            fill_value=0.0
-        ).reset_index()
-        
-        pivot_df.columns.name = None
-        period_columns = [col for col in pivot_df.columns if col not in dimension_columns]
+        if editor_df.empty:
+            st.warning("No records found for the selected filters.")
+        else:
+            # Unsaved edits live in `editor_edits`, keyed by ledger cell, so they survive paging and sorting
+            if st.session_state.get('editor_edits_brand') != st.session_state.brand:
+                st.session_state.editor_edits = {}
+                st.session_state.editor_edits_brand = st.session_state.brand
+            edits = st.session_state.editor_edits
+            harvest_editor_edits(edits, editor_df)
+
+            def first_editor_page():
+                st.session_state.editor_page = 1
+
+            ctrl1, ctrl2, ctrl3, ctrl4 = st.columns([3, 3, 1, 1])
+            with ctrl1:
+                text_filter = st.text_input("Filter rows", key="editor_text_filter", placeholder="Store, class, account or partner", on_change=first_editor_page)
+            with ctrl2:
+                sort_options = ["Class / Account / Partner", "Store", "Account", "Partner"] + list(editor_periods) + ["Total"]
+                sort_label = st.selectbox("Sort by", sort_options, key="editor_sort", on_change=first_editor_page)
+            with ctrl3:
+                descending = st.toggle("Desc", key="editor_sort_desc", on_change=first_editor_page)
+            with ctrl4:
+                page_size = st.selectbox("Rows", [50, 100, 200, 500], index=1, key="editor_page_size", on_change=first_editor_page)
+            sort_by = {"Class / Account / Partner": None, "Store": 'Store', "Account": 'account_name',
+                       "Partner": 'partner_id_name'}.get(sort_label, sort_label)
+
+            with span("editor_pivot"):
+                wide = dataset_derived(
+                    ('editor_wide',) + st.session_state.editor_filter_key,
+                    lambda: editor_wide_frame(editor_df)
+                )
+                page_df, period_columns, row_keys, total_rows, page = editor_page(
+                    editor_df, page=st.session_state.get('editor_page', 1) - 1, page_size=page_size,
+                    sort_by=sort_by, descending=descending, text_filter=text_filter,
+                    overrides={cell: edit['new_value'] for cell, edit in edits.items()}, wide=wide
+                )
+            record_rows("editor_page", len(page_df))
+            st.session_state.editor_page = page + 1
         
-        def get_period_sort_key(period):
-            try:
-                month_name, year = period.rsplit(' ', 1)
-                month_map = {
-                    'January': 1, 'February': 2, 'March': 3, 'April': 4, 'May': 5, 'June': 6,
-                    'July': 7, 'August': 8, 'September': 9, 'October': 10, 'November': 11, 'December': 12
+            if period_columns:
+                st.markdown(f"""
+                <span style='color:#64748B; font-size:0.8rem; font-weight:500;'>
+                {total_rows} unique account-partner combinations | 
+                Showing balances for {len(period_columns)} periods: {period_columns[0]} → {period_columns[-1]}
+                </span>
+                """, unsafe_allow_html=True)
+                brand_name = reverse_brand_map.get(st.session_state.brand, "Unknown")
+                flat_export_popover("editor_flat", [
+                    ("GL rows", f"{brand_name}_GL_Rows_{editor_store}", lambda: ledger_export_frame(editor_df)),
+                    ("Pivot", f"{brand_name}_Ledger_Pivot_{editor_store}", lambda: build_editor_pivot(editor_df, formatted=False)[0])
+                ])
+
+                column_config = {
+                    "Store": st.column_config.TextColumn("Store", disabled=True, width="stretch"),
+                    "classification": st.column_config.TextColumn("Classification", disabled=True),
+                    "account_name": st.column_config.TextColumn("Account", disabled=True),
+                    "partner_id_name": st.column_config.TextColumn("Partner", disabled=True),
+                    "Total": st.column_config.TextColumn("Total (All Periods)", disabled=True)
                 }
-                month_num = month_map.get(month_name, 0)
-                return (int(year), month_num)
-            except:
-                return (9999, 99)
-        
-        if period_columns:
-            period_columns = sorted(period_columns, key=get_period_sort_key)
-            pivot_df['Total'] = pivot_df[period_columns].sum(axis=1)
-            column_order = dimension_columns + period_columns + ['Total']
-            pivot_df = pivot_df[column_order]
-            
-            for col in period_columns + ['Total']:
-                pivot_df[col] = pd.to_numeric(pivot_df[col], errors='coerce').fillna(0.0).apply(fmt_currency)
-            
-            pivot_df = pivot_df.sort_values(['classification', 'account_name', 'partner_id_name'])
-            
-            st.markdown(f"""
-            <span style='color:#64748B; font-size:0.8rem; font-weight:500;'>
-            {len(pivot_df)} unique account-partner combinations | 
-            Showing balances for {len(period_columns)} periods: {period_columns[0]} → {period_columns[-1]}
-            </span>
-            """, unsafe_allow_html=True)
-
-            column_config = {
-                "Store": st.column_config.TextColumn("Store", disabled=True, width="stretch"),
-                "classification": st.column_config.TextColumn("Classification", disabled=True),
-                "account_name": st.column_config.TextColumn("Account", disabled=True),
-                "partner_id_name": st.column_config.TextColumn("Partner", disabled=True),
-                "Total": st.column_config.TextColumn("Total (All Periods)", disabled=True)
-            }
             
-            for period in period_columns:
-                try:
-                    month_name, year = period.rsplit(' ', 1)
-                    short_period = month_name[:3] + " " + year[-2:]
-                except:
-                    short_period = period
+                for period in period_columns:
+                    try:
+                        month_name, year = period.rsplit(' ', 1)
+                        short_period = month_name[:3] + " " + year[-2:]
+                    except:
+                        short_period = period
                 
-                column_config[period] = st.column_config.TextColumn(
-                    short_period, required=True
-                )
+                    column_config[period] = st.column_config.TextColumn(
+                        short_period, required=True
+                    )
 
-            filtered_pivot_df = pivot_df.copy()
-            if 'editor_class' in st.session_state and st.session_state.editor_class != "All":
-                filtered_pivot_df = filtered_pivot_df[filtered_pivot_df['classification'] == st.session_state.editor_class]
-            if 'editor_account' in st.session_state and st.session_state.editor_account != "All":
-                filtered_pivot_df = filtered_pivot_df[filtered_pivot_df['account_name'] == st.session_state.editor_account]
-            if 'editor_partner' in st.session_state and st.session_state.editor_partner != "All":
-                filtered_pivot_df = filtered_pivot_df[filtered_pivot_df['partner_id_name'] == st.session_state.editor_partner]
-
-            current_editor_key = f"editor_{st.session_state.reset_editor}"
-            editor_df_widget = st.data_editor(
-                filtered_pivot_df, 
-                key=current_editor_key, 
-                width='stretch',
-                hide_index=True,
-                num_rows="fixed",
-                disabled=['Store', 'classification', 'account_name', 'partner_id_name', 'Total'],
-                column_config=column_config
-            )
+                # A new grid per page/sort/filter, so positional edits never land on a different row
+                current_editor_key = f"editor_{st.session_state.reset_editor}_{abs(hash((page, page_size, sort_label, descending, text_filter, tuple(period_columns), total_rows)))}"
+                st.session_state.editor_widget_key = current_editor_key
+                st.session_state.editor_page_keys = row_keys
+                with span("editor_render"):
+                    editor_df_widget = st.data_editor(
+                        page_df, 
+                        key=current_editor_key, 
+                        width='stretch',
+                        hide_index=True,
+                        num_rows="fixed",
+                        disabled=['Store', 'classification', 'account_name', 'partner_id_name', 'Total'],
+                        column_config=column_config
+                    )
 
-            changes_summary = []
-            if current_editor_key in st.session_state:
-                edits = st.session_state[current_editor_key].get("edited_rows", {})
-                for row_idx, changed_cols in edits.items():
-                    row_data = filtered_pivot_df.iloc[row_idx]
-                    for period, new_val in changed_cols.items():
-                        if period in period_columns:
-                            clean_val = str(new_val).replace(',', '').replace('₹','')
-                            changes_summary.append({
-                                'store': row_data['Store'],
-                                'classification': row_data['classification'],
-                                'account': row_data['account_name'],
-                                'partner': row_data['partner_id_name'],
-                                'period': period,
-                                'new_value': float(clean_val)
-                            })
-
-            st.session_state.dirty = len(changes_summary) > 0
-
-            st.write("<br>", unsafe_allow_html=True)
-            col1, col2, col3 = st.columns([6, 2, 2])
-
-            with col1:
-                if st.session_state.dirty:
-                    st.info(f"📝 {len(changes_summary)} pending changes.")
-
-            with col2:
-                if st.button("🗑️ Discard", width='stretch', disabled=not st.session_state.dirty):
-                    if current_editor_key in st.session_state:
-                        del st.session_state[current_editor_key]
-                    st.session_state.reset_editor += 1
-                    st.session_state.dirty = False
+                page_count = max((total_rows - 1) // page_size + 1, 1)
+                if page_count > 1:
+                    pager1, pager2 = st.columns([1, 5])
+                    with pager1:
+                        st.number_input("Page", min_value=1, max_value=page_count, step=1, key="editor_page")
+                    with pager2:
+                        st.caption(f"Rows {page * page_size + 1}–{min((page + 1) * page_size, total_rows)} of {total_rows} · page {page + 1} of {page_count}")
+
+                changes_summary = [
+                    {'store': cell[0], 'classification': cell[1], 'account': cell[2], 'partner': cell[3], 'period': cell[4], **edit}
+                    for cell, edit in edits.items()
+                ]
+                st.session_state.pending_changes = changes_summary
+                st.session_state.pending_changes_brand = st.session_state.brand
+
+                st.session_state.dirty = len(changes_summary) > 0
+
+                st.write("<br>", unsafe_allow_html=True)
+                col1, col2, col3 = st.columns([6, 2, 2])
+
+                with col1:
+                    if st.session_state.dirty:
+                        st.info(f"📝 {len(changes_summary)} pending changes.")
+
+                with col2:
+                    if st.button("🗑️ Discard", width='stretch', disabled=not st.session_state.dirty):
+                        if current_editor_key in st.session_state:
+                            del st.session_state[current_editor_key]
+                        st.session_state.editor_edits = {}
+                        st.session_state.pending_changes = []
+                        st.session_state.reset_editor += 1
+                        st.session_state.dirty = False
+                        st.rerun(scope="fragment")
+
+                with col3:
+                    if st.button("💾 Save to Fabric", width='stretch', disabled=not st.session_state.dirty, type="primary"):
+                        save_changes(changes_summary)
+                        st.session_state.pending_changes = []
+                        st.session_state.editor_edits = {}
+                        if current_editor_key in st.session_state:
+                            del st.session_state[current_editor_key]
+                        st.session_state.reset_editor += 1
+                        st.session_state.dirty = False
+                        st.rerun()
+
+    @panel_fragment("adjustment_import")
+    def adjustment_import_panel():
+        # Large reclasses as one file instead of cell-by-cell grid edits; saved as a single journal batch
+        with st.expander("📥 Bulk import adjustments"):
+            st.caption("CSV or Excel with Store, Classification, Account, Partner and Period (e.g. April 2025) columns, "
+                       "plus either Balance (the cell's new balance) or Adjustment (added to its current balance). "
+                       "Adjustment rows for the same cell are added together; with Balance, list each cell once.")
+            uploaded = st.file_uploader("Adjustments file", type=["csv", "xlsx"],
+                                        key=f"adjustment_upload_{st.session_state.get('reset_adjustments', 0)}")
+            if uploaded is None:
+                return
+            import_key = (uploaded.file_id, st.session_state.dataset_handle)
+            changes, rejected = session_frame('adjustment_changes'), session_frame('adjustment_rejected')
+            if st.session_state.get('adjustment_import_key') != import_key or changes is None or rejected is None:
+                try:
+                    with span("adjustment_validate", file_bytes=uploaded.size):
+                        adjustments = read_adjustments(uploaded, uploaded.name)
+                        changes, rejected = validate_adjustments(adjustments, session_frame('current_df'))
+                except ValueError as e:
+                    st.error(f"⚠️ {e}")
+                    return
+                record_rows("adjustment_rows", len(adjustments))
+                set_session_frame('adjustment_changes', changes)
+                set_session_frame('adjustment_rejected', rejected)
+                st.session_state.adjustment_import_key = import_key
+
+            if len(rejected):
+                st.warning(f"⚠️ {len(rejected)} row(s) do not match a loaded store, period or account and will not be saved.")
+                st.dataframe(rejected, hide_index=True, width='stretch')
+            if changes.empty:
+                st.info("ℹ️ No balance changes in this file.")
+                return
+            st.markdown(f"**{len(changes)}** cell(s) change by **{fmt_currency(add_balances(*changes['delta']))}** in total.")
+            st.dataframe(
+                changes.rename(columns={'classification': "Classification", 'account_name': "Account", 'partner_id_name': "Partner",
+                                        'DisplayPeriod': "Period", 'old_value': "Current", 'new_value': "New", 'delta': "Change"}),
+                hide_index=True, width='stretch',
+                column_config={c: st.column_config.NumberColumn(c, format="₹%.2f") for c in ["Current", "New", "Change"]}
+            )
+            save_col, clear_col = st.columns(2)
+            with save_col:
+                if st.button(f"💾 Save {len(changes)} adjustment(s) to Fabric", key="adjustment_save", type="primary", width='stretch'):
+                    save_changes(adjustment_changes(changes))
+                    st.session_state.reset_adjustments = st.session_state.get('reset_adjustments', 0) + 1
+                    st.session_state.adjustment_import_key = None
                     st.rerun()
+            with clear_col:
+                if st.button("🗑️ Discard file", key="adjustment_discard", width='stretch'):
+                    st.session_state.reset_adjustments = st.session_state.get('reset_adjustments', 0) + 1
+                    st.session_state.adjustment_import_key = None
+                    st.rerun(scope="fragment")
+
+    journal_counts = edit_journal.status_counts(brand=st.session_state.brand, user=st.session_state.get('logged_in_user'))
+
+    # Polls the journal while saves are still queued, without rerunning the editor
+    @panel_fragment("save_status", run_every=3 if journal_counts.get(JOURNAL_PENDING) else None)
+    def save_status_panel():
+        brand, user = st.session_state.brand, st.session_state.get('logged_in_user')
+        counts = edit_journal.status_counts(brand=brand, user=user)
+        pending, failed, held = counts.get(JOURNAL_PENDING, 0), counts.get(JOURNAL_FAILED, 0), counts.get(JOURNAL_CONFLICT, 0)
+        if pending:
+            st.info(f"⏳ {pending} saved edit(s) queued for Fabric. They are sent in the background and retried until accepted.")
+            if st.session_state.get('unchecked_save_error'):
+                st.warning(f"⚠️ Fabric couldn't be read to check your save for conflicting edits "
+                           f"({st.session_state.unchecked_save_error}). They will be checked before they are sent.")
+        elif st.session_state.get('last_save_batch'):
+            batch = edit_journal.status_counts(batch_id=st.session_state.last_save_batch)
+            if batch.get(JOURNAL_SENT):
+                st.success(f"✅ Successfully synced {batch[JOURNAL_SENT]} records to Fabric!")
+            st.session_state.last_save_batch = None
+        if not pending:
+            st.session_state.unchecked_save_error = None
+        conflicts = st.session_state.get('save_conflicts') or []
+        if conflicts:
+            st.warning(f"⚠️ {len(conflicts)} edit(s) were not saved: someone else changed the same cell since you loaded it. "
+                       "The grid now shows their value.")
+            st.dataframe(pd.DataFrame([{
+                'store': c['store'], 'account': c['account'], 'partner': c['partner'], 'period': c['period'],
+                'your value': c['new_value'], 'their value': c['server_value'],
+                'changed by': c['server_modified_user'], 'changed at': c['server_modified_at']
+            } for c in conflicts]), hide_index=True, width='stretch')
+            keep_col, overwrite_col = st.columns(2)
+            with keep_col:
+                if st.button("Keep their values", key="conflict_keep", width='stretch'):
+                    st.session_state.save_conflicts = []
+                    st.rerun(scope="fragment")
+            with overwrite_col:
+                if st.button("Overwrite with mine", key="conflict_overwrite", width='stretch'):
+                    mine = [{k: c[k] for k in ('store', 'classification', 'account', 'partner', 'period', 'new_value')} for c in conflicts]
+                    # Made against their values, which Fabric now holds
+                    journal_changes(mine, [c['server_modified_at'] for c in conflicts])
+                    apply_saved_changes(mine)
+                    st.session_state.save_conflicts = []
+                    st.rerun()
+        if held:
+            st.warning(f"⚠️ {held} queued edit(s) were not sent: someone else changed the same cell in Fabric first. "
+                       "The grid shows their value.")
+            rows = edit_journal.rows(brand=brand, user=user, statuses=(JOURNAL_CONFLICT,))
+            st.dataframe(pd.DataFrame([{
+                'store': r['variables']['store'], 'account': r['variables']['account_name'],
+                'partner': r['variables']['partner_id_name'],
+                'period': f"{r['variables']['monthName']} {r['variables']['year']}",
+                'your value': r['variables']['balance'], 'their change': r['last_error']
+            } for r in rows]), hide_index=True, width='stretch')
+            keep_col, overwrite_col = st.columns(2)
+            with keep_col:
+                if st.button("Keep their values", key="journal_conflict_keep", width='stretch'):
+                    edit_journal.resolve_conflicts(brand=brand, user=user)
+                    st.rerun()
+            with overwrite_col:
+                if st.button("Overwrite with mine", key="journal_conflict_overwrite", width='stretch'):
+                    edit_journal.resolve_conflicts(brand=brand, user=user, overwrite=True)
+                    edit_drainer.wake()
+                    st.rerun()
+        if failed:
+            st.error(f"⚠️ {failed} edit(s) could not be saved to Fabric after repeated attempts.")
+            with st.expander("Failed edits"):
+                rows = edit_journal.rows(brand=brand, user=user, statuses=(JOURNAL_FAILED,))
+                st.dataframe(pd.DataFrame([{
+                    'store': r['variables']['store'], 'account': r['variables']['account_name'],
+                    'partner': r['variables']['partner_id_name'],
+                    'period': f"{r['variables']['monthName']} {r['variables']['year']}",
+                    'balance': r['variables']['balance'], 'attempts': r['attempts'], 'error': r['last_error']
+                } for r in rows]), hide_index=True, width='stretch')
+            if st.button("🔁 Retry failed edits", key="journal_retry_failed"):
+                edit_journal.retry_failed(brand=brand, user=user)
+                edit_drainer.wake()
+                st.rerun()
 
-            with col3:
-                if st.button("💾 Save to Fabric", width='stretch', disabled=not st.session_state.dirty, type="primary"):
-                    with st.spinner("Syncing changes with Fabric..."):
-                        success_count, error_count = 0, 0
-                        month_map = {"Jan": "January", "Feb": "February", "Mar": "March", "Apr": "April", "May": "May", "Jun": "June", "Jul": "July", "Aug": "August", "Sep": "September", "Oct": "October", "Nov": "November", "Dec": "December"}
-                        current_time_fabric = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-
-                        for change in changes_summary:
-                            p_parts = change['period'].split()
-                            full_month = month_map.get(p_parts[0], p_parts[0])
-                            raw_year = p_parts[1]
-                            full_year = 2000 + int(raw_year) if len(raw_year) == 2 else int(raw_year)
-                            
-                            variables = {
-                                "year": full_year,
-                                "monthName": full_month,
-                                "store": str(change['store']).strip(),
-                                "balance": float(change['new_value']),
-                                "account_name": str(change['account']).strip(),
-                                "classification": str(change['classification']).strip(),
-                                "partner_id_name": str(change['partner']).strip(),
-                                "last_modified_at": current_time_fabric,
-                                "last_modified_user": st.session_state.get('logged_in_user', 'Unknown')
-                            }
-
-                            try:
-                                response = run_graphql(UPSERT_MUTATION, variables)
-                                if response and "errors" not in response:
-                                    success_count += 1
-                                else:
-                                    error_msg = response['errors'][0]['message'] if response else "No response"
-                                    st.error(f"Failed to save {change['account']}: {error_msg}")
-                                    error_count += 1
-                            except Exception as e:
-                                st.error(f"Connection error: {str(e)}")
-                                error_count += 1
-
-                        if error_count == 0:
-                            st.success(f"✅ Successfully synced {success_count} records to Fabric!")
-                            load_data.clear() 
-                            if current_editor_key in st.session_state:
-                                del st.session_state[current_editor_key]
-                            st.session_state.reset_editor += 1
-                            st.session_state.dirty = False
-                            st.rerun()
-                        else:
-                            st.warning(f"Process complete: {success_count} saved, {error_count} failed.")
+    save_status_panel()
+    adjustment_import_panel()
+    ledger_editor_panel()
 
 # ===========================
 # BUDGETING VIEW
@@ -1403,248 +1710,239 @@ elif view_mode == "✏️ Ledger Editor":
 elif view_mode == "💰 Budget vs Actual":
     if "budget_base_period" not in st.session_state:
         st.info("ℹ️ Please select a Base Period in the sidebar to view budgeting data.")
-        st.stop()
-
-    base_period = st.session_state.budget_base_period
+        stop_rerun()
 
-    classification_order = [
-        'Net Sales', 'Other Income', 'Cost of Goods Sold (COGS)', 'Employee cost',
-        'Rent and Utilities', 'Marketing and Advertisment', 'Admin Expenses',
-        'Logistics', 'Other Expenses', 'Finance cost', 'Supplier Payments',
-        'Purchase Expense', 'Depreciation'
-    ]
+    @st.cache_data(ttl=600)
+    def fetch_budget_data():
+        response = run_graphql(BUDGET_QUERY)
+        return pd.DataFrame(response["data"]["executesp_pr_readBudgetData"]) if response else pd.DataFrame()
 
-    st.markdown("""
-    <style>
-        [data-testid="stDataFrame"] th p {
-            font-weight: 800 !important;
-            text-transform: uppercase !important;
-            text-align: center !important;
-            color: #1E293B !important;
-        }
-        .super-kpi-card {
-            border-radius: 12px;
-            padding: 22px;
-            box-shadow: 0 4px 12px rgba(0,0,0,0.05);
-            margin-bottom: 20px;
-        }
+    @panel_fragment("budget")
+    def budget_panel(df, base_period):
+        st.markdown("""
+        <style>
+            [data-testid="stDataFrame"] th p {
+                font-weight: 800 !important;
+                text-transform: uppercase !important;
+                text-align: center !important;
+                color: #1E293B !important;
+            }
+            .super-kpi-card {
+                border-radius: 12px;
+                padding: 22px;
+                box-shadow: 0 4px 12px rgba(0,0,0,0.05);
+                margin-bottom: 20px;
+            }
         
-        .card-revenue { 
-            background: linear-gradient(90deg, #F0FDF4 0%, #FFFFFF 100%);
-            border: 1px solid #DCFCE7;
-            border-left: 6px solid #22C55E !important; 
-        } 
+            .card-revenue { 
+                background: linear-gradient(90deg, #F0FDF4 0%, #FFFFFF 100%);
+                border: 1px solid #DCFCE7;
+                border-left: 6px solid #22C55E !important; 
+            } 
         
-        .card-expense { 
-            background: linear-gradient(90deg, #FEF2F2 0%, #FFFFFF 100%);
-            border: 1px solid #FEE2E2;
-            border-left: 6px solid #EF4444 !important; 
-        } 
+            .card-expense { 
+                background: linear-gradient(90deg, #FEF2F2 0%, #FFFFFF 100%);
+                border: 1px solid #FEE2E2;
+                border-left: 6px solid #EF4444 !important; 
+            } 
         
-        .super-kpi-header {
-            font-size: 0.8rem;
-            font-weight: 700;
-            color: #475569;
-            text-transform: uppercase;
-            letter-spacing: 0.8px;
-            margin-bottom: 18px;
-        }
-        .partition-container {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        .partition {
-            flex: 1;
-            text-align: center;
-            border-right: 1px solid rgba(0,0,0,0.05);
-        }
-        .partition:last-child { border-right: none; }
+            .super-kpi-header {
+                font-size: 0.8rem;
+                font-weight: 700;
+                color: #475569;
+                text-transform: uppercase;
+                letter-spacing: 0.8px;
+                margin-bottom: 18px;
+            }
+            .partition-container {
+                display: flex;
+                justify-content: space-between;
+                align-items: center;
+            }
+            .partition {
+                flex: 1;
+                text-align: center;
+                border-right: 1px solid rgba(0,0,0,0.05);
+            }
+            .partition:last-child { border-right: none; }
         
-        .partition-label { font-size: 0.65rem; color: #64748B; font-weight: 700; margin-bottom: 6px; }
-        .partition-value { font-size: 1.15rem; font-weight: 700; color: #0F172A; font-family: 'DM Mono', monospace; }
+            .partition-label { font-size: 0.65rem; color: #64748B; font-weight: 700; margin-bottom: 6px; }
+            .partition-value { font-size: 1.15rem; font-weight: 700; color: #0F172A; font-family: 'DM Mono', monospace; }
         
-        .text-revenue { color: #15803D !important; font-weight: 800; }
-        .text-expense { color: #B91C1C !important; font-weight: 800; }
-        .text-neutral { color: #854D0E !important; background: #FEF9C3; padding: 2px 8px; border-radius: 4px; }
-    </style>
-    """, unsafe_allow_html=True)
-    
-    BUDGET_QUERY = "query budgetData { executesp_pr_readBudgetData { Particulars Month Year Budget } }"
+            .text-revenue { color: #15803D !important; font-weight: 800; }
+            .text-expense { color: #B91C1C !important; font-weight: 800; }
+            .text-neutral { color: #854D0E !important; background: #FEF9C3; padding: 2px 8px; border-radius: 4px; }
+        </style>
+        """, unsafe_allow_html=True)
     
-    @st.cache_data(ttl=600)
-    def fetch_budget_data():
-        response = run_graphql(BUDGET_QUERY)
-        return pd.DataFrame(response["data"]["executesp_pr_readBudgetData"]) if response else pd.DataFrame()
-
-    raw_budget_df = fetch_budget_data()
-    actual_data = df[df['DisplayPeriod'] == base_period].copy()
-    if 'editor_store_filter' in st.session_state and st.session_state.editor_store_filter != "All":
-        actual_data = actual_data[actual_data['Store'] == st.session_state.editor_store_filter]
+        with span("budget_fetch"):
+            raw_budget_df = fetch_budget_data()
+        actual_data = df[df['DisplayPeriod'] == base_period].copy()
+        if 'editor_store_filter' in st.session_state and st.session_state.editor_store_filter != "All":
+            actual_data = actual_data[actual_data['Store'] == st.session_state.editor_store_filter]
     
-    actual_summary = actual_data.groupby('classification')['Balance'].sum().reset_index()
-    actual_summary.rename(columns={'classification': 'Particulars', 'Balance': 'Actual'}, inplace=True)
+        actual_summary = balance_sum(actual_data, 'classification').reset_index()
+        actual_summary.rename(columns={'classification': 'Particulars', 'Balance': 'Actual'}, inplace=True)
 
-    if not raw_budget_df.empty:
-        raw_budget_df['DisplayPeriod'] = raw_budget_df['Month'] + " " + raw_budget_df['Year'].astype(str)
-        period_budget_df = raw_budget_df[raw_budget_df['DisplayPeriod'] == base_period]
+        if not raw_budget_df.empty:
+            raw_budget_df['DisplayPeriod'] = raw_budget_df['Month'] + " " + raw_budget_df['Year'].astype(str)
+            period_budget_df = raw_budget_df[raw_budget_df['DisplayPeriod'] == base_period]
         
-        # Safely handle periods with zero budget data
-        if not period_budget_df.empty:
-            budget_pivot = period_budget_df.pivot_table(index='Particulars', values='Budget', aggfunc='sum').reset_index()
-            pivot_df = pd.merge(pd.DataFrame({'Particulars': classification_order}), budget_pivot, on='Particulars', how='left').fillna(0.0)
+            # Safely handle periods with zero budget data
+            if not period_budget_df.empty:
+                budget_pivot = period_budget_df.pivot_table(index='Particulars', values='Budget', aggfunc='sum').reset_index()
+                pivot_df = pd.merge(pd.DataFrame({'Particulars': CLASSIFICATION_ORDER}), budget_pivot, on='Particulars', how='left').fillna(0.0)
+            else:
+                pivot_df = pd.DataFrame({'Particulars': CLASSIFICATION_ORDER, 'Budget': 0.0})
         else:
-            pivot_df = pd.DataFrame({'Particulars': classification_order, 'Budget': 0.0})
-    else:
-        pivot_df = pd.DataFrame({'Particulars': classification_order, 'Budget': 0.0})
-
-    # Merge actuals
-    pivot_df = pd.merge(pivot_df, actual_summary, on='Particulars', how='left').fillna(0.0)
-
-    # Failsafe: Ensure 'Actual' column exists even if actual_summary was completely empty
-    if 'Actual' not in pivot_df.columns:
-        pivot_df['Actual'] = 0.0
-
-    # ==========================================
-
-    def get_val(df, part, col):
-        return df.loc[df['Particulars'] == part, col].sum()
-
-    rev_b = get_val(pivot_df, 'Net Sales', 'Budget') + get_val(pivot_df, 'Other Income', 'Budget')
-    rev_a = get_val(pivot_df, 'Net Sales', 'Actual') + get_val(pivot_df, 'Other Income', 'Actual')
-    exp_b = get_val(pivot_df, 'Cost of Goods Sold (COGS)', 'Budget')
-    exp_a = get_val(pivot_df, 'Cost of Goods Sold (COGS)', 'Actual')
-    op_exp_b = (get_val(pivot_df, 'Employee cost', 'Budget') + 
-                get_val(pivot_df, 'Rent and Utilities', 'Budget') + 
-                get_val(pivot_df, 'Marketing and Advertisment', 'Budget') + 
-                get_val(pivot_df, 'Admin Expenses', 'Budget') + 
-                get_val(pivot_df, 'Logistics', 'Budget') +
-                get_val(pivot_df, 'Other Expenses', 'Budget')
-    )
-    op_exp_a = (get_val(pivot_df, 'Employee cost', 'Actual') + 
-                get_val(pivot_df, 'Rent and Utilities', 'Actual') + 
-                get_val(pivot_df, 'Marketing and Advertisment', 'Actual') + 
-                get_val(pivot_df, 'Admin Expenses', 'Actual') + 
-                get_val(pivot_df, 'Logistics', 'Actual') +
-                get_val(pivot_df, 'Other Expenses', 'Actual')
-    )
-    fin_cost_b = get_val(pivot_df, 'Finance cost', 'Budget')
-    fin_cost_a = get_val(pivot_df, 'Finance cost', 'Actual')
-
-    final_rows = [
-        'Net Sales', 'Other Income',
-        {'Particulars': 'TOTAL REVENUE', 'Budget': rev_b, 'Actual': rev_a, 'is_calc': True},
-        'Cost of Goods Sold (COGS)',
-        {'Particulars': 'TOTAL EXPENSE', 'Budget': exp_b, 'Actual': exp_a, 'is_calc': True},
-        {'Particulars': 'GROSS PROFIT', 'Budget': rev_b - exp_b, 'Actual': rev_a - exp_a, 'is_calc': True},
-        'Employee cost', 'Rent and Utilities', 'Marketing and Advertisment', 
-        'Admin Expenses', 'Logistics', 'Other Expenses',
-        {'Particulars': 'TOTAL OPERATING EXPENSE', 'Budget': op_exp_b, 'Actual': op_exp_a, 'is_calc': True},
-        {'Particulars': 'OPERATING PROFIT (EBIT)', 'Budget': rev_b - exp_b - op_exp_b, 'Actual': rev_a - exp_a - op_exp_a, 'is_calc': True},
-        'Finance cost', 'Depreciation',
-        {'Particulars': 'PBT', 'Budget': rev_b - exp_b - op_exp_b - fin_cost_b, 'Actual': rev_a - exp_a - op_exp_a - fin_cost_a, 'is_calc': True},
-        'Supplier Payments', 'Purchase Expense'
-    ]
+            pivot_df = pd.DataFrame({'Particulars': CLASSIFICATION_ORDER, 'Budget': 0.0})
+
+        # Merge actuals
+        pivot_df = pd.merge(pivot_df, actual_summary, on='Particulars', how='left').fillna(0.0)
+
+        # Failsafe: Ensure 'Actual' column exists even if actual_summary was completely empty
+        if 'Actual' not in pivot_df.columns:
+            pivot_df['Actual'] = 0.0
+
+        # ==========================================
+
+        def get_val(df, part, col):
+            return df.loc[df['Particulars'] == part, col].sum()
+
+        def rollup(col, *particulars):
+            return add_balances(*(get_val(pivot_df, p, col) for p in particulars))
+
+        operating_lines = ['Employee cost', 'Rent and Utilities', 'Marketing and Advertisment',
+                           'Admin Expenses', 'Logistics', 'Other Expenses']
+        rev_b = rollup('Budget', 'Net Sales', 'Other Income')
+        rev_a = rollup('Actual', 'Net Sales', 'Other Income')
+        exp_b = get_val(pivot_df, 'Cost of Goods Sold (COGS)', 'Budget')
+        exp_a = get_val(pivot_df, 'Cost of Goods Sold (COGS)', 'Actual')
+        op_exp_b = rollup('Budget', *operating_lines)
+        op_exp_a = rollup('Actual', *operating_lines)
+        fin_cost_b = get_val(pivot_df, 'Finance cost', 'Budget')
+        fin_cost_a = get_val(pivot_df, 'Finance cost', 'Actual')
+
+        final_rows = [
+            'Net Sales', 'Other Income',
+            {'Particulars': 'TOTAL REVENUE', 'Budget': rev_b, 'Actual': rev_a, 'is_calc': True},
+            'Cost of Goods Sold (COGS)',
+            {'Particulars': 'TOTAL EXPENSE', 'Budget': exp_b, 'Actual': exp_a, 'is_calc': True},
+            {'Particulars': 'GROSS PROFIT', 'Budget': add_balances(rev_b, -exp_b), 'Actual': add_balances(rev_a, -exp_a), 'is_calc': True},
+            'Employee cost', 'Rent and Utilities', 'Marketing and Advertisment', 
+            'Admin Expenses', 'Logistics', 'Other Expenses',
+            {'Particulars': 'TOTAL OPERATING EXPENSE', 'Budget': op_exp_b, 'Actual': op_exp_a, 'is_calc': True},
+            {'Particulars': 'OPERATING PROFIT (EBIT)', 'Budget': add_balances(rev_b, -exp_b, -op_exp_b),
+             'Actual': add_balances(rev_a, -exp_a, -op_exp_a), 'is_calc': True},
+            'Finance cost', 'Depreciation',
+            {'Particulars': 'PBT', 'Budget': add_balances(rev_b, -exp_b, -op_exp_b, -fin_cost_b),
+             'Actual': add_balances(rev_a, -exp_a, -op_exp_a, -fin_cost_a), 'is_calc': True},
+            'Supplier Payments', 'Purchase Expense'
+        ]
+
+        processed_data = []
+        for item in final_rows:
+            if isinstance(item, dict):
+                processed_data.append(item)
+            else:
+                row_match = pivot_df[pivot_df['Particulars'] == item]
+                b_val = row_match['Budget'].values[0] if not row_match.empty else 0.0
+                a_val = row_match['Actual'].values[0] if not row_match.empty else 0.0
+                processed_data.append({'Particulars': item, 'Budget': b_val, 'Actual': a_val, 'is_calc': False})
 
-    processed_data = []
-    for item in final_rows:
-        if isinstance(item, dict):
-            processed_data.append(item)
-        else:
-            row_match = pivot_df[pivot_df['Particulars'] == item]
-            b_val = row_match['Budget'].values[0] if not row_match.empty else 0.0
-            a_val = row_match['Actual'].values[0] if not row_match.empty else 0.0
-            processed_data.append({'Particulars': item, 'Budget': b_val, 'Actual': a_val, 'is_calc': False})
-
-    table_df = pd.DataFrame(processed_data)
-    table_df['Change %'] = table_df.apply(lambda r: ((r['Actual'] - r['Budget']) / r['Budget'] * 100) if r['Budget'] != 0 else (100.0 if r['Actual'] > 0 else 0.0), axis=1)
-
-    st.subheader(f"🎯 Performance Analytics: {base_period}")
-
-    rev_diff = rev_a - rev_b
-    rev_var_pct = (rev_diff / rev_b * 100) if rev_b != 0 else 0
-    rev_text_class = "text-revenue" if rev_diff > 0 else "text-expense" if rev_diff < 0 else "text-neutral"
-
-    total_planned_exp = op_exp_b + exp_b + fin_cost_b
-    total_actual_exp = op_exp_a + exp_a + fin_cost_a
-    exp_diff = total_actual_exp - total_planned_exp
-    exp_var_pct = (exp_diff / total_planned_exp * 100) if total_planned_exp != 0 else 0
-    exp_text_class = "text-expense" if exp_diff > 0 else "text-revenue" if exp_diff < 0 else "text-neutral"
-
-    col_left, col_right = st.columns(2)
-
-    with col_left:
-        st.markdown(f"""
-        <div class="super-kpi-card card-revenue">
-            <div class="super-kpi-header">📊 Revenue Performance</div>
-            <div class="partition-container">
-                <div class="partition">
-                    <div class="partition-label">TARGET REVENUE</div>
-                    <div class="partition-value">{fmt_currency(rev_b)}</div>
-                </div>
-                <div class="partition">
-                    <div class="partition-label">ACTUAL REVENUE</div>
-                    <div class="partition-value">{fmt_currency(rev_a)}</div>
-                </div>
-                <div class="partition">
-                    <div class="partition-label">VARIANCE %</div>
-                    <div class="partition-value {rev_text_class}">{rev_var_pct:+.1f}%</div>
+        table_df = pd.DataFrame(processed_data)
+        table_df['Change %'] = table_df.apply(lambda r: ((r['Actual'] - r['Budget']) / r['Budget'] * 100) if r['Budget'] != 0 else (100.0 if r['Actual'] > 0 else 0.0), axis=1)
+
+        st.subheader(f"🎯 Performance Analytics: {base_period}")
+
+        rev_diff = add_balances(rev_a, -rev_b)
+        rev_var_pct = (rev_diff / rev_b * 100) if rev_b != 0 else 0
+        rev_text_class = "text-revenue" if rev_diff > 0 else "text-expense" if rev_diff < 0 else "text-neutral"
+
+        total_planned_exp = add_balances(op_exp_b, exp_b, fin_cost_b)
+        total_actual_exp = add_balances(op_exp_a, exp_a, fin_cost_a)
+        exp_diff = add_balances(total_actual_exp, -total_planned_exp)
+        exp_var_pct = (exp_diff / total_planned_exp * 100) if total_planned_exp != 0 else 0
+        exp_text_class = "text-expense" if exp_diff > 0 else "text-revenue" if exp_diff < 0 else "text-neutral"
+
+        col_left, col_right = st.columns(2)
+
+        with col_left:
+            st.markdown(f"""
+            <div class="super-kpi-card card-revenue">
+                <div class="super-kpi-header">📊 Revenue Performance</div>
+                <div class="partition-container">
+                    <div class="partition">
+                        <div class="partition-label">TARGET REVENUE</div>
+                        <div class="partition-value">{fmt_currency(rev_b)}</div>
+                    </div>
+                    <div class="partition">
+                        <div class="partition-label">ACTUAL REVENUE</div>
+                        <div class="partition-value">{fmt_currency(rev_a)}</div>
+                    </div>
+                    <div class="partition">
+                        <div class="partition-label">VARIANCE %</div>
+                        <div class="partition-value {rev_text_class}">{rev_var_pct:+.1f}%</div>
+                    </div>
                 </div>
             </div>
-        </div>
-        """, unsafe_allow_html=True)
+            """, unsafe_allow_html=True)
 
-    with col_right:
-        st.markdown(f"""
-        <div class="super-kpi-card card-expense">
-            <div class="super-kpi-header">💸 Budget Utilization</div>
-            <div class="partition-container">
-                <div class="partition">
-                    <div class="partition-label">PLANNED BUDGET</div>
-                    <div class="partition-value">{fmt_currency(total_planned_exp)}</div>
-                </div>
-                <div class="partition">
-                    <div class="partition-label">EXPENDITURE TO DATE</div>
-                    <div class="partition-value">{fmt_currency(total_actual_exp)}</div>
-                </div>
-                <div class="partition">
-                    <div class="partition-label">VARIANCE %</div>
-                    <div class="partition-value {exp_text_class}">{exp_var_pct:+.1f}%</div>
+        with col_right:
+            st.markdown(f"""
+            <div class="super-kpi-card card-expense">
+                <div class="super-kpi-header">💸 Budget Utilization</div>
+                <div class="partition-container">
+                    <div class="partition">
+                        <div class="partition-label">PLANNED BUDGET</div>
+                        <div class="partition-value">{fmt_currency(total_planned_exp)}</div>
+                    </div>
+                    <div class="partition">
+                        <div class="partition-label">EXPENDITURE TO DATE</div>
+                        <div class="partition-value">{fmt_currency(total_actual_exp)}</div>
+                    </div>
+                    <div class="partition">
+                        <div class="partition-label">VARIANCE %</div>
+                        <div class="partition-value {exp_text_class}">{exp_var_pct:+.1f}%</div>
+                    </div>
                 </div>
             </div>
-        </div>
-        """, unsafe_allow_html=True)
+            """, unsafe_allow_html=True)
 
-    st.write("<br>", unsafe_allow_html=True)
+        st.write("<br>", unsafe_allow_html=True)
 
-    def style_rows(row):
-        styles = [''] * len(row)
-        v = row['Change %']
-        if v > 0: styles[row.index.get_loc('Change %')] = 'background-color: #FEF2F2; color: #991B1B;'
-        elif v < 0: styles[row.index.get_loc('Change %')] = 'background-color: #F0FDF4; color: #166534;'
-        else: styles[row.index.get_loc('Change %')] = 'background-color: #FEF9C3; color: #854D0E;'
+        def style_rows(row):
+            styles = [''] * len(row)
+            v = row['Change %']
+            if v > 0: styles[row.index.get_loc('Change %')] = 'background-color: #FEF2F2; color: #991B1B;'
+            elif v < 0: styles[row.index.get_loc('Change %')] = 'background-color: #F0FDF4; color: #166534;'
+            else: styles[row.index.get_loc('Change %')] = 'background-color: #FEF9C3; color: #854D0E;'
         
-        if row['is_calc']:
-            return ['font-weight: 800; background-color: #F8FAFC; color: #1E293B; border-top: 2px solid #334155;'] * len(row)
-        return styles
-
-    styler = table_df.style.apply(style_rows, axis=1)
-    styler = styler.format({
-        'Budget': lambda x: fmt_currency(x),
-        'Actual': lambda x: fmt_currency(x),
-        'Change %': '{:+.1f}%'
-    })
-
-    st.dataframe(
-        styler,
-        width='stretch',
-        hide_index=True,
-        height=(len(table_df) * 36) + 40,
-        column_config={
-            "Particulars": st.column_config.TextColumn("PARTICULARS", width="large"),
-            "Budget": st.column_config.TextColumn("BUDGET", width="medium"),
-            "Actual": st.column_config.TextColumn("ACTUAL", width="medium"),
-            "Change %": st.column_config.TextColumn("CHANGE %", width="small"),
-            "is_calc": None
-        }
-    )
+            if row['is_calc']:
+                return ['font-weight: 800; background-color: #F8FAFC; color: #1E293B; border-top: 2px solid #334155;'] * len(row)
+            return styles
+
+        styler = table_df.style.apply(style_rows, axis=1)
+        styler = styler.format({
+            'Budget': lambda x: fmt_currency(x),
+            'Actual': lambda x: fmt_currency(x),
+            'Change %': '{:+.1f}%'
+        })
+
+        st.dataframe(
+            styler,
+            width='stretch',
+            hide_index=True,
+            height=(len(table_df) * 36) + 40,
+            column_config={
+                "Particulars": st.column_config.TextColumn("PARTICULARS", width="large"),
+                "Budget": st.column_config.TextColumn("BUDGET", width="medium"),
+                "Actual": st.column_config.TextColumn("ACTUAL", width="medium"),
+                "Change %": st.column_config.TextColumn("CHANGE %", width="small"),
+                "is_calc": None
+            }
+        )
+
+    budget_panel(df, st.session_state.budget_base_period)
+
+render_debug_panel()
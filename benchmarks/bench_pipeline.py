@@ -0,0 +1,189 @@
+"""
+Benchmark suite for the reporting pipeline.
+
+Times every stage the dashboard runs on a synthetic ledger and appends the results
+to a JSON-lines history so runs can be compared across commits:
+
+    python -m benchmarks.bench_pipeline --stores 10 --accounts 80 --months 36
+    python -m benchmarks.bench_pipeline --compare          # diff against the last matching run
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import report_engine as engine
+from benchmarks.synthetic_gl import generate_ledger_items
+
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def time_stage(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'repeat': repeat
+    }
+
+def peak_memory_mb(fn):
+    """Peak Python heap allocated while running `fn` (the response body itself excluded)."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+def run_suite(brand="pra", stores=5, accounts=60, partners=8, months=24, seed=42, repeat=3):
+    """
+    Run every pipeline stage once per `repeat` on the same synthetic ledger.
+
+    :return: (stage timings dict, row count)
+    """
+    items = generate_ledger_items(brand, stores=stores, accounts=accounts, partners=partners, months=months, seed=seed)
+    stages = {}
+
+    df, stages['load_transform'] = time_stage(lambda: engine.prepare_ledger_frame(items, brand), repeat)
+
+    # Full response decoding: json.loads + list of dicts vs the streaming columnar decoder
+    body = json.dumps({"data": {engine.READ_DATA_KEYS[brand]: items}}).encode("utf-8")
+    decode_legacy = lambda: engine.prepare_ledger_frame(json.loads(body)["data"][engine.READ_DATA_KEYS[brand]], brand)
+    decode_stream = lambda: engine.decode_read_stream((body[i:i + 65536] for i in range(0, len(body), 65536)), brand)
+    _, stages['decode_json_legacy'] = time_stage(decode_legacy, repeat)
+    _, stages['decode_json_streaming'] = time_stage(decode_stream, repeat)
+    stages['decode_json_legacy']['peak_mb'] = peak_memory_mb(decode_legacy)
+    stages['decode_json_streaming']['peak_mb'] = peak_memory_mb(decode_stream)
+
+    period_list = engine.get_period_list(df)
+    selected_periods = engine.select_periods(period_list, period_list[0], 12)
+    report_df, stages['filter'] = time_stage(lambda: engine.select_report_frame(df, selected_periods), repeat)
+
+    hierarchy, stages['hierarchy_periods'] = time_stage(
+        lambda: engine.build_hierarchy_data(report_df, selected_periods), repeat)
+
+    comp_df, _ = engine.store_comparison_frame(report_df, selected_periods)
+    store_list = sorted(comp_df['Store'].unique().tolist())
+    store_hierarchy, stages['hierarchy_stores'] = time_stage(
+        lambda: engine.build_hierarchy_data(comp_df, store_list, group_by='Store'), repeat)
+
+    cube, stages['aggregation_cube'] = time_stage(lambda: engine.build_aggregation_cube(df), repeat)
+    _, stages['cube_hierarchy_periods'] = time_stage(
+        lambda: engine.hierarchy_from_cube(cube, selected_periods, periods=selected_periods), repeat)
+    _, stages['cube_hierarchy_yoy'] = time_stage(
+        lambda: engine.hierarchy_from_cube(cube, selected_periods, periods=selected_periods, compare='yoy'), repeat)
+    comp_periods, _ = engine.store_comparison_periods(selected_periods)
+    _, stages['cube_hierarchy_stores'] = time_stage(
+        lambda: engine.hierarchy_from_cube(cube, group_by='Store', periods=comp_periods), repeat)
+
+    _, stages['profit_metrics'] = time_stage(
+        lambda: engine.calculate_profit_metrics(report_df, selected_periods, engine.REVENUE_CLASSES), repeat)
+
+    _, stages['render_pnl_html'] = time_stage(
+        lambda: engine.render_pnl_html(hierarchy, selected_periods, expand_all=True), repeat)
+    _, stages['render_store_html'] = time_stage(
+        lambda: engine.render_store_html(store_hierarchy, store_list, expand_all=True), repeat)
+
+    _, stages['trend_metrics'] = time_stage(lambda: engine.build_trend_data(df), repeat)
+    _, stages['anomaly_scan'] = time_stage(lambda: engine.scan_anomalies(df), repeat)
+
+    editor_df = df[df['DisplayPeriod'].isin(selected_periods)]
+    _, stages['editor_pivot'] = time_stage(lambda: engine.build_editor_pivot(editor_df), repeat)
+    _, stages['editor_page'] = time_stage(lambda: engine.editor_page(editor_df, page_size=100), repeat)
+
+    _, stages['excel_pnl'] = time_stage(
+        lambda: engine.build_excel_report(hierarchy, selected_periods, brand=brand, expand_all=True), repeat)
+    _, stages['excel_store'] = time_stage(
+        lambda: engine.build_excel_report(store_hierarchy, store_list, store_filter="Comparison", brand=brand, report_type="store"), repeat)
+
+    return stages, len(items)
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def find_baseline(history, params):
+    for record in reversed(history):
+        if record.get('params') == params:
+            return record
+    return None
+
+def print_report(record, baseline=None, threshold=0.10):
+    print(f"\n{record['rows']:,} rows | rev {record['revision'] or '?'} | {record['timestamp']}")
+    print(f"{'stage':<22}{'median':>12}{'min':>12}" + (f"{'baseline':>12}{'change':>10}" if baseline else ""))
+    regressions = []
+    for stage, stats in record['stages'].items():
+        line = f"{stage:<22}{stats['median'] * 1000:>10.1f}ms{stats['min'] * 1000:>10.1f}ms"
+        base = (baseline or {}).get('stages', {}).get(stage)
+        if base:
+            change = (stats['median'] - base['median']) / base['median'] if base['median'] else 0.0
+            flag = "  <-- slower" if change > threshold else ""
+            line += f"{base['median'] * 1000:>10.1f}ms{change:>+9.1%}{flag}"
+            if change > threshold:
+                regressions.append(stage)
+        if 'peak_mb' in stats:
+            line += f"   peak {stats['peak_mb']:.1f} MB"
+        print(line)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the GL reporting pipeline on a synthetic ledger.")
+    parser.add_argument("--brand", choices=["pra", "wed"], default="pra")
+    parser.add_argument("--stores", type=int, default=5)
+    parser.add_argument("--accounts", type=int, default=60)
+    parser.add_argument("--partners", type=int, default=8)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSON-lines history file")
+    parser.add_argument("--no-record", action="store_true", help="Do not append this run to the history")
+    parser.add_argument("--compare", action="store_true", help="Compare against the last run with the same parameters")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    params = {k: getattr(args, k) for k in ("brand", "stores", "accounts", "partners", "months", "seed")}
+    baseline = find_baseline(load_history(args.results), params) if args.compare else None
+
+    stages, rows = run_suite(repeat=args.repeat, **params)
+    record = {
+        'timestamp': datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'params': params,
+        'rows': rows,
+        'stages': stages
+    }
+    regressions = print_report(record, baseline, args.threshold)
+
+    if not args.no_record:
+        with open(args.results, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    if regressions:
+        print(f"\nRegressions over {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Local stand-in for the Fabric GraphQL endpoint.
+
+Serves the read, keyed readCells, readAggregate and upsert operations the dashboard
+uses from a synthetic ledger, with configurable latency, throttling (429) and error
+injection, so the read and save paths can be load-tested offline. Point the app at
+it through the usual environment:
+
+    python -m benchmarks.fabric_stub --port 8765 --latency 150 --throttle-rate 0.05
+    FABRIC_ENDPOINT=http://127.0.0.1:8765/graphql FABRIC_STATIC_TOKEN=local streamlit run app.py
+
+GET /stats returns request counters; POST /reset restores the seeded dataset.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from report_engine import BRAND_RENAMES, READ_AGGREGATE_KEYS, READ_CELLS_KEYS, READ_DATA_KEYS
+from benchmarks.synthetic_gl import MONTH_NAMES, generate_budget_items, generate_ledger_items
+
+UPSERT_FIELDS = {
+    "executesp_pr_upsertBalance": "pra",
+    "executesp_wd_upsertBalance": "wed"
+}
+
+class StubConfig:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, throttle_rate=0.0, error_rate=0.0,
+                 graphql_error_rate=0.0, retry_after=1.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.graphql_error_rate = graphql_error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+class StubLedgerStore:
+    """In-memory per-brand ledger that upserts mutate, keyed like the Fabric stored procedure."""
+
+    def __init__(self, dataset_kwargs):
+        self.dataset_kwargs = dataset_kwargs
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.items = {brand: generate_ledger_items(brand, **self.dataset_kwargs) for brand in READ_DATA_KEYS}
+            self.budget = generate_budget_items(
+                months=self.dataset_kwargs.get('months', 24), seed=self.dataset_kwargs.get('seed', 42))
+            self.index = {brand: {self._key(brand, row): row for row in rows} for brand, rows in self.items.items()}
+            self.next_id = {brand: len(rows) + 1 for brand, rows in self.items.items()}
+
+    @staticmethod
+    def _fields(brand):
+        # Reverse of the app's rename: which raw fields hold the account and partner
+        renames = {v: k for k, v in BRAND_RENAMES.get(brand, {}).items()}
+        return renames.get("account_name", "account_name"), renames.get("partner_id_name", "partner_id_name")
+
+    def _key(self, brand, row):
+        account_field, partner_field = self._fields(brand)
+        return (row["Year"], row["MonthName"], row["Store"], row[account_field], row["classification"], row[partner_field])
+
+    def read(self, brand):
+        with self._lock:
+            return list(self.items[brand])
+
+    def read_cells(self, brand, keys):
+        with self._lock:
+            index = self.index[brand]
+            rows = (index.get((k["year"], k["monthName"], k["store"], k["account_name"], k["classification"],
+                               k["partner_id_name"])) for k in keys)
+            return [dict(row) for row in rows if row is not None]
+
+    def read_aggregate(self, brand, periods, store=None):
+        account_field, partner_field = self._fields(brand)
+        wanted = {(p["year"], p["monthName"]) for p in periods}
+        totals = {}
+        with self._lock:
+            for row in self.items[brand]:
+                if (row["Year"], row["MonthName"]) not in wanted or (store is not None and row["Store"] != store):
+                    continue
+                key = (row["classification"], row[account_field], row[partner_field], row["Store"],
+                       row["Year"], row["MonthName"], row["Month"])
+                totals[key] = totals.get(key, 0.0) + float(row.get("Balance") or 0.0)
+        return [{"classification": c, account_field: a, partner_field: p, "Store": s, "Year": y, "MonthName": m,
+                 "Month": month, "Balance": round(balance, 2)}
+                for (c, a, p, s, y, m, month), balance in totals.items()]
+
+    def upsert(self, brand, variables):
+        account_field, partner_field = self._fields(brand)
+        key = (variables["year"], variables["monthName"], variables["store"], variables["account_name"],
+               variables["classification"], variables["partner_id_name"])
+        with self._lock:
+            row = self.index[brand].get(key)
+            if row is None:
+                row = {
+                    "id": self.next_id[brand], "Year": variables["year"], "MonthName": variables["monthName"],
+                    "Store": variables["store"], account_field: variables["account_name"],
+                    "classification": variables["classification"], partner_field: variables["partner_id_name"],
+                    "Month": None, "FinancialYearMonth": None
+                }
+                if variables["monthName"] in MONTH_NAMES:
+                    month = MONTH_NAMES.index(variables["monthName"]) + 1
+                    row["Month"], row["FinancialYearMonth"] = month, (month - 4) % 12 + 1
+                self.next_id[brand] += 1
+                self.items[brand].append(row)
+                self.index[brand][key] = row
+            row["Balance"] = variables.get("balance")
+            row["last_modified_at"] = variables.get("last_modified_at")
+            row["last_modified_user"] = variables.get("last_modified_user")
+        return 1
+
+class StubStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def bump(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+def resolve_operation(query):
+    """Pick the stub operation from the query text; the app only ever sends one root field."""
+    for field, brand in UPSERT_FIELDS.items():
+        if field in query:
+            return "upsert", brand, field
+    for brand, field in READ_CELLS_KEYS.items():
+        if field in query:
+            return "cells", brand, field
+    for brand, field in READ_AGGREGATE_KEYS.items():
+        if field in query:
+            return "aggregate", brand, field
+    for brand, field in READ_DATA_KEYS.items():
+        if field in query:
+            return "read", brand, field
+    if "executesp_pr_readBudgetData" in query:
+        return "budget", "pra", "executesp_pr_readBudgetData"
+    return None, None, None
+
+def make_handler(store, config, stats):
+    class FabricStubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._send(200, stats.snapshot())
+            else:
+                self._send(404, {"errors": [{"message": "Not found"}]})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length) if length else b"{}"
+            if self.path.rstrip("/") == "/reset":
+                store.reset()
+                stats.bump("reset")
+                return self._send(200, {"ok": True})
+
+            if config.latency_ms or config.jitter_ms:
+                delay = config.latency_ms + config.random.uniform(-config.jitter_ms, config.jitter_ms)
+                time.sleep(max(delay, 0.0) / 1000.0)
+
+            roll = config.random.random()
+            if roll < config.throttle_rate:
+                stats.bump("throttled")
+                return self._send(429, {"errors": [{"message": "Too many requests"}]},
+                                  {"Retry-After": str(config.retry_after)})
+            if roll < config.throttle_rate + config.error_rate:
+                stats.bump("http_error")
+                return self._send(500, {"errors": [{"message": "Injected server error"}]})
+
+            try:
+                body = json.loads(raw or b"{}")
+            except ValueError:
+                stats.bump("bad_request")
+                return self._send(400, {"errors": [{"message": "Invalid JSON body"}]})
+
+            operation, brand, field = resolve_operation(body.get("query") or "")
+            if operation is None:
+                stats.bump("unknown_operation")
+                return self._send(200, {"errors": [{"message": "Unknown operation"}]})
+            stats.bump(field)
+
+            if config.random.random() < config.graphql_error_rate:
+                stats.bump("graphql_error")
+                return self._send(200, {"data": None, "errors": [{"message": f"Injected error in {field}"}]})
+
+            if operation == "read":
+                return self._send(200, {"data": {field: store.read(brand)}})
+            if operation == "cells":
+                try:
+                    keys = json.loads((body.get("variables") or {}).get("keys") or "[]")
+                    return self._send(200, {"data": {field: store.read_cells(brand, keys)}})
+                except (ValueError, KeyError, TypeError) as e:
+                    return self._send(200, {"data": None, "errors": [{"message": f"Invalid keys: {e}"}]})
+            if operation == "aggregate":
+                variables = body.get("variables") or {}
+                try:
+                    periods = json.loads(variables.get("periods") or "[]")
+                    return self._send(200, {"data": {field: store.read_aggregate(brand, periods, variables.get("store"))}})
+                except (ValueError, KeyError, TypeError) as e:
+                    return self._send(200, {"data": None, "errors": [{"message": f"Invalid periods: {e}"}]})
+            if operation == "budget":
+                return self._send(200, {"data": {field: store.budget}})
+            try:
+                rows = store.upsert(brand, body.get("variables") or {})
+            except KeyError as e:
+                return self._send(200, {"data": None, "errors": [{"message": f"Missing variable {e}"}]})
+            return self._send(200, {"data": {field: {"rows_affected": rows}}})
+
+    return FabricStubHandler
+
+def serve(host="127.0.0.1", port=8765, config=None, dataset_kwargs=None):
+    """Build the stub server; call `serve_forever()` (or run it in a thread for tests)."""
+    store = StubLedgerStore(dataset_kwargs or {})
+    stats = StubStats()
+    server = ThreadingHTTPServer((host, port), make_handler(store, config or StubConfig(), stats))
+    server.ledger_store = store
+    server.stats = stats
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Fabric GraphQL stand-in with latency and failure injection.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean added latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- latency jitter (ms)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--graphql-error-rate", type=float, default=0.0, help="Fraction answered 200 with a GraphQL error")
+    parser.add_argument("--stores", type=int, default=5)
+    parser.add_argument("--accounts", type=int, default=60)
+    parser.add_argument("--partners", type=int, default=8)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    config = StubConfig(args.latency, args.jitter, args.throttle_rate, args.error_rate,
+                        args.graphql_error_rate, args.retry_after, args.seed)
+    dataset = {k: getattr(args, k) for k in ("stores", "accounts", "partners", "months", "seed")}
+    server = serve(args.host, args.port, config, dataset)
+    print(f"Fabric stub listening on http://{args.host}:{args.port}/graphql")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Load test for the Fabric read and save paths.
+
+Drives `report_engine.run_graphql` (including its 429 retries) with concurrent
+readers and savers against whatever FABRIC_ENDPOINT points at, normally the local
+stub from `benchmarks.fabric_stub`:
+
+    python -m benchmarks.load_fabric --endpoint http://127.0.0.1:8765/graphql --readers 4 --savers 8 --saves 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import report_engine as engine
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def timed(fn):
+    start = time.perf_counter()
+    try:
+        result = fn()
+        ok = bool(result) and "errors" not in result
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+def read_once(brand):
+    return timed(lambda: engine.run_graphql(engine.READ_QUERIES[brand]))
+
+def save_once(brand, rnd, targets):
+    target = rnd.choice(targets)
+    variables = dict(target)
+    variables["balance"] = round(rnd.uniform(-10_000, 250_000), 2)
+    variables["last_modified_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    variables["last_modified_user"] = "loadtest@local"
+    return timed(lambda: engine.run_graphql(engine.UPSERT_MUTATIONS[brand], variables))
+
+def summarize(name, results, wall):
+    latencies = [r[0] for r in results]
+    failures = sum(1 for r in results if not r[1])
+    if not results:
+        return
+    print(f"{name:<8}{len(results):>7} calls {failures:>5} failed  "
+          f"p50 {percentile(latencies, 50) * 1000:>8.1f}ms  p95 {percentile(latencies, 95) * 1000:>8.1f}ms  "
+          f"mean {statistics.fmean(latencies) * 1000:>8.1f}ms  {len(results) / wall:>7.1f}/s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent load test of the Fabric read and save paths.")
+    parser.add_argument("--endpoint", default=None, help="Overrides FABRIC_ENDPOINT")
+    parser.add_argument("--brand", choices=["pra", "wed"], default="pra")
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--reads", type=int, default=10)
+    parser.add_argument("--savers", type=int, default=4)
+    parser.add_argument("--saves", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.endpoint:
+        os.environ["FABRIC_ENDPOINT"] = args.endpoint
+    os.environ.setdefault("FABRIC_STATIC_TOKEN", "local")
+
+    # One read up front gives real keys to upsert against
+    df = engine.load_data(args.brand)
+    if df.empty:
+        print("Endpoint returned no ledger rows.", file=sys.stderr)
+        return 1
+    keys = df[['Year', 'MonthName', 'Store', 'account_name', 'classification', 'partner_id_name']].drop_duplicates().head(500)
+    targets = [{
+        "year": int(r.Year), "monthName": r.MonthName, "store": r.Store, "account_name": r.account_name,
+        "classification": r.classification, "partner_id_name": r.partner_id_name
+    } for r in keys.itertuples(index=False)]
+    rnd = random.Random(args.seed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.readers) as pool:
+        reads = list(pool.map(lambda _: read_once(args.brand), range(args.reads)))
+    summarize("read", reads, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.savers) as pool:
+        saves = list(pool.map(lambda _: save_once(args.brand, rnd, targets), range(args.saves)))
+    summarize("save", saves, time.perf_counter() - start)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Seeded synthetic General Ledger generator.
+
+Produces rows shaped exactly like the `executesp_*_readData` GraphQL responses
+(Wedtree rows use `Ledger`/`ContraName`), so they can be fed through the same
+`report_engine` transforms as live Fabric data.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+from report_engine import CLASSIFICATION_ORDER, READ_DATA_KEYS
+
+MONTH_NAMES = [
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December'
+]
+
+# Rough monthly magnitude per classification, so totals look like a real P&L
+CLASS_SCALE = {
+    'Net Sales': 2_500_000, 'Other Income': 40_000, 'Cost of Goods Sold (COGS)': 1_400_000,
+    'Employee cost': 300_000, 'Rent and Utilities': 180_000, 'Marketing and Advertisment': 60_000,
+    'Admin Expenses': 45_000, 'Logistics': 35_000, 'Other Expenses': 20_000, 'Finance cost': 25_000,
+    'Supplier Payments': 900_000, 'Purchase Expense': 700_000, 'Depreciation': 50_000
+}
+
+def month_sequence(months, start_year=2021, start_month=4):
+    """(year, month) pairs for `months` consecutive months starting at start_year/start_month."""
+    sequence = []
+    for offset in range(months):
+        index = (start_month - 1) + offset
+        sequence.append((start_year + index // 12, index % 12 + 1))
+    return sequence
+
+def generate_accounts(accounts, seed=0):
+    """Spread `accounts` ledger accounts across the classification order."""
+    rnd = random.Random(seed)
+    chart = []
+    for i in range(accounts):
+        classification = CLASSIFICATION_ORDER[i % len(CLASSIFICATION_ORDER)]
+        chart.append((classification, f"{classification.split(' ')[0]} Ledger {i + 1:03d}", rnd.uniform(0.2, 1.8)))
+    return chart
+
+def generate_ledger_items(brand="pra", stores=5, accounts=60, partners=8, months=24,
+                          start_year=2021, start_month=4, seed=42):
+    """
+    Build stores x accounts x partners x months ledger rows for `brand`.
+
+    :return: list of dicts with the brand's readData field names
+    """
+    rnd = random.Random(seed)
+    chart = generate_accounts(accounts, seed)
+    store_names = [f"Store {i + 1:02d}" for i in range(stores)]
+    periods = month_sequence(months, start_year, start_month)
+    account_field, partner_field = ("Ledger", "ContraName") if brand == "wed" else ("account_name", "partner_id_name")
+    stamp_base = datetime(start_year, start_month, 1, tzinfo=timezone.utc)
+
+    items = []
+    row_id = 0
+    for store in store_names:
+        store_factor = rnd.uniform(0.6, 1.4)
+        for classification, account, weight in chart:
+            scale = CLASS_SCALE.get(classification, 50_000) * weight * store_factor / max(partners, 1)
+            for p in range(partners):
+                partner = f"Partner {p + 1:03d}"
+                level = scale * rnd.uniform(0.5, 1.5)
+                for year, month in periods:
+                    row_id += 1
+                    # Seasonal drift plus noise, with an occasional reversal
+                    balance = level * (1 + 0.15 * ((month % 12) - 6) / 6) * rnd.gauss(1.0, 0.12)
+                    if rnd.random() < 0.01:
+                        balance = -balance
+                    modified = stamp_base + timedelta(days=rnd.randint(0, 30 * months))
+                    items.append({
+                        "id": row_id,
+                        account_field: account,
+                        "classification": classification,
+                        partner_field: partner,
+                        "Store": store,
+                        "Balance": round(balance, 2),
+                        "Year": year,
+                        "MonthName": MONTH_NAMES[month - 1],
+                        "Month": month,
+                        "FinancialYearMonth": (month - 4) % 12 + 1,
+                        "last_modified_at": modified.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                        "last_modified_user": "synthetic@generator"
+                    })
+    return items
+
+def generate_read_response(brand="pra", **kwargs):
+    """A full GraphQL response body, as `run_graphql(READ_QUERIES[brand])` would return it."""
+    return {"data": {READ_DATA_KEYS[brand]: generate_ledger_items(brand, **kwargs)}}
+
+def generate_budget_items(months=24, start_year=2021, start_month=4, seed=42):
+    """Rows shaped like `executesp_pr_readBudgetData` (one budget per classification and month)."""
+    rnd = random.Random(seed)
+    items = []
+    for year, month in month_sequence(months, start_year, start_month):
+        for classification in CLASSIFICATION_ORDER:
+            items.append({
+                "Particulars": classification,
+                "Month": MONTH_NAMES[month - 1],
+                "Year": year,
+                "Budget": round(CLASS_SCALE.get(classification, 50_000) * 5 * rnd.uniform(0.9, 1.1), 2)
+            })
+    return items
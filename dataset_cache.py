@@ -0,0 +1,259 @@
+"""
+Per-process cache of loaded brand datasets for the Streamlit app.
+
+`BrandDatasetCache` keeps the most recently used brands in memory, and `DatasetHandle`
+names one version of a brand's dataset for the caches derived from it. app.py builds
+one cache per process from:
+
+    BRAND_CACHE_MAX_ENTRIES=4     brands kept loaded
+    BRAND_CACHE_MAX_MB=512        memory budget for datasets and their aggregates
+    BRAND_CACHE_TTL=300           seconds before a brand is reloaded from Fabric
+"""
+import copy
+import io
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from report_engine import Hierarchy, SingleFlight, apply_ledger_changes, apply_ledger_delta
+
+def estimate_nbytes(obj):
+    """Rough in-memory size of a cached object, used for the LRU memory budget."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, io.BytesIO):
+        return obj.getbuffer().nbytes
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(k) + estimate_nbytes(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(v) for v in obj)
+    return sys.getsizeof(obj)
+
+class DatasetHandle:
+    """
+    Identity of one version of a brand's cached dataset: the brand plus a version id that
+    bumps on every load and every applied save. Derived caches key on the handle and their
+    filter parameters, so a lookup hashes two scalars instead of a ledger frame.
+    """
+    __slots__ = ('brand', 'version')
+
+    def __init__(self, brand, version):
+        self.brand = brand
+        self.version = version
+
+    def __eq__(self, other):
+        return isinstance(other, DatasetHandle) and (self.brand, self.version) == (other.brand, other.version)
+
+    def __hash__(self):
+        return hash((self.brand, self.version))
+
+    def __repr__(self):
+        return f"DatasetHandle({self.brand!r}, {self.version})"
+
+class BrandDatasetCache:
+    """
+    Bounded LRU of loaded brand datasets plus the aggregates derived from them.
+
+    Switching brands becomes a dictionary lookup instead of a Fabric fetch. Entries
+    expire after `ttl` seconds (same freshness as the old `load_data` cache) and the
+    least recently used brands are evicted once `max_bytes` is exceeded. Sessions that
+    miss at the same moment (e.g. right after a TTL expiry) share one load, and one
+    build of each derived aggregate. Aggregates of a version that is no longer the
+    brand's current one (a session still editing an older load) go to a separate,
+    bounded LRU rather than being rebuilt on every rerun.
+    """
+
+    def __init__(self, max_entries=4, max_bytes=512 * 1024 * 1024, ttl=300, max_derived=32):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_derived = max_derived
+        self._entries = OrderedDict()
+        self._older = OrderedDict()
+        self._version = 0
+        self._lock = threading.RLock()
+        self._loads = SingleFlight("brand_load")
+        self._builds = SingleFlight("derived_build")
+
+    def _expired(self, entry):
+        return (time.monotonic() - entry['loaded_at']) > self.ttl
+
+    def total_bytes(self):
+        with self._lock:
+            return (sum(e['nbytes'] + sum(d[1] for d in e['derived'].values()) for e in self._entries.values())
+                    + sum(d[1] for d in self._older.values()))
+
+    def _evict(self, keep=None):
+        while self._older and self.total_bytes() > self.max_bytes:
+            self._older.popitem(last=False)
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes() > self.max_bytes):
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                # Never evict the entry that was just requested; trim its aggregates instead
+                entry = self._entries[oldest]
+                if not entry['derived']:
+                    break
+                entry['derived'].popitem(last=False)
+                continue
+            self._entries.pop(oldest)
+
+    def get(self, brand):
+        with self._lock:
+            entry = self._entries.get(brand)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                self._entries.pop(brand)
+                return None
+            self._entries.move_to_end(brand)
+            return entry['df']
+
+    def put(self, brand, df):
+        with self._lock:
+            self._version += 1
+            self._entries[brand] = {
+                'df': df,
+                'handle': DatasetHandle(brand, self._version),
+                'nbytes': estimate_nbytes(df),
+                'loaded_at': time.monotonic(),
+                'derived': OrderedDict()
+            }
+            self._entries.move_to_end(brand)
+            self._evict(keep=brand)
+            return df
+
+    def get_or_load(self, brand, loader):
+        df = self.get(brand)
+        if df is None:
+            df = self._loads.do(brand, lambda: self._load(brand, loader))
+        return df
+
+    def _load(self, brand, loader):
+        # A caller that missed just before the previous load finished finds it cached here
+        df = self.get(brand)
+        if df is not None:
+            return df
+        df = loader(brand)
+        # An empty read is served but not cached, so a bad response is not pinned for the whole TTL
+        return self.put(brand, df) if not df.empty else df
+
+    def handle(self, brand):
+        """Handle of the dataset currently cached for `brand`, or None."""
+        with self._lock:
+            entry = self._entries.get(brand)
+            return entry['handle'] if entry is not None else None
+
+    def derived(self, handle, key, builder):
+        """
+        Memoise an aggregate computed from the dataset identified by `handle` (hierarchies,
+        pivots, rendered HTML, exports...). `key` carries only the filter parameters. Stored
+        with the cached dataset while it is still that version, and in the older-versions
+        LRU otherwise, so a session holding an older load never pollutes a fresher entry.
+        """
+        if handle is None:
+            return builder()
+        with self._lock:
+            derived, derived_key = self._derived_for(handle, key)
+            if derived_key in derived:
+                derived.move_to_end(derived_key)
+                return derived[derived_key][0]
+
+        value = self._builds.do((handle, key), builder)
+
+        with self._lock:
+            derived, derived_key = self._derived_for(handle, key)
+            derived[derived_key] = (value, estimate_nbytes(value))
+            while len(derived) > self.max_derived:
+                derived.popitem(last=False)
+            self._evict(keep=handle.brand)
+        return value
+
+    def _derived_for(self, handle, key):
+        # The current entry's aggregates, or the shared LRU of aggregates of older versions
+        entry = self._entries.get(handle.brand)
+        if entry is not None and entry['handle'] == handle:
+            return entry['derived'], key
+        return self._older, (handle, key)
+
+    def invalidate(self, brand=None):
+        with self._lock:
+            if brand is None:
+                self._entries.clear()
+                self._older.clear()
+            else:
+                self._entries.pop(brand, None)
+                for older_key in [k for k in self._older if k[0].brand == brand]:
+                    del self._older[older_key]
+
+    def apply_changes(self, brand, changes):
+        """
+        Fold ledger edits Fabric has accepted into the cached dataset, instead of dropping
+        everything and refetching. The patched frame and patched copies of the cached
+        hierarchies become a new version with a new handle; readers still rendering the
+        old version keep their untouched objects.
+
+        :return: the new handle, or None if `brand` is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(brand)
+            shared = OrderedDict(entry['derived']) if entry is not None else None
+        while entry is not None:
+            # Patched outside the lock, so other sessions' lookups don't wait on the copies
+            df, deltas = apply_ledger_changes(entry['df'], changes)
+            derived = self._patched_derived(shared, deltas)
+            with self._lock:
+                if self._entries.get(brand) is not entry:
+                    # Reloaded or patched meanwhile: fold into that version instead
+                    entry = self._entries.get(brand)
+                    shared = OrderedDict(entry['derived']) if entry is not None else None
+                    continue
+                self._version += 1
+                patched = dict(entry, df=df, handle=DatasetHandle(brand, self._version),
+                               nbytes=estimate_nbytes(df), derived=derived)
+                self._entries[brand] = patched
+                self._evict(keep=brand)
+                return patched['handle']
+        return None
+
+    def local_version(self, handle, df, changes):
+        """
+        A private version of the dataset `handle` (whose frame is `df`) with `changes`
+        applied, for edits saved to the journal but not yet accepted by Fabric. The shared
+        entry is left alone; the new handle's aggregates start as patched copies of the
+        shared hierarchies and live with the other non-current versions.
+
+        :return: (patched frame, new handle); the handle is None if `handle` is
+        """
+        df, deltas = apply_ledger_changes(df, changes)
+        if handle is None:
+            return df, None
+        with self._lock:
+            entry = self._entries.get(handle.brand)
+            shared = OrderedDict(entry['derived'] if entry is not None and entry['handle'] == handle else {})
+            self._version += 1
+            local = DatasetHandle(handle.brand, self._version)
+        derived = self._patched_derived(shared, deltas)
+        with self._lock:
+            for key, value in derived.items():
+                self._older[(local, key)] = value
+            while len(self._older) > self.max_derived:
+                self._older.popitem(last=False)
+            self._evict(keep=handle.brand)
+        return df, local
+
+    @staticmethod
+    def _patched_derived(derived, deltas):
+        # Flat aggregates are cheap to rebuild; only hierarchies are carried over, as copies
+        patched = OrderedDict()
+        for key, (value, _) in derived.items():
+            if isinstance(value, Hierarchy):
+                value = copy.deepcopy(value)
+                for delta in deltas:
+                    apply_ledger_delta(value, **delta)
+                patched[key] = (value, estimate_nbytes(value))
+        return patched
@@ -0,0 +1,354 @@
+"""
+Durable write-ahead journal for Ledger Editor saves.
+
+Every edit is written to a local SQLite journal before anything is sent to Fabric.
+A background drainer replays pending rows through the brand's upsert mutation,
+retrying failures with backoff and recording the outcome of each row, so a browser
+refresh, a Fabric outage or a process restart never loses work and saving never
+blocks the UI. Edits saved while Fabric could not be read are journaled unchecked;
+the drainer checks them for conflicting edits before sending and holds back any
+it finds as conflict rows:
+
+    GL_EDIT_JOURNAL=path.sqlite3     journal location (default edit_journal.sqlite3)
+    GL_JOURNAL_MAX_ATTEMPTS=8        attempts before a row is marked failed
+
+    python -m edit_journal --status          # row counts per brand and status
+    python -m edit_journal --retry-failed    # requeue failed rows
+    python -m edit_journal --drain           # send every due row once (reads .env for Fabric)
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime, timezone
+
+import report_engine as engine
+
+PENDING, SENT, FAILED, SUPERSEDED, CONFLICT = "pending", "sent", "failed", "superseded", "conflict"
+
+# Fields that identify one ledger cell in the upsert stored procedure
+CELL_KEY_FIELDS = ("year", "monthName", "store", "account_name", "classification", "partner_id_name")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_edits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    user TEXT,
+    cell_key TEXT NOT NULL,
+    variables TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    base_modified_at TEXT,
+    checked INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pending_edits_status ON pending_edits (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS pending_edits_cell ON pending_edits (brand, cell_key, status);
+"""
+
+# Columns added since the first journals were written; older files get them when opened
+ADDED_COLUMNS = {"base_modified_at": "TEXT", "checked": "INTEGER NOT NULL DEFAULT 1"}
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def cell_key(variables):
+    return json.dumps([variables.get(f) for f in CELL_KEY_FIELDS])
+
+class EditJournal:
+    def __init__(self, path=None, max_attempts=None):
+        self.path = path or os.getenv("GL_EDIT_JOURNAL", "edit_journal.sqlite3")
+        self.max_attempts = max_attempts or int(os.getenv("GL_JOURNAL_MAX_ATTEMPTS", "8"))
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            existing = {r["name"] for r in conn.execute("PRAGMA table_info(pending_edits)")}
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE pending_edits ADD COLUMN {column} {definition}")
+
+    def _connect(self):
+        # One short-lived connection per operation keeps this safe to share between threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, brand, user, variables_list, base_stamps=None, checked=True):
+        """
+        Journal a save. Older unsent edits to the same cells are superseded, so a
+        retried stale value can never overwrite a newer one.
+
+        :param base_stamps: per row, the cell's `last_modified_at` the edit was made against
+        :param checked: False if the save could not check Fabric for conflicting edits;
+                        the drainer checks against `base_stamps` before sending
+        :return: batch id
+        """
+        batch_id = uuid.uuid4().hex[:12]
+        stamp = _now()
+        base_stamps = base_stamps or [None] * len(variables_list)
+        with closing(self._connect()) as conn, conn:
+            for variables, base in zip(variables_list, base_stamps):
+                key = cell_key(variables)
+                conn.execute(
+                    "UPDATE pending_edits SET status = ?, updated_at = ? WHERE brand = ? AND cell_key = ? AND status IN (?, ?, ?)",
+                    (SUPERSEDED, stamp, brand, key, PENDING, FAILED, CONFLICT))
+                conn.execute(
+                    "INSERT INTO pending_edits (batch_id, brand, user, cell_key, variables, base_modified_at, checked, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (batch_id, brand, user, key, json.dumps(variables), base, int(checked), stamp, stamp))
+        return batch_id
+
+    def due(self, limit=50):
+        """Pending rows whose next attempt is due, oldest first."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM pending_edits WHERE status = ? AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (PENDING, time.time(), limit)).fetchall()
+        return [dict(r) for r in rows]
+
+    def mark_sent(self, row_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE pending_edits SET status = ?, attempts = attempts + 1, last_error = NULL, updated_at = ? "
+                         "WHERE id = ? AND status = ?", (SENT, _now(), row_id, PENDING))
+
+    def mark_error(self, row_id, error):
+        """Record a failed attempt; retried with exponential backoff until `max_attempts`."""
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT attempts FROM pending_edits WHERE id = ?", (row_id,)).fetchone()
+            if row is None:
+                return
+            attempts = row["attempts"] + 1
+            status = FAILED if attempts >= self.max_attempts else PENDING
+            delay = min(5 * (2 ** (attempts - 1)), 300)
+            conn.execute(
+                "UPDATE pending_edits SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (status, attempts, str(error)[:500], time.time() + delay, _now(), row_id, PENDING))
+
+    def mark_conflict(self, row_id, conflict):
+        """Hold back a row whose cell Fabric changed since the edit was made (see `detect_conflicts`)."""
+        detail = f"Changed in Fabric to {conflict['server_value']} by {conflict['server_modified_user']} at {conflict['server_modified_at']}"
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE pending_edits SET status = ?, last_error = ?, updated_at = ? WHERE id = ? AND status = ?",
+                         (CONFLICT, detail, _now(), row_id, PENDING))
+
+    def resolve_conflicts(self, brand=None, user=None, overwrite=False):
+        """
+        Settle conflict rows: `overwrite` queues them to be sent as they are, otherwise
+        they are dropped in favour of Fabric's values. Returns how many rows were settled.
+        """
+        clauses, params = ["status = ?"], [CONFLICT]
+        if brand is not None:
+            clauses.append("brand = ?")
+            params.append(brand)
+        if user is not None:
+            clauses.append("user = ?")
+            params.append(user)
+        update = "status = ?, checked = 1, attempts = 0, next_attempt_at = 0" if overwrite else "status = ?"
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                f"UPDATE pending_edits SET {update}, updated_at = ? WHERE {' AND '.join(clauses)}",
+                [PENDING if overwrite else SUPERSEDED, _now()] + params)
+            return cursor.rowcount
+
+    def retry_failed(self, brand=None, user=None):
+        """Put failed rows back in the queue; returns how many were requeued."""
+        clauses, params = ["status = ?"], [FAILED]
+        if brand is not None:
+            clauses.append("brand = ?")
+            params.append(brand)
+        if user is not None:
+            clauses.append("user = ?")
+            params.append(user)
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                f"UPDATE pending_edits SET status = ?, attempts = 0, next_attempt_at = 0, updated_at = ? WHERE {' AND '.join(clauses)}",
+                [PENDING, _now()] + params)
+            return cursor.rowcount
+
+    def status_counts(self, brand=None, user=None, batch_id=None):
+        clauses, params = [], []
+        for column, value in (("brand", brand), ("user", user), ("batch_id", batch_id)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f"SELECT status, COUNT(*) AS n FROM pending_edits {where} GROUP BY status", params).fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    def rows(self, brand=None, user=None, statuses=(PENDING, FAILED), limit=200):
+        """Journal rows with their variables decoded, oldest first; `limit=None` returns them all."""
+        clauses = [f"status IN ({', '.join('?' * len(statuses))})"]
+        params = list(statuses)
+        if brand is not None:
+            clauses.append("brand = ?")
+            params.append(brand)
+        if user is not None:
+            clauses.append("user = ?")
+            params.append(user)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f"SELECT * FROM pending_edits WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?",
+                                params + [-1 if limit is None else limit]).fetchall()
+        return [dict(r, variables=json.loads(r["variables"])) for r in rows]
+
+    def unsent_base_stamps(self, brand, user):
+        """
+        {(store, classification, account, partner, period): last_modified_at} for the cells
+        `user` has pending or failed edits to: the stamp each edit was made against, which
+        Fabric still holds while the user's own frames already carry the edit's stamp.
+        """
+        stamps = {}
+        for row in self.rows(brand=brand, user=user, limit=None):
+            stamps[engine.change_key(engine.upsert_change(row["variables"]))] = row["base_modified_at"]
+        return stamps
+
+def send_upsert(brand, variables):
+    """Default drainer transport: the brand's upsert mutation. Raises on any failure."""
+    response = engine.run_graphql(engine.UPSERT_MUTATIONS[brand], variables)
+    if not response or "errors" in response:
+        raise RuntimeError(response["errors"][0]["message"] if response else "No response")
+    return response
+
+def fetch_conflicts(brand, variables_list, base_stamps):
+    """
+    Default drainer check for rows journaled unchecked: per row, its cell as
+    `detect_conflicts` reports it if Fabric changed it since `base_stamps`, else None.
+    Raises on any failure.
+    """
+    changes = [engine.upsert_change(variables) for variables in variables_list]
+    keys = [engine.change_key(change) for change in changes]
+    conflicts = engine.detect_conflicts(None, engine.fetch_cells(brand, changes), changes,
+                                        loaded_stamps=dict(zip(keys, base_stamps)))
+    by_key = {engine.change_key(conflict): conflict for conflict in conflicts}
+    return [by_key.get(key) for key in keys]
+
+class JournalDrainer:
+    """
+    Daemon thread replaying due journal rows to Fabric, one at a time in journal order.
+    Unchecked rows are first checked for conflicting edits, one `check` call per brand
+    and pass. `on_applied(brand, changes)` is called after each pass with the cells as
+    Fabric now holds them (sent edits, and Fabric's value for conflict rows), e.g. to
+    fold them into a cached dataset.
+    """
+
+    def __init__(self, journal, send=send_upsert, check=fetch_conflicts, on_applied=None, interval=5.0):
+        self.journal = journal
+        self.send = send
+        self.check = check
+        self.on_applied = on_applied
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="gl-edit-journal", daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _check_unchecked(self, rows):
+        # {row id: conflict or None} for the unchecked rows; a failed check backs its rows off like a failed send
+        results, by_brand = {}, {}
+        for row in rows:
+            if not row["checked"]:
+                by_brand.setdefault(row["brand"], []).append(row)
+        for brand, unchecked in by_brand.items():
+            try:
+                conflicts = self.check(brand, [json.loads(r["variables"]) for r in unchecked],
+                                       [r["base_modified_at"] for r in unchecked])
+            except Exception as e:
+                for row in unchecked:
+                    self.journal.mark_error(row["id"], e)
+                continue
+            results.update(zip([r["id"] for r in unchecked], conflicts))
+        return results
+
+    def drain_once(self):
+        """Send every due row once; returns (sent, errors)."""
+        sent = errors = 0
+        applied = {}
+        rows = self.journal.due()
+        checks = self._check_unchecked(rows)
+        for row in rows:
+            if self._stop.is_set():
+                break
+            if not row["checked"]:
+                if row["id"] not in checks:
+                    errors += 1
+                    continue
+                conflict = checks[row["id"]]
+                if conflict is not None:
+                    self.journal.mark_conflict(row["id"], conflict)
+                    applied.setdefault(row["brand"], []).append(engine.server_change(conflict))
+                    continue
+            variables = json.loads(row["variables"])
+            try:
+                self.send(row["brand"], variables)
+            except Exception as e:
+                self.journal.mark_error(row["id"], e)
+                errors += 1
+            else:
+                self.journal.mark_sent(row["id"])
+                applied.setdefault(row["brand"], []).append(engine.upsert_change(variables))
+                sent += 1
+        if self.on_applied is not None:
+            for brand, changes in applied.items():
+                self.on_applied(brand, changes)
+        return sent, errors
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.drain_once()
+            except sqlite3.Error:
+                pass
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or replay the Ledger Editor save journal.")
+    parser.add_argument("--journal", default=None, help="Overrides GL_EDIT_JOURNAL")
+    parser.add_argument("--status", action="store_true", help="Print row counts per brand and status")
+    parser.add_argument("--retry-failed", action="store_true", help="Requeue rows that exhausted their attempts")
+    parser.add_argument("--drain", action="store_true", help="Send every due row once and exit")
+    args = parser.parse_args(argv)
+
+    # --drain sends through Fabric, which needs the endpoint and credentials from .env
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    journal = EditJournal(args.journal)
+    if args.retry_failed:
+        print(f"Requeued {journal.retry_failed()} row(s).")
+    if args.drain:
+        sent, errors = JournalDrainer(journal).drain_once()
+        print(f"Sent {sent}, failed {errors}.")
+    if args.status or not (args.retry_failed or args.drain):
+        for brand in engine.BRAND_NAMES:
+            counts = journal.status_counts(brand=brand)
+            if counts:
+                print(f"{brand:<6}" + "  ".join(f"{status} {n}" for status, n in sorted(counts.items())))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
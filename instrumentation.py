@@ -0,0 +1,162 @@
+"""
+Per-rerun instrumentation: timing spans, Fabric call statistics and filter row counts.
+
+A trace is started at the top of each Streamlit rerun and is context-local, so the
+engine can record into it without knowing about Streamlit. When no trace is active
+every recorder is a no-op (batch CLI, benchmarks).
+
+Finished traces are kept in a small per-process ring buffer for the admin debug
+panel and, when configured, emitted as JSON lines:
+
+    GL_METRICS_LOG=1            log each trace on the "gl.metrics" logger
+    GL_METRICS_FILE=path.jsonl  append each trace to a file
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+logger = logging.getLogger("gl.metrics")
+
+_current_trace = ContextVar("gl_current_trace", default=None)
+_recent_traces = deque(maxlen=200)
+_recent_lock = threading.Lock()
+
+class RerunTrace:
+    def __init__(self, session_id=None, user=None, context=None):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.user = user
+        self.context = dict(context or {})
+        self.started_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        self._t0 = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.graphql_calls = []
+        self.row_counts = []
+        self._depth = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self._t0
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'session_id': self.session_id,
+            'user': self.user,
+            'started_at': self.started_at,
+            'duration_ms': round((self.duration if self.duration is not None else self.elapsed()) * 1000, 2),
+            'context': self.context,
+            'spans': self.spans,
+            'graphql_calls': self.graphql_calls,
+            'row_counts': self.row_counts,
+            'graphql_summary': self.graphql_summary()
+        }
+
+    def graphql_summary(self):
+        calls = self.graphql_calls
+        return {
+            'count': len(calls),
+            'total_ms': round(sum(c['latency_ms'] for c in calls), 2),
+            'request_bytes': sum(c['request_bytes'] for c in calls),
+            'response_bytes': sum(c['response_bytes'] for c in calls),
+            'errors': sum(1 for c in calls if not c['ok'])
+        }
+
+def current_trace():
+    return _current_trace.get()
+
+def start_trace(session_id=None, user=None, context=None):
+    """Begin a new rerun trace, finishing any trace left open by an earlier st.stop()."""
+    previous = _current_trace.get()
+    if previous is not None and previous.duration is None:
+        finish_trace(previous)
+    trace = RerunTrace(session_id, user, context)
+    _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace=None):
+    trace = trace or _current_trace.get()
+    if trace is None or trace.duration is not None:
+        return trace
+    trace.duration = trace.elapsed()
+    with _recent_lock:
+        _recent_traces.append(trace)
+    _export(trace)
+    return trace
+
+def recent_traces(session_id=None, limit=20):
+    with _recent_lock:
+        traces = [t for t in _recent_traces if session_id is None or t.session_id == session_id]
+    return traces[-limit:]
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block of work as a named stage of the current rerun."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    trace._depth += 1
+    try:
+        yield
+    finally:
+        trace._depth -= 1
+        trace.spans.append({
+            'name': name,
+            'start_ms': round((start - trace._t0) * 1000, 2),
+            'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+            'depth': trace._depth,
+            **attrs
+        })
+
+def record_rows(step, rows):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.row_counts.append({'step': step, 'rows': int(rows)})
+
+def set_context(**context):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.context.update(context)
+
+def operation_name(query):
+    """First root field of a GraphQL document, e.g. `executesp_pr_readData`."""
+    body = query.split("{", 1)[1] if "{" in query else query
+    for token in body.replace("(", " ").replace("{", " ").split():
+        return token
+    return "unknown"
+
+def record_graphql(query, latency, request_bytes, response_bytes, status, attempts=1, ok=True):
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace.graphql_calls.append({
+        'operation': operation_name(query),
+        'latency_ms': round(latency * 1000, 2),
+        'request_bytes': int(request_bytes),
+        'response_bytes': int(response_bytes),
+        'status': status,
+        'attempts': attempts,
+        'ok': ok
+    })
+
+def _export(trace):
+    if os.getenv("GL_METRICS_LOG") == "1" or os.getenv("GL_METRICS_FILE"):
+        line = json.dumps(trace.to_dict(), default=str)
+        if os.getenv("GL_METRICS_LOG") == "1":
+            logger.info(line)
+        path = os.getenv("GL_METRICS_FILE")
+        if path:
+            try:
+                with _recent_lock, open(path, "a") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.warning("Could not write metrics to %s: %s", path, e)
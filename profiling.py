@@ -0,0 +1,142 @@
+"""
+Opt-in sampling profiler for dashboard reruns.
+
+A daemon thread samples the rerun thread's Python stack at a fixed interval, so a
+slow filter combination can be profiled where it happens without slowing down every
+other session. Each profiled rerun writes two reports named after its time and trace:
+
+    <time>_<trace>.folded   collapsed stacks, one "frame;frame;frame count" line per stack
+                            (flamegraph.pl, speedscope.app and inferno read this directly)
+    <time>_<trace>.txt      the rerun context (view, filters) and the hottest functions
+
+    GL_PROFILE=1                 profile every rerun (admins can also toggle it per session)
+    GL_PROFILE_DIR=profiles      report directory
+    GL_PROFILE_INTERVAL_MS=5     sampling interval
+    GL_PROFILE_MAX_SECONDS=120   a sampler left running by an aborted rerun stops itself
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+_active = {}
+_active_lock = threading.Lock()
+
+def profiling_enabled():
+    return os.getenv("GL_PROFILE") == "1"
+
+def profile_dir():
+    return os.getenv("GL_PROFILE_DIR", "profiles")
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Samples one thread's stack every `interval` seconds until stopped."""
+
+    def __init__(self, thread_id=None, interval=None, max_seconds=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval or float(os.getenv("GL_PROFILE_INTERVAL_MS", "5")) / 1000
+        self.max_seconds = max_seconds or float(os.getenv("GL_PROFILE_MAX_SECONDS", "120"))
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._t0 = None
+
+    def start(self):
+        # One sampler per rerun thread; a rerun aborted by st.rerun()/st.stop() never stopped its own
+        with _active_lock:
+            previous = _active.get(self.thread_id)
+            _active[self.thread_id] = self
+        if previous is not None:
+            previous.stop()
+        self._t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="gl-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        with _active_lock:
+            if _active.get(self.thread_id) is self:
+                del _active[self.thread_id]
+        return self
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+            self.duration = time.perf_counter() - self._t0
+            if self.duration > self.max_seconds:
+                break
+
+    def folded(self):
+        """Collapsed stacks, root frame first."""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit=15):
+        """
+        Hottest functions by samples spent in the function itself (`self_ms`) and
+        anywhere below it on the stack (`total_ms`).
+
+        :return: [{'function', 'self_ms', 'total_ms', 'self_pct'}] sorted by self time
+        """
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        ms = self.interval * 1000
+        ranked = sorted(total, key=lambda label: (own[label], total[label]), reverse=True)[:limit]
+        return [{
+            'function': label,
+            'self_ms': round(own[label] * ms, 1),
+            'total_ms': round(total[label] * ms, 1),
+            'self_pct': round(100.0 * own[label] / self.samples, 1) if self.samples else 0.0
+        } for label in ranked]
+
+    def write_reports(self, name, context=None, directory=None):
+        """
+        Write `<name>.folded` and `<name>.txt` into `directory` (default GL_PROFILE_DIR).
+
+        :return: {'folded', 'text', 'samples', 'duration_ms', 'top'}
+        """
+        directory = directory or profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{name}")
+        top = self.top_functions(30)
+        with open(base + ".folded", "w") as f:
+            f.write(self.folded() + "\n")
+        with open(base + ".txt", "w") as f:
+            f.write(f"context  {json.dumps(context or {}, default=str, sort_keys=True)}\n")
+            f.write(f"samples  {self.samples} every {self.interval * 1000:.1f} ms over {self.duration * 1000:.0f} ms\n\n")
+            f.write(f"{'self ms':>10}{'total ms':>10}{'self %':>8}  function\n")
+            for row in top:
+                f.write(f"{row['self_ms']:>10.1f}{row['total_ms']:>10.1f}{row['self_pct']:>8.1f}  {row['function']}\n")
+        return {
+            'folded': base + ".folded",
+            'text': base + ".txt",
+            'samples': self.samples,
+            'duration_ms': round(self.duration * 1000, 1),
+            'top': top
+        }
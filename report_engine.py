@@ -0,0 +1,2406 @@
+"""
+Headless General Ledger reporting engine.
+
+Everything the Streamlit dashboard needs to turn Fabric ledger rows into P&L and
+store comparison reports, without a browser session. `app.py` imports from here,
+and running the module directly generates month-end workbook packs:
+
+    python -m report_engine --brand all --fy 2024 --workers 4 --out packs/
+    python -m report_engine --brand pra --month "March 2025" --previous 2 --compare yoy
+    python -m report_engine --brand pra --extract parquet --out extracts/
+"""
+import argparse
+import codecs
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from array import array
+from bisect import bisect_left
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+import requests
+import openpyxl
+from openpyxl.styles import (PatternFill, Font, Alignment, Border, Side)
+from openpyxl.utils import get_column_letter
+
+import instrumentation
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet exports are optional
+    pa = pq = None
+
+# =============================
+# BRANDS & QUERIES
+# =============================
+BRAND_NAMES = {
+    "pra": "Prashanti",
+    "wed": "Wedtree"
+}
+
+READ_QUERIES = {
+    "wed": """
+    query {
+      executesp_wd_readData { id Ledger classification ContraName Store Balance Year MonthName Month FinancialYearMonth last_modified_at last_modified_user }
+    }
+    """,
+    "pra": """
+    query {
+      executesp_pr_readData { id account_name classification partner_id_name Store Balance Year MonthName Month FinancialYearMonth last_modified_at last_modified_user }
+    }
+    """
+}
+
+UPSERT_MUTATIONS = {
+    "wed": """
+    mutation upsertBalance($year: Int!, $monthName: String!, $store: String!, $balance: Float, $account_name: String!, $classification: String!, $partner_id_name: String!, $last_modified_at: DateTime, $last_modified_user: String) {
+      executesp_wd_upsertBalance(year: $year, monthName: $monthName, store: $store, balance: $balance, account_name: $account_name, classification: $classification, partner_id_name: $partner_id_name, last_modified_at: $last_modified_at, last_modified_user: $last_modified_user) { rows_affected }
+    }
+    """,
+    "pra": """
+    mutation upsertBalance($year: Int!, $monthName: String!, $store: String!, $balance: Float, $account_name: String!, $classification: String!, $partner_id_name: String!, $last_modified_at: DateTime, $last_modified_user: String) {
+      executesp_pr_upsertBalance(year: $year, monthName: $monthName, store: $store, balance: $balance, account_name: $account_name, classification: $classification, partner_id_name: $partner_id_name, last_modified_at: $last_modified_at, last_modified_user: $last_modified_user) { rows_affected }
+    }
+    """
+}
+
+# Narrow keyed read used for conflict checks: `keys` is a JSON list of upsert key objects
+# ({year, monthName, store, account_name, classification, partner_id_name})
+READ_CELLS_QUERIES = {
+    "wed": """
+    query readCells($keys: String!) {
+      executesp_wd_readCells(keys: $keys) { id Ledger classification ContraName Store Balance Year MonthName Month FinancialYearMonth last_modified_at last_modified_user }
+    }
+    """,
+    "pra": """
+    query readCells($keys: String!) {
+      executesp_pr_readCells(keys: $keys) { id account_name classification partner_id_name Store Balance Year MonthName Month FinancialYearMonth last_modified_at last_modified_user }
+    }
+    """
+}
+
+READ_CELLS_KEYS = {
+    "wed": "executesp_wd_readCells",
+    "pra": "executesp_pr_readCells"
+}
+
+# Pre-aggregated read for the dashboard views: Balance summed per classification / account /
+# partner / store / month. `periods` is a JSON list of {year, monthName}; `store` null means all.
+READ_AGGREGATE_QUERIES = {
+    "wed": """
+    query readAggregate($periods: String!, $store: String) {
+      executesp_wd_readAggregate(periods: $periods, store: $store) { Ledger classification ContraName Store Balance Year MonthName Month }
+    }
+    """,
+    "pra": """
+    query readAggregate($periods: String!, $store: String) {
+      executesp_pr_readAggregate(periods: $periods, store: $store) { account_name classification partner_id_name Store Balance Year MonthName Month }
+    }
+    """
+}
+
+READ_AGGREGATE_KEYS = {
+    "wed": "executesp_wd_readAggregate",
+    "pra": "executesp_pr_readAggregate"
+}
+
+READ_DATA_KEYS = {
+    "wed": "executesp_wd_readData",
+    "pra": "executesp_pr_readData"
+}
+
+# Wedtree exposes the same ledger under different column names
+BRAND_RENAMES = {
+    "wed": {
+        "Ledger": "account_name",
+        "ContraName": "partner_id_name"
+    },
+    "pra": {}
+}
+
+BUDGET_QUERY = "query budgetData { executesp_pr_readBudgetData { Particulars Month Year Budget } }"
+
+REVENUE_CLASSES = ['Net Sales', 'Other Income']
+
+CLASSIFICATION_ORDER = [
+    'Net Sales', 'Other Income', 'Cost of Goods Sold (COGS)', 'Employee cost',
+    'Rent and Utilities', 'Marketing and Advertisment', 'Admin Expenses',
+    'Logistics', 'Other Expenses', 'Finance cost', 'Supplier Payments',
+    'Purchase Expense', 'Depreciation'
+]
+
+def get_classification_order(cls):
+    try:
+        return CLASSIFICATION_ORDER.index(cls)
+    except ValueError:
+        return len(CLASSIFICATION_ORDER) + (sum(ord(c) for c in cls) if cls else 0)
+
+# =============================
+# FABRIC API
+# =============================
+@lru_cache(maxsize=1)
+def get_credential():
+    from azure.identity import ClientSecretCredential
+    return ClientSecretCredential(
+        tenant_id=os.getenv("FABRIC_TENANT_ID"),
+        client_id=os.getenv("FABRIC_CLIENT_ID"),
+        client_secret=os.getenv("FABRIC_CLIENT_SECRET")
+    )
+
+def get_access_token():
+    # A static token skips Azure AD entirely (local stub server, load tests)
+    static_token = os.getenv("FABRIC_STATIC_TOKEN")
+    if static_token:
+        return static_token
+    credential = get_credential()
+    token = credential.get_token("https://api.fabric.microsoft.com/.default")
+    return token.token
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+def _retry_delay(response, attempt):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return 0.5 * (2 ** attempt)
+
+def _post_graphql(query, variables=None, stream=False):
+    """POST with retries; returns (response, attempts, start, request_bytes)."""
+    endpoint = os.getenv("FABRIC_ENDPOINT")
+    max_retries = int(os.getenv("FABRIC_MAX_RETRIES", "3"))
+    headers = {
+        "Authorization": f"Bearer {get_access_token()}",
+        "Content-Type": "application/json"
+    }
+    payload = {"query": query, "variables": variables}
+    request_bytes = len(json.dumps(payload))
+    start = time.perf_counter()
+    response = None
+    try:
+        for attempt in range(max_retries + 1):
+            response = requests.post(endpoint, json=payload, headers=headers, stream=stream)
+            # Throttling and gateway errors are retried; upserts are idempotent so this is safe for saves too
+            if response.status_code in RETRY_STATUSES and attempt < max_retries:
+                time.sleep(_retry_delay(response, attempt))
+                continue
+            response.raise_for_status()
+            return response, attempt + 1, start, request_bytes
+    except Exception:
+        instrumentation.record_graphql(query, time.perf_counter() - start, request_bytes,
+                                       len(response.content) if response is not None and not stream else 0,
+                                       response.status_code if response is not None else None,
+                                       ok=False)
+        raise
+
+class GraphQLError(RuntimeError):
+    """A GraphQL response carrying `errors` instead of the requested data."""
+
+def graphql_error(result):
+    errors = (result or {}).get("errors") or [{}]
+    return GraphQLError(errors[0].get("message") or "GraphQL request failed")
+
+def run_graphql(query, variables=None):
+    response, attempts, start, request_bytes = _post_graphql(query, variables)
+    result = response.json()
+    instrumentation.record_graphql(query, time.perf_counter() - start, request_bytes, len(response.content),
+                                   response.status_code, attempts, ok="errors" not in (result or {}))
+    return result
+
+# =============================
+# REQUEST COALESCING
+# =============================
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the work and
+    every caller arriving while it is in flight waits for, and receives, the same
+    result (or exception). Nothing is kept once the call finishes, so this is not a
+    cache; it only stops a cache miss from turning into one fetch per waiting session.
+    Callers share the returned object and must treat it as read-only.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            with instrumentation.span("coalesced_wait", flight=self.name):
+                flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+# Full ledger reads and aggregate reads, keyed by brand + query (+ variables)
+fabric_reads = SingleFlight("fabric_read")
+
+# =============================
+# EXACT BALANCES
+# =============================
+# GL_PAISE_BALANCES=1 keeps every ledger Balance as an exact int64 count of paise next to
+# the rupee `Balance` column. Totals are reduced in integers, so a P&L summed over
+# thousands of rows matches the ledger to the paisa instead of drifting in float64;
+# rupees are derived from the paise only for display, exports and the GraphQL upsert.
+PAISE_BALANCES = os.getenv("GL_PAISE_BALANCES") == "1"
+PAISE_COLUMN = 'BalancePaise'
+
+def to_paise(values):
+    """
+    Rupee amount(s) rounded half away from zero to whole paise: an int for a scalar, an
+    int64 array otherwise. 12.345 is 1234.4999... paise in float64, hence the 6dp snap first.
+    """
+    if isinstance(values, (int, float)):
+        scaled = round(values * 100, 6)
+        return int(scaled + 0.5 if scaled >= 0 else scaled - 0.5)
+    scaled = np.round(np.asarray(values, dtype=float) * 100, 6)
+    paise = np.trunc(scaled + np.copysign(0.5, scaled)).astype(np.int64)
+    return int(paise) if paise.ndim == 0 else paise
+
+def _with_paise(frame):
+    # Frames built outside `_finish_ledger_frame` (aggregates, tests) get their paise derived here
+    return frame if PAISE_COLUMN in frame.columns else frame.assign(**{PAISE_COLUMN: to_paise(frame['Balance'])})
+
+def balance_sum(frame, by, **groupby_kwargs):
+    """`frame.groupby(by, ...)['Balance'].sum()`, reduced in exact paise under GL_PAISE_BALANCES."""
+    if not PAISE_BALANCES:
+        return frame.groupby(by, **groupby_kwargs)['Balance'].sum()
+    sums = _with_paise(frame).groupby(by, **groupby_kwargs)[PAISE_COLUMN].sum()
+    if isinstance(sums, pd.DataFrame):  # as_index=False
+        sums['Balance'] = sums.pop(PAISE_COLUMN) / 100
+        return sums
+    return (sums / 100).rename('Balance')
+
+def total_balance(frame):
+    """Sum of `frame`'s Balance, exact under GL_PAISE_BALANCES."""
+    if not PAISE_BALANCES:
+        return frame['Balance'].sum()
+    return int(_with_paise(frame)[PAISE_COLUMN].sum()) / 100
+
+def add_balances(*values):
+    """Sum of rupee amounts, exact to the paisa under GL_PAISE_BALANCES."""
+    if not PAISE_BALANCES:
+        return sum(values)
+    return sum(to_paise(v) for v in values) / 100
+
+def sum_balance_columns(frame, columns):
+    """Row sums of the rupee `columns` of `frame`, exact under GL_PAISE_BALANCES."""
+    if not PAISE_BALANCES:
+        return frame[columns].sum(axis=1)
+    return pd.Series(to_paise(frame[columns]).sum(axis=1) / 100, index=frame.index)
+
+def _reduction_units(balances):
+    # Cells about to be summed again: int64 paise under GL_PAISE_BALANCES, rupees otherwise
+    return pd.Series(to_paise(balances), index=balances.index, name=balances.name) if PAISE_BALANCES else balances
+
+# =============================
+# DATA LOADING
+# =============================
+def _finish_ledger_frame(df):
+    if not df.empty:
+        df['Balance'] = pd.to_numeric(df['Balance'], errors='coerce').fillna(0.0)
+        if PAISE_BALANCES:
+            df[PAISE_COLUMN] = to_paise(df['Balance'])
+            df['Balance'] = df[PAISE_COLUMN] / 100
+        df['Year'] = pd.to_numeric(df['Year'], errors='coerce')
+        df['Month'] = pd.to_numeric(df['Month'], errors='coerce')
+        df['PeriodSort'] = df['Year'].astype(str) + "-" + df['Month'].astype(str).str.zfill(2)
+        df['DisplayPeriod'] = df['MonthName'] + " " + df['Year'].astype(str)
+    return df
+
+def prepare_ledger_frame(items, brand):
+    """Turn raw `executesp_*_readData` rows into the ledger frame used by every report."""
+    df = pd.DataFrame(items)
+    if BRAND_RENAMES.get(brand):
+        df = df.rename(columns=BRAND_RENAMES[brand])
+    return _finish_ledger_frame(df)
+
+# Low-cardinality text columns whose repeated values are shared instead of duplicated per row
+INTERNED_COLUMNS = {'Store', 'classification', 'account_name', 'partner_id_name', 'MonthName', 'last_modified_user'}
+
+def _to_float(value):
+    if value.__class__ is float:
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+class LedgerColumnDecoder:
+    """
+    Accumulates ledger records straight into per-column buffers, with the brand's
+    renames applied as they arrive. Records are transposed in small batches, so at
+    most `batch_size` row dicts are alive at once; `Balance` goes into a packed float
+    array and repeated dimension strings are stored once. Peak memory stays close to
+    the size of the final frame instead of a full list of per-row dicts.
+
+    The price is decode time: transposing and interning batches in Python is not
+    faster than one `json.loads` plus `pd.DataFrame(rows)`, and on the benchmark
+    ledgers it ranges from on par to ~1.6x slower (bench_pipeline `decode_json_*`)
+    for roughly a third of the peak memory.
+    """
+
+    def __init__(self, brand, batch_size=2048):
+        self.renames = BRAND_RENAMES.get(brand, {})
+        self.batch_size = batch_size
+        self.columns = {}
+        self.rows = 0
+        self._pending = []
+        self._interned = {}
+
+    def add(self, record):
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def extend(self, records):
+        self._pending.extend(records)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        # First record's key order, plus any keys only some records carry
+        fields = list(batch[0])
+        fields += sorted(set().union(*batch).difference(fields))
+        intern = self._interned.setdefault
+        if all(len(record) == len(fields) for record in batch):
+            # Every record carries every field: transpose at C speed
+            getter = itemgetter(*fields)
+            transposed = zip(*map(getter, batch)) if len(fields) > 1 else ([getter(r) for r in batch],)
+        else:
+            transposed = ([record.get(field) for record in batch] for field in fields)
+        for field, values in zip(fields, transposed):
+            name = self.renames.get(field, field)
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = (array('d', [float("nan")]) * self.rows if name == 'Balance'
+                                               else [None] * self.rows)
+            if name == 'Balance':
+                column.extend(map(_to_float, values))
+            elif name in INTERNED_COLUMNS:
+                column.extend(map(intern, values, values))
+            else:
+                column.extend(values)
+        self.rows += len(batch)
+        # Columns absent from this whole batch still need their rows
+        for name, column in self.columns.items():
+            if len(column) < self.rows:
+                missing = self.rows - len(column)
+                column.extend(array('d', [float("nan")]) * missing if name == 'Balance' else [None] * missing)
+
+    def to_frame(self):
+        self.flush()
+        data = {}
+        for name in list(self.columns):
+            column = self.columns.pop(name)
+            data[name] = np.frombuffer(column, dtype=np.float64).copy() if name == 'Balance' else column
+        return _finish_ledger_frame(pd.DataFrame(data))
+
+_SEPARATORS = re.compile(r'[\s,]*')
+
+def iter_json_array_batches(chunks, key):
+    """
+    Yield the elements of the JSON array stored under `key` from a stream of byte
+    chunks, as lists holding the elements completed by each chunk. Yields nothing
+    if the value is null; raises GraphQLError when the body has top-level `errors`
+    and no array (e.g. `{"errors": [...], "data": null}`) or no `key` at all.
+
+    Ledger rows are flat objects, so everything up to the last `}` in the buffer is
+    normally a run of complete elements and is decoded in one C-level call; if that
+    guess fails (a `}` inside a string) the buffer is decoded element by element.
+    """
+    raw_decode = json.JSONDecoder().raw_decode
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    marker = f'"{key}"'
+    buf, pos, state = "", 0, "seek"
+    for chunk in chunks:
+        # Until the array starts the whole body is kept: it is either a short prefix or an error body
+        buf = (buf[pos:] if state == "array" else buf) + text_decoder.decode(chunk)
+        pos = 0
+        if state == "seek":
+            idx = buf.find(marker)
+            if idx < 0:
+                continue
+            value_pos = idx + len(marker)
+            while value_pos < len(buf) and buf[value_pos] in " \t\r\n:":
+                value_pos += 1
+            if value_pos >= len(buf):
+                continue
+            if buf[value_pos] != "[":
+                state = "null"
+                continue
+            buf, pos, state = buf[value_pos + 1:], 0, "array"
+        if state != "array":
+            continue
+
+        batch = []
+        pos = _SEPARATORS.match(buf, pos).end()
+        last = buf.rfind("}", pos)
+        if last > pos and buf[pos] != "]":
+            try:
+                batch = json.loads("[" + buf[pos:last + 1] + "]")
+                pos = last + 1
+            except json.JSONDecodeError:
+                batch = []
+        end = len(buf)
+        while True:
+            pos = _SEPARATORS.match(buf, pos).end()
+            if pos >= end:
+                break
+            if buf[pos] == "]":
+                state = "done"
+                break
+            try:
+                item, pos = raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Element continues in the next chunk
+                break
+            batch.append(item)
+        if batch:
+            yield batch
+        if state == "done":
+            return
+    if state == "array":
+        raise ValueError(f"Truncated GraphQL response while reading {key}")
+    # No array: the body is small, so decode it whole for its errors
+    try:
+        result = json.loads(buf)
+    except json.JSONDecodeError:
+        raise ValueError(f"Malformed GraphQL response while reading {key}")
+    if isinstance(result, dict) and result.get("errors"):
+        raise graphql_error(result)
+    if state == "seek":
+        raise GraphQLError(f"GraphQL response has no {key}")
+
+def decode_read_stream(chunks, brand):
+    """Build the ledger frame for `brand` from a streamed `executesp_*_readData` response body."""
+    columns = LedgerColumnDecoder(brand)
+    for batch in iter_json_array_batches(chunks, READ_DATA_KEYS[brand]):
+        columns.extend(batch)
+    return columns.to_frame()
+
+def stream_read_data(brand, chunk_size=64 * 1024):
+    query = READ_QUERIES[brand]
+    response, attempts, start, request_bytes = _post_graphql(query, stream=True)
+    received, ok = [0], False
+
+    def counted_chunks():
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            received[0] += len(chunk)
+            yield chunk
+
+    try:
+        df = decode_read_stream(counted_chunks(), brand)
+        ok = True
+    finally:
+        response.close()
+        instrumentation.record_graphql(query, time.perf_counter() - start, request_bytes, received[0],
+                                       response.status_code, attempts, ok=ok)
+    return df
+
+def load_data(brand, graphql=None):
+    """
+    Fetch and prepare `brand`'s ledger. By default the response is streamed through the
+    columnar decoder, which trades some decode time for a much lower peak (see
+    `LedgerColumnDecoder`); passing `graphql` (or GL_STREAMING_DECODE=0) uses the plain JSON
+    path. A response with GraphQL `errors` and no rows raises GraphQLError on either path.
+    Concurrent calls for the same brand share one fetch and receive the same frame.
+    """
+    return fabric_reads.do((brand, READ_QUERIES[brand], graphql), lambda: _load_data(brand, graphql))
+
+def _load_data(brand, graphql=None):
+    if graphql is None and os.getenv("GL_STREAMING_DECODE", "1") != "0":
+        with instrumentation.span("fabric_read_decode", brand=brand):
+            df = stream_read_data(brand)
+        instrumentation.record_rows("ledger_loaded", len(df))
+        return df
+
+    with instrumentation.span("fabric_read", brand=brand):
+        result = (graphql or run_graphql)(READ_QUERIES[brand])
+    items = ((result or {}).get("data") or {}).get(READ_DATA_KEYS[brand])
+    if items is None and (result or {}).get("errors"):
+        raise graphql_error(result)
+    with instrumentation.span("dataframe_build", brand=brand):
+        df = prepare_ledger_frame(items or [], brand)
+    instrumentation.record_rows("ledger_loaded", len(df))
+    return df
+
+def load_report_cube(brand, periods, store_filter="All", ledger=None, graphql=None):
+    """
+    Aggregation cube (see `build_aggregation_cube`) for `periods` and `store_filter`,
+    summed by Fabric so the payload is the size of the report rather than the ledger.
+    Falls back to aggregating `ledger` (or a full read) locally when the endpoint has
+    no readAggregate.
+    """
+    graphql = graphql or run_graphql
+    keys = [{"year": int(year), "monthName": month} for month, year in (p.rsplit(' ', 1) for p in periods)]
+    variables = {"periods": json.dumps(keys), "store": None if store_filter == "All" else store_filter}
+    with instrumentation.span("fabric_read_aggregate", brand=brand, periods=len(keys)):
+        result = fabric_reads.do((brand, READ_AGGREGATE_QUERIES[brand], json.dumps(variables), graphql),
+                                 lambda: graphql(READ_AGGREGATE_QUERIES[brand], variables))
+    if result and not result.get("errors"):
+        rows = prepare_ledger_frame((result.get("data") or {}).get(READ_AGGREGATE_KEYS[brand]) or [], brand)
+        instrumentation.record_rows("aggregate_loaded", len(rows))
+        if rows.empty:
+            return pd.Series([], index=pd.MultiIndex.from_arrays([[]] * len(CUBE_DIMENSIONS), names=CUBE_DIMENSIONS),
+                             name='Balance', dtype=float)
+        return build_aggregation_cube(rows)
+
+    if ledger is None:
+        ledger = load_data(brand) if graphql is run_graphql else load_data(brand, graphql)
+    with instrumentation.span("aggregate_local", brand=brand):
+        return build_aggregation_cube(select_report_frame(ledger, periods, store_filter))
+
+def get_period_list(df):
+    unique_periods = df[['PeriodSort', 'DisplayPeriod']].drop_duplicates().sort_values('PeriodSort', ascending=False)
+    return unique_periods['DisplayPeriod'].tolist()
+
+# =============================
+# HELPER FUNCTIONS
+# =============================
+def get_financial_year_range(df, year, start_month=4):
+    months = [(year, m) for m in range(start_month, 13)] + [(year + 1, m) for m in range(1, start_month)]
+    periods = []
+    for y, m in months:
+        period_sort = f"{y}-{str(m).zfill(2)}"
+        mask = (df['Year'] == y) & (df['Month'] == m)
+        if mask.any():
+            display = df.loc[mask, 'DisplayPeriod'].iloc[0]
+            periods.append({'sort': period_sort, 'display': display})
+    return periods
+
+def calculate_profit_metrics(df, periods, revenue_classes):
+    results = []
+    for period in periods:
+        period_data = df[df['DisplayPeriod'] == period]
+        revenue = total_balance(period_data[period_data['classification'].isin(revenue_classes)])
+        expenses = total_balance(period_data[~period_data['classification'].isin(revenue_classes)])
+        profit = add_balances(revenue, -expenses)
+        results.append({
+            'DisplayPeriod': period,
+            'Revenue': revenue,
+            'Expenses': expenses,
+            'Profit': profit,
+            'Margin': (profit / revenue * 100) if revenue != 0 else 0
+        })
+    return pd.DataFrame(results)
+
+def fmt_currency(val):
+    if pd.isna(val) or val == 0: 
+        return "₹0"
+    
+    # 1. Format as integer string (No decimals)
+    main_part = f"{int(round(float(val)))}"
+    
+    # 2. Logic for Indian Thousand Separator (Lakhs/Crores)
+    if len(main_part) > 3:
+        # Separate the last 3 digits
+        last_three = main_part[-3:]
+        remaining = main_part[:-3]
+        
+        # Group the remaining digits in pairs (twos)
+        remaining = re.sub(r'(\d+?)(?=(\d{2})+(?!\d))', r'\1,', remaining)
+        main_part = remaining + ',' + last_three
+        
+    return f"₹{main_part}"
+
+# =============================
+# HIERARCHICAL DATA BUILDER
+# =============================
+class Hierarchy(dict):
+    """
+    classification -> {'totals', 'accounts'} mapping returned by `build_hierarchy_data`.
+
+    Also carries the grand totals, the column list, what the columns are grouped by
+    and the `scope` (periods / store) the source rows were filtered to, which is what
+    `apply_ledger_delta` needs to keep every level up to date without a rebuild.
+
+    With a period comparison (`hierarchy_from_cube(compare=...)`), `deltas` is a
+    hierarchy of the same shape holding each cell's change against its `reference`
+    period ({column: reference period}).
+    """
+
+    def __init__(self, columns=(), group_by='DisplayPeriod', scope=None):
+        super().__init__()
+        self.columns = list(columns)
+        self.group_by = group_by
+        self.scope = dict(scope or {})
+        self.grand_totals = {c: 0.0 for c in self.columns}
+        self.compare = None
+        self.reference = {}
+        self.deltas = None
+
+HIERARCHY_LEVELS = ['classification', 'account_name', 'partner_id_name']
+CUBE_DIMENSIONS = HIERARCHY_LEVELS + ['Store', 'DisplayPeriod']
+
+# Period-over-period comparisons: mode -> (label, calendar months back to the reference period).
+# For a month, the same period of the last financial year is the same month a year earlier.
+PERIOD_COMPARISONS = {'mom': ("MoM", 1), 'yoy': ("YoY", 12)}
+
+def shift_period(period, months):
+    """`period` ('June 2025') moved `months` calendar months back."""
+    month_name, year = period.rsplit(' ', 1)
+    index = int(year) * 12 + MONTH_NUMBERS[month_name] - 1 - months
+    return f"{list(MONTH_NUMBERS)[index % 12]} {index // 12}"
+
+def comparison_periods(periods, compare):
+    """Reference period of each of `periods` for a PERIOD_COMPARISONS mode."""
+    months = PERIOD_COMPARISONS[compare][1]
+    return [shift_period(p, months) for p in periods]
+
+def delta_pct(value, delta):
+    """`delta` as a fraction of the reference value (`value - delta`); None when that is zero."""
+    prior = value - delta
+    return delta / abs(prior) if abs(prior) > 0.005 else None
+
+def build_aggregation_cube(df):
+    """
+    Balance summed per classification / account / partner / store / period.
+
+    Built once per dataset; every P&L and Store Comparison hierarchy is a reduction
+    over this (see `hierarchy_from_cube`) instead of a fresh scan of the ledger rows.
+    """
+    return balance_sum(df, CUBE_DIMENSIONS, dropna=False, sort=False)
+
+def hierarchy_from_cube(cube, grouping_list=None, group_by='DisplayPeriod', periods=None, store_filter="All", scope=None,
+                        compare=None):
+    """
+    Hierarchy over `grouping_list` values of `group_by` ('DisplayPeriod' or 'Store'),
+    restricted to `periods` (None for all) and `store_filter`.
+
+    :param grouping_list: Columns to show; None for every value present, sorted
+    :param compare: A PERIOD_COMPARISONS mode to also compute every node's change against
+                    the reference period of each column (period hierarchies only)
+    """
+    references = []
+    if compare is not None:
+        if group_by != 'DisplayPeriod' or grouping_list is None:
+            raise ValueError("Period comparisons need a period hierarchy with explicit columns")
+        references = comparison_periods(grouping_list, compare)
+    cells = cube
+    if periods is not None:
+        cells = cells[cells.index.get_level_values('DisplayPeriod').isin(list(periods) + references)]
+    if store_filter != "All":
+        cells = cells[cells.index.get_level_values('Store') == store_filter]
+    leaf = _reduction_units(cells).groupby(level=HIERARCHY_LEVELS + [group_by], dropna=False, sort=False).sum()
+    if grouping_list is None:
+        grouping_list = sorted(v for v in leaf.index.get_level_values(group_by).unique() if not pd.isna(v))
+    if compare is None:
+        return _hierarchy_from_cells(leaf, grouping_list, group_by, scope)
+
+    # One matrix for the shown and reference periods; the delta matrix is a single subtraction.
+    # Nodes with balances only in a reference period are kept (as zeros) so their drop shows.
+    hierarchy = Hierarchy(grouping_list, group_by, scope)
+    if leaf.empty:
+        hierarchy.deltas = Hierarchy(grouping_list, group_by, scope)
+    else:
+        wide = leaf.unstack(group_by, fill_value=0)
+        current = wide.reindex(columns=grouping_list, fill_value=0)
+        prior = wide.reindex(columns=references, fill_value=0).set_axis(grouping_list, axis=1)
+        hierarchy = _hierarchy_from_wide(current, grouping_list, group_by, scope)
+        hierarchy.deltas = _hierarchy_from_wide(current - prior, grouping_list, group_by, scope)
+    hierarchy.compare = compare
+    hierarchy.reference = dict(zip(grouping_list, references))
+    return hierarchy
+
+def _hierarchy_from_cells(leaf, grouping_list, group_by, scope):
+    # leaf: Balance per (classification, account, partner, group_by), in paise under GL_PAISE_BALANCES
+    if leaf.empty:
+        return Hierarchy(grouping_list, group_by, scope)
+    wide = leaf.unstack(group_by, fill_value=0).reindex(columns=list(grouping_list), fill_value=0)
+    return _hierarchy_from_wide(wide, grouping_list, group_by, scope)
+
+def _hierarchy_from_wide(wide, grouping_list, group_by, scope):
+    # wide: one row per (classification, account, partner), one column per `grouping_list` value.
+    # Rows with a missing account or partner count towards the levels above but get no node of their own.
+    hierarchy = Hierarchy(grouping_list, group_by, scope)
+    columns = hierarchy.columns
+    acc_wide = wide.groupby(level=[0, 1], dropna=False, sort=False).sum()
+    cls_wide = wide.groupby(level=0, dropna=False, sort=False).sum()
+    grand = cls_wide[cls_wide.index.notna()].sum()
+    if PAISE_BALANCES:
+        # Every level was reduced in int64 paise; the nodes hold rupees
+        wide, acc_wide, cls_wide, grand = wide / 100, acc_wide / 100, cls_wide / 100, grand / 100
+
+    partners = {}
+    for (classification, account, partner), values in zip(wide.index, wide.to_numpy().tolist()):
+        if not pd.isna(partner):
+            partners.setdefault((classification, account), []).append((partner, dict(zip(columns, values))))
+    accounts = {}
+    for (classification, account), values in zip(acc_wide.index, acc_wide.to_numpy().tolist()):
+        if not pd.isna(account):
+            accounts.setdefault(classification, []).append((account, dict(zip(columns, values))))
+
+    cls_totals = {c: dict(zip(columns, v)) for c, v in zip(cls_wide.index, cls_wide.to_numpy().tolist()) if not pd.isna(c)}
+    for classification in sorted(cls_totals, key=get_classification_order):
+        account_nodes = {}
+        for account, acc_totals in sorted(accounts.get(classification, []), key=itemgetter(0)):
+            account_nodes[account] = {
+                'totals': acc_totals,
+                'partners': dict(sorted(partners.get((classification, account), []), key=itemgetter(0)))
+            }
+        hierarchy[classification] = {'totals': cls_totals[classification], 'accounts': account_nodes}
+    if cls_totals:
+        hierarchy.grand_totals = dict(zip(columns, grand.tolist()))
+    return hierarchy
+
+def build_hierarchy_data(report_df, grouping_list, group_by='DisplayPeriod', scope=None):
+    """
+    Modified to support dynamic grouping (e.g., by Period or by Store).
+    
+    :param report_df: The source DataFrame
+    :param grouping_list: List of columns to show (e.g., selected_periods or unique_stores)
+    :param group_by_col: The column name in report_df to filter against (default 'DisplayPeriod')
+    :param scope: Filters report_df was built with, e.g. {'periods': [...], 'store': 'All'}
+    """
+    leaf = _reduction_units(balance_sum(report_df, HIERARCHY_LEVELS + [group_by], dropna=False, sort=False))
+    return _hierarchy_from_cells(leaf, grouping_list, group_by, scope)
+
+def apply_hierarchy_delta(hierarchy, classification, account, partner, column, delta):
+    """
+    Add `delta` to one partner cell and to its account, classification and grand
+    totals in O(depth). Missing nodes are created (appended after existing ones).
+    """
+    columns = hierarchy.columns if isinstance(hierarchy, Hierarchy) else []
+    cls_node = hierarchy.get(classification)
+    if cls_node is None:
+        cls_node = hierarchy[classification] = {'totals': {c: 0.0 for c in columns}, 'accounts': {}}
+    acc_node = cls_node['accounts'].get(account)
+    if acc_node is None:
+        acc_node = cls_node['accounts'][account] = {'totals': {c: 0.0 for c in columns}, 'partners': {}}
+    prt_totals = acc_node['partners'].get(partner)
+    if prt_totals is None:
+        prt_totals = acc_node['partners'][partner] = {c: 0.0 for c in columns}
+
+    levels = [prt_totals, acc_node['totals'], cls_node['totals']]
+    if isinstance(hierarchy, Hierarchy):
+        levels.append(hierarchy.grand_totals)
+    for totals in levels:
+        totals[column] = add_balances(totals.get(column, 0.0), delta)
+
+def _add_hierarchy_column(hierarchy, column):
+    # Zero under every existing node, as a rebuild with the new column would have
+    hierarchy.columns.append(column)
+    hierarchy.grand_totals[column] = 0.0
+    for cls_node in hierarchy.values():
+        cls_node['totals'][column] = 0.0
+        for acc_node in cls_node['accounts'].values():
+            acc_node['totals'][column] = 0.0
+            for prt_totals in acc_node['partners'].values():
+                prt_totals[column] = 0.0
+
+def apply_ledger_delta(hierarchy, store, classification, account, partner, period, delta):
+    """
+    Apply a ledger cell change to a hierarchy if it falls inside the hierarchy's scope.
+
+    :return: True when the hierarchy was updated
+    """
+    scope = hierarchy.scope
+    if scope.get('store', "All") != "All" and store != scope['store']:
+        return False
+    updated = False
+    if hierarchy.deltas is not None:
+        # An edit to a reference period moves the change shown against it the other way
+        for column, reference in hierarchy.reference.items():
+            if reference == period:
+                apply_hierarchy_delta(hierarchy, classification, account, partner, column, 0.0)
+                apply_hierarchy_delta(hierarchy.deltas, classification, account, partner, column, -delta)
+                updated = True
+    if scope.get('periods') is not None and period not in scope['periods']:
+        return updated
+    column = store if hierarchy.group_by == 'Store' else period
+    if column not in hierarchy.columns:
+        if hierarchy.group_by != 'Store':
+            return updated
+        # A store with no rows before this edit becomes a new comparison column
+        _add_hierarchy_column(hierarchy, column)
+    apply_hierarchy_delta(hierarchy, classification, account, partner, column, delta)
+    if hierarchy.deltas is not None:
+        apply_hierarchy_delta(hierarchy.deltas, classification, account, partner, column, delta)
+    return True
+
+LEDGER_KEY_COLUMNS = ['Store', 'classification', 'account_name', 'partner_id_name', 'DisplayPeriod']
+MODIFIED_COLUMNS = ['last_modified_at', 'last_modified_user']
+
+def ledger_cell_values(df, changes):
+    """Current summed Balance of each changed (store, class, account, partner, period) cell."""
+    if not changes or df.empty:
+        return [0.0 for _ in changes]
+    sums = balance_sum(df, LEDGER_KEY_COLUMNS)
+    keys = [(c['store'], c['classification'], c['account'], c['partner'], c['period']) for c in changes]
+    return [float(sums.get(key, 0.0)) for key in keys]
+
+def apply_ledger_changes(df, changes):
+    """
+    Return a copy of `df` with each change's cell set to its `new_value`, plus the
+    per-cell deltas to feed `apply_ledger_delta`. A cell spread over several rows is
+    collapsed onto its first row; a cell with no rows gets a new one. Changes that
+    carry `last_modified_at`/`last_modified_user` also restamp the cell's rows.
+    """
+    df = df.copy()
+    indices = df.groupby(LEDGER_KEY_COLUMNS, sort=False).indices if not df.empty else {}
+    balance_col = df.columns.get_loc('Balance') if 'Balance' in df.columns else None
+    paise_col = df.columns.get_loc(PAISE_COLUMN) if PAISE_BALANCES and PAISE_COLUMN in df.columns else None
+    stamp_cols = [c for c in MODIFIED_COLUMNS if c in df.columns]
+    deltas, new_rows = [], []
+    for change in changes:
+        key = (change['store'], change['classification'], change['account'], change['partner'], change['period'])
+        positions = indices.get(key)
+        new_value = to_paise(change['new_value']) / 100 if PAISE_BALANCES else float(change['new_value'])
+        if positions is not None and len(positions):
+            if paise_col is not None:
+                old_value = int(df.iloc[positions, paise_col].sum()) / 100
+                df.iloc[positions, paise_col] = 0
+                df.iloc[positions[0], paise_col] = to_paise(new_value)
+            else:
+                old_value = float(df.iloc[positions, balance_col].sum())
+            df.iloc[positions, balance_col] = 0.0
+            df.iloc[positions[0], balance_col] = new_value
+            for column in stamp_cols:
+                if change.get(column) is not None:
+                    df.iloc[positions, df.columns.get_loc(column)] = change[column]
+        else:
+            old_value = 0.0
+            month_name, year = change['period'].rsplit(' ', 1)
+            month = MONTH_NUMBERS.get(month_name, 0)
+            new_rows.append({
+                'Store': change['store'], 'classification': change['classification'],
+                'account_name': change['account'], 'partner_id_name': change['partner'],
+                'Balance': new_value, **({PAISE_COLUMN: to_paise(new_value)} if paise_col is not None else {}),
+                'Year': int(year), 'MonthName': month_name, 'Month': month,
+                'PeriodSort': f"{year}-{str(month).zfill(2)}", 'DisplayPeriod': change['period'],
+                **{column: change[column] for column in MODIFIED_COLUMNS if change.get(column) is not None}
+            })
+        deltas.append({
+            'store': change['store'], 'classification': change['classification'], 'account': change['account'],
+            'partner': change['partner'], 'period': change['period'], 'delta': add_balances(new_value, -old_value)
+        })
+    if new_rows:
+        df = pd.concat([df, pd.DataFrame(new_rows)], ignore_index=True)
+    return df, deltas
+
+# =============================
+# EXCEL EXPORT WITH NATIVE GROUPING
+# =============================
+def build_excel_report(hierarchy, periods, store_filter="All", brand="pra", report_type="pnl", expand_all=False, open_classifications=None, open_accounts=None):
+    brand_name = BRAND_NAMES.get(brand, brand)
+    if open_classifications is None: open_classifications = set()
+    if open_accounts is None: open_accounts = set()
+    
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "P&L Statement"
+
+    ws.sheet_properties.outlinePr.summaryBelow = False
+    
+    DARK_BLUE, MID_BLUE, LIGHT_BLUE, WHITE = "0F2044", "1A3A6B", "EEF2F9", "FFFFFF"
+    GREEN, RED, GREY = "059669", "E11D48", "64748B"
+    
+    def make_fill(hex_color): return PatternFill(start_color=hex_color, end_color=hex_color, fill_type="solid")
+    hair_border = Border(bottom=Side(style='hair', color='E2E8F0'))
+
+    # --- Period comparison: a change and change % column per period and for the total ---
+    deltas = getattr(hierarchy, 'deltas', None)
+    delta_headers = []
+    if deltas is not None:
+        compare_label = PERIOD_COMPARISONS[hierarchy.compare][0]
+        for p in list(periods) + ["Total"]:
+            delta_headers += [f"{p} Δ {compare_label}", f"{p} Δ%"]
+
+    def write_deltas(row, totals, delta_totals, size, bold, fill, border, color=None):
+        if delta_totals is None:
+            return
+        pairs = [(totals.get(p, 0), delta_totals.get(p, 0.0)) for p in periods]
+        pairs.append((add_balances(*(v for v, _ in pairs)), add_balances(*(d for _, d in pairs))))
+        col_idx = len(periods) + 3
+        for value, delta in pairs:
+            for v, number_format in ((delta, '#,##0'), (delta_pct(value, delta), '0.0%')):
+                cell = ws.cell(row=row, column=col_idx, value=v)
+                cell.number_format = number_format
+                cell.font = Font(name="Calibri", bold=bold, size=size, color=color or (GREEN if delta >= 0.005 else RED if delta <= -0.005 else GREY))
+                cell.fill = make_fill(fill)
+                cell.alignment = Alignment(horizontal="right", vertical="center")
+                if border is not None:
+                    cell.border = border
+                col_idx += 1
+    
+    # --- Title Block ---
+    ws.merge_cells(f"A1:{get_column_letter(len(periods) + 3 + len(delta_headers))}1")
+    title_cell = ws["A1"]
+    if report_type == "store":
+        title_cell.value = "Store Comparison Report"
+    elif report_type == "group":
+        title_cell.value = "Consolidated Profit & Loss Statement"
+    else:
+        title_cell.value = "Profit & Loss Statement"
+    title_cell.font = Font(name="Calibri", bold=True, size=14, color=WHITE)
+    title_cell.fill = make_fill(DARK_BLUE)
+    title_cell.alignment = Alignment(horizontal="center", vertical="center")
+    ws.row_dimensions[1].height = 30
+    
+    ws.merge_cells(f"A2:{get_column_letter(len(periods) + 3 + len(delta_headers))}2")
+    sub_cell = ws["A2"]
+    if report_type == "store":
+        sub_cell.value = f"Brand: {brand_name}  |  Comparison View  |  Generated: {datetime.now().strftime('%d %b %Y, %H:%M')}"
+    elif report_type == "group":
+        sub_cell.value = f"Brands: {' + '.join(periods)}  |  {store_filter}  |  Generated: {datetime.now().strftime('%d %b %Y, %H:%M')}"
+    else:
+        sub_cell.value = f"Brand: {brand_name}  |  Store: {store_filter}  |  Generated: {datetime.now().strftime('%d %b %Y, %H:%M')}"
+    sub_cell.font = Font(name="Calibri", size=9, color="B8D4F5")
+    sub_cell.fill = make_fill(MID_BLUE)
+    sub_cell.alignment = Alignment(horizontal="center", vertical="center")
+    ws.row_dimensions[2].height = 18
+    ws.row_dimensions[3].height = 6
+    
+    # --- Headers ---
+    header_row = 4
+    headers = ["Account Hierarchy"] + list(periods) + ["Total"] + delta_headers
+    for col_idx, header in enumerate(headers, 1):
+        cell = ws.cell(row=header_row, column=col_idx, value=header)
+        cell.font = Font(name="Calibri", bold=True, size=9, color=WHITE)
+        cell.fill = make_fill(DARK_BLUE)
+        cell.alignment = Alignment(horizontal="right" if col_idx > 1 else "left", vertical="center", wrap_text=False)
+        cell.border = Border(bottom=Side(style='medium', color='FFFFFF'))
+    ws.row_dimensions[header_row].height = 24
+    
+    ws.column_dimensions['A'].width = 38
+    for col_idx in range(2, len(periods) + 2): ws.column_dimensions[get_column_letter(col_idx)].width = 15
+    ws.column_dimensions[get_column_letter(len(periods) + 2)].width = 15
+    for col_idx in range(len(periods) + 3, len(headers) + 1): ws.column_dimensions[get_column_letter(col_idx)].width = 15
+    
+    # --- Data Population with Outline Grouping ---
+    current_row = header_row + 1
+    
+    sorted_classifications = sorted(hierarchy.keys(), key=get_classification_order)
+    
+    for cls_name in sorted_classifications:
+        cls_data = hierarchy[cls_name]
+        cls_key = f"cls_{cls_name}"
+        is_cls_open = expand_all or (cls_key in open_classifications)
+        cls_total = add_balances(*cls_data['totals'].values())
+        
+        # 1. Classification (Level 0 summary - no outline level)
+        cls_cell = ws.cell(row=current_row, column=1, value=f"  {cls_name}")
+        cls_cell.font = Font(name="Calibri", bold=True, size=10, color=DARK_BLUE)
+        cls_cell.fill = make_fill(LIGHT_BLUE)
+        cls_cell.alignment = Alignment(horizontal="left", vertical="center", indent=1)
+        cls_cell.border = Border(top=Side(style='thin', color='CBD5E1'), bottom=Side(style='thin', color='CBD5E1'))
+        
+        for col_idx, p in enumerate(periods, 2):
+            v = cls_data['totals'].get(p, 0)
+            cell = ws.cell(row=current_row, column=col_idx, value=v)
+            cell.number_format = '#,##0'
+            cell.font = Font(name="Calibri", bold=True, size=9, color=GREEN if v > 0 else RED if v < 0 else GREY)
+            cell.fill = make_fill(LIGHT_BLUE)
+            cell.alignment = Alignment(horizontal="right", vertical="center")
+            cell.border = Border(top=Side(style='thin', color='CBD5E1'), bottom=Side(style='thin', color='CBD5E1'))
+        
+        total_cell = ws.cell(row=current_row, column=len(periods) + 2, value=cls_total)
+        total_cell.number_format = '#,##0'
+        total_cell.font = Font(name="Calibri", bold=True, size=9, color=GREEN if cls_total > 0 else RED if cls_total < 0 else GREY)
+        total_cell.fill = make_fill(LIGHT_BLUE)
+        total_cell.alignment = Alignment(horizontal="right", vertical="center")
+        total_cell.border = Border(top=Side(style='thin', color='CBD5E1'), bottom=Side(style='thin', color='CBD5E1'))
+        write_deltas(current_row, cls_data['totals'], _node_deltas(deltas, cls_name), 9, True, LIGHT_BLUE,
+                     Border(top=Side(style='thin', color='CBD5E1'), bottom=Side(style='thin', color='CBD5E1')))
+        ws.row_dimensions[current_row].height = 20
+        current_row += 1
+        
+        # Sort accounts alphabetically within each classification
+        for acc_name in sorted(cls_data['accounts'].keys()):
+            acc_data = cls_data['accounts'][acc_name]
+            acc_key = f"acc_{cls_name}__{acc_name}"
+            is_acc_open = expand_all or (acc_key in open_accounts)
+            acc_total = add_balances(*acc_data['totals'].values())
+            
+            # 2. Account (Level 1 details inside Classification)
+            acc_cell = ws.cell(row=current_row, column=1, value=f"      {acc_name}")
+            acc_cell.font = Font(name="Calibri", bold=True, size=9, color="334155")
+            acc_cell.fill = make_fill(WHITE)
+            acc_cell.alignment = Alignment(horizontal="left", vertical="center", indent=3)
+            acc_cell.border = hair_border
+            
+            for col_idx, p in enumerate(periods, 2):
+                v = acc_data['totals'].get(p, 0)
+                cell = ws.cell(row=current_row, column=col_idx, value=v)
+                cell.number_format = '#,##0'
+                cell.font = Font(name="Calibri", bold=True, size=8, color=GREEN if v > 0 else RED if v < 0 else GREY)
+                cell.fill = make_fill(WHITE)
+                cell.alignment = Alignment(horizontal="right", vertical="center")
+                cell.border = hair_border
+            
+            acc_total_cell = ws.cell(row=current_row, column=len(periods) + 2, value=acc_total)
+            acc_total_cell.number_format = '#,##0'
+            acc_total_cell.font = Font(name="Calibri", bold=True, size=8, color=GREEN if acc_total > 0 else RED if acc_total < 0 else GREY)
+            acc_total_cell.fill = make_fill(WHITE)
+            acc_total_cell.alignment = Alignment(horizontal="right", vertical="center")
+            acc_total_cell.border = hair_border
+            write_deltas(current_row, acc_data['totals'], _node_deltas(deltas, cls_name, acc_name), 8, True, WHITE, hair_border)
+            
+            # ** EXCEL NATIVE GROUPING LOGIC **
+            ws.row_dimensions[current_row].outline_level = 1
+            if not is_cls_open:
+                ws.row_dimensions[current_row].hidden = True
+                
+            ws.row_dimensions[current_row].height = 18
+            current_row += 1
+            
+            # Sort partners alphabetically within each account
+            for partner_name in sorted(acc_data['partners'].keys()):
+                prt_totals = acc_data['partners'][partner_name]
+                prt_total = add_balances(*prt_totals.values())
+                
+                # 3. Partner (Level 2 details inside Account)
+                prt_cell = ws.cell(row=current_row, column=1, value=f"            · {partner_name}")
+                prt_cell.font = Font(name="Calibri", size=8, color=GREY)
+                prt_cell.fill = make_fill(WHITE)
+                prt_cell.alignment = Alignment(horizontal="left", vertical="center", indent=5)
+                prt_cell.border = hair_border
+                
+                for col_idx, p in enumerate(periods, 2):
+                    v = prt_totals.get(p, 0)
+                    cell = ws.cell(row=current_row, column=col_idx, value=v)
+                    cell.number_format = '#,##0'
+                    cell.font = Font(name="Calibri", size=8, color=GREEN if v > 0 else RED if v < 0 else GREY)
+                    cell.fill = make_fill(WHITE)
+                    cell.alignment = Alignment(horizontal="right", vertical="center")
+                    cell.border = hair_border
+                
+                prt_total_cell = ws.cell(row=current_row, column=len(periods) + 2, value=prt_total)
+                prt_total_cell.number_format = '#,##0'
+                prt_total_cell.font = Font(name="Calibri", size=8, color=GREEN if prt_total > 0 else RED if prt_total < 0 else GREY)
+                prt_total_cell.fill = make_fill(WHITE)
+                prt_total_cell.alignment = Alignment(horizontal="right", vertical="center")
+                prt_total_cell.border = hair_border
+                write_deltas(current_row, prt_totals, _node_deltas(deltas, cls_name, acc_name, partner_name), 8, False, WHITE, hair_border)
+                
+                # ** EXCEL NATIVE GROUPING LOGIC **
+                ws.row_dimensions[current_row].outline_level = 2
+                if not is_cls_open or not is_acc_open:
+                    ws.row_dimensions[current_row].hidden = True
+                    
+                ws.row_dimensions[current_row].height = 16
+                current_row += 1
+    
+    # Grand Total
+    grand_totals = getattr(hierarchy, 'grand_totals', None) or {}
+    grand_totals = {p: grand_totals[p] if p in grand_totals else add_balances(*(cls_data['totals'].get(p, 0) for cls_data in hierarchy.values())) for p in periods}
+    grand_total = add_balances(*grand_totals.values())
+    
+    gt_cell = ws.cell(row=current_row, column=1, value="  GRAND TOTAL")
+    gt_cell.font = Font(name="Calibri", bold=True, size=11, color=WHITE)
+    gt_cell.fill = make_fill(DARK_BLUE)
+    gt_cell.alignment = Alignment(horizontal="left", vertical="center")
+    
+    for col_idx, p in enumerate(periods, 2):
+        cell = ws.cell(row=current_row, column=col_idx, value=grand_totals[p])
+        cell.number_format = '#,##0'
+        cell.font = Font(name="Calibri", bold=True, size=10, color=WHITE)
+        cell.fill = make_fill(DARK_BLUE)
+        cell.alignment = Alignment(horizontal="right", vertical="center")
+    
+    gt_total = ws.cell(row=current_row, column=len(periods) + 2, value=grand_total)
+    gt_total.number_format = '#,##0'
+    gt_total.font = Font(name="Calibri", bold=True, size=10, color=WHITE)
+    gt_total.fill = make_fill(DARK_BLUE)
+    gt_total.alignment = Alignment(horizontal="right", vertical="center")
+    if deltas is not None:
+        write_deltas(current_row, grand_totals, deltas.grand_totals, 10, True, DARK_BLUE, None, color=WHITE)
+    ws.row_dimensions[current_row].height = 24
+    
+    ws.freeze_panes = "B5"
+    
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+# =============================
+# HTML GRID RENDERING
+# =============================
+def _focus_attrs(focus, cls_name, acc_name=None):
+    # `open` for the classification/account on the path to the focused cell
+    if focus is None or focus[0] != cls_name or (acc_name is not None and focus[1] != acc_name):
+        return ""
+    return "open"
+
+def fmt_delta(value, delta):
+    """Change against the reference period as shown under a grid cell, e.g. '▲ ₹1,200 · +4.5%'."""
+    if abs(delta) < 0.005:
+        return "–"
+    pct = delta_pct(value, delta)
+    return f"{'▲' if delta > 0 else '▼'} {fmt_currency(abs(delta))}" + (f" · {pct:+.1%}" if pct is not None else "")
+
+def _delta_html(value, delta):
+    if delta is None:
+        return ""
+    direction = "delta-up" if delta >= 0.005 else "delta-down" if delta <= -0.005 else "delta-flat"
+    return f"<div class='pnl-delta {direction}'>{fmt_delta(value, delta)}</div>"
+
+def _node_deltas(deltas, *path):
+    # The node of the delta hierarchy at classification [/ account [/ partner]], or None
+    node = deltas.get(path[0]) if deltas is not None else None
+    if node is not None and len(path) > 1:
+        node = node['accounts'].get(path[1])
+    if node is not None and len(path) > 2:
+        return node['partners'].get(path[2])
+    return node['totals'] if node is not None else None
+
+def render_pnl_html(hierarchy, periods, expand_all=False, focus=None):
+    """
+    Render a period hierarchy as the collapsible HTML/CSS grid used in Financial Insights.
+    A hierarchy built with a period comparison shows each cell's change under its value.
+
+    :param focus: Optional (classification, account, partner, period) cell to open and highlight
+    """
+    deltas = getattr(hierarchy, 'deltas', None)
+
+    def delta_line(totals, delta_totals, column=None):
+        # Change for one column, or for the row total when `column` is None
+        if delta_totals is None:
+            return ""
+        if column is None:
+            return _delta_html(add_balances(*totals.values()), add_balances(*delta_totals.values()))
+        return _delta_html(totals.get(column, 0), delta_totals.get(column, 0.0))
+
+    num_periods = len(periods)
+    grid_template = f"350px repeat({num_periods}, minmax(130px, 1fr)) minmax(140px, 1fr)"
+
+    html_parts = []
+    html_parts.append(f"""
+    <style>
+    .pnl-container {{ width: 100%; overflow-x: auto; border: 1px solid #CBD5E1; border-radius: 8px; background: #FFFFFF; padding-bottom: 10px; }}
+    .pnl-table-wrapper {{ min-width: 100%; width: max-content; display: flex; flex-direction: column; }}
+    .pnl-row {{ 
+        display: grid; 
+        grid-template-columns: {grid_template}; 
+        border-bottom: 1px solid #E2E8F0; 
+        align-items: center; 
+        transition: background 0.2s; 
+        width: 100%;
+        background-color: inherit;
+    }}
+    .pnl-row:hover {{ background-color: #F8FAFC; }}
+    .pnl-header {{ background-color: #0F2044 !important; color: white; font-weight: bold; position: sticky; top: 0; z-index: 10; font-size: 12px; letter-spacing: 0.5px; }}
+    .pnl-cell {{ padding: 10px 12px; white-space: nowrap; font-size: 13px; }}
+    .pnl-cell:first-child {{ 
+        position: sticky; 
+        left: 0; 
+        background-color: inherit; 
+        z-index: 5; 
+        border-right: 1px solid #E2E8F0; 
+        overflow: hidden;
+        text-overflow: ellipsis;
+        white-space: nowrap;
+    }}
+    .pnl-header .pnl-cell:first-child {{ background-color: #0F2044; z-index: 15; }}
+    .align-right {{ text-align: right; }}
+    .val-pos {{ color: #059669; font-weight: 600; font-family: 'DM Mono', monospace; }}
+    .val-neg {{ color: #E11D48; font-weight: 600; font-family: 'DM Mono', monospace; }}
+    .val-tot {{ color: #0F2044; font-weight: 800; font-family: 'DM Mono', monospace; background: #EEF2F9; border-radius: 4px; padding: 3px 6px; display: inline-block; }}
+    .lvl-1 {{ font-weight: 700; color: #0F2044; background: #F1F5F9; cursor: pointer; }}
+    .lvl-2 {{ font-weight: 600; color: #334155; background: #FFFFFF; cursor: pointer; }}
+    .lvl-3 {{ color: #64748B; background: #FFFFFF; }}
+    details > summary {{ list-style: none; outline: none; }}
+    details > summary::-webkit-details-marker {{ display: none; }}
+    .arrow {{ display: inline-block; width: 18px; font-size: 11px; transition: transform 0.2s; color: #64748B; margin-right: 4px; }}
+    details[open] > summary .arrow {{ transform: rotate(90deg); color: #0F2044; }}
+    .cell-focus {{ outline: 2px solid #F59E0B; outline-offset: -3px; background: #FEF3C7; }}
+    .pnl-delta {{ font-size: 10px; font-weight: 500; margin-top: 2px; }}
+    .delta-up {{ color: #059669; }}
+    .delta-down {{ color: #E11D48; }}
+    .delta-flat {{ color: #94A3B8; }}
+    </style>
+    
+    <div class='pnl-container'>
+        <div class='pnl-table-wrapper'>
+    """)
+
+    html_parts.append("<div class='pnl-row pnl-header'>")
+    compare_label = f" <span style='font-weight: 500; color: #B8D4F5;'>· Δ {PERIOD_COMPARISONS[hierarchy.compare][0]}</span>" if deltas is not None else ""
+    html_parts.append(f"<div class='pnl-cell'>PARTICULARS{compare_label}</div>")
+    for p in periods:
+        short_p = p[:3] + " " + p[-2:]
+        html_parts.append(f"<div class='pnl-cell align-right'>{short_p.upper()}</div>")
+    html_parts.append("<div class='pnl-cell align-right'>TOTAL</div></div>")
+
+    pnl_open_attr = "open" if expand_all else ""
+
+    for cls_name, cls_data in hierarchy.items():
+        html_parts.append(f"<details {pnl_open_attr or _focus_attrs(focus, cls_name)}><summary class='pnl-row lvl-1'>")
+        html_parts.append(f"<div class='pnl-cell' title='{cls_name.upper()}'><span class='arrow'>▶</span> 📂 {cls_name.upper()}</div>")
+        cls_deltas = _node_deltas(deltas, cls_name)
+        for p in periods:
+            v = cls_data['totals'].get(p, 0)
+            color_cls = "val-pos" if v >= 0 else "val-neg"
+            html_parts.append(f"<div class='pnl-cell align-right {color_cls}'>{fmt_currency(v)}{delta_line(cls_data['totals'], cls_deltas, p)}</div>")
+        
+        cls_tot = add_balances(*cls_data['totals'].values())
+        html_parts.append(f"<div class='pnl-cell align-right'><span class='val-tot'>{fmt_currency(cls_tot)}</span>{delta_line(cls_data['totals'], cls_deltas)}</div>")
+        html_parts.append("</summary>")
+
+        for acc_name, acc_data in cls_data['accounts'].items():
+            acc_deltas = _node_deltas(deltas, cls_name, acc_name)
+            html_parts.append(f"<details {pnl_open_attr or _focus_attrs(focus, cls_name, acc_name)}><summary class='pnl-row lvl-2'>")
+            html_parts.append(f"<div class='pnl-cell' title='{acc_name}' style='padding-left: 28px;'><span class='arrow'>▶</span> 📄 {acc_name}</div>")
+            for p in periods:
+                v = acc_data['totals'].get(p, 0)
+                color_cls = "val-pos" if v >= 0 else "val-neg"
+                html_parts.append(f"<div class='pnl-cell align-right {color_cls}'>{fmt_currency(v)}{delta_line(acc_data['totals'], acc_deltas, p)}</div>")
+            
+            acc_tot = add_balances(*acc_data['totals'].values())
+            color_cls = "val-pos" if acc_tot >= 0 else "val-neg"
+            html_parts.append(f"<div class='pnl-cell align-right {color_cls}' style='font-weight: 800;'>{fmt_currency(acc_tot)}{delta_line(acc_data['totals'], acc_deltas)}</div>")
+            html_parts.append("</summary>")
+
+            for partner_name, prt_totals in acc_data['partners'].items():
+                prt_deltas = _node_deltas(deltas, cls_name, acc_name, partner_name)
+                focus_col = focus[3] if focus is not None and focus[:3] == (cls_name, acc_name, partner_name) else None
+                html_parts.append("<div class='pnl-row lvl-3'>")
+                html_parts.append(f"<div class='pnl-cell' title='{partner_name}' style='padding-left: 65px;'>• {partner_name}</div>")
+                for p in periods:
+                    v = prt_totals.get(p, 0)
+                    color_cls = "val-pos" if v >= 0 else "val-neg"
+                    if p == focus_col: color_cls += " cell-focus"
+                    html_parts.append(f"<div class='pnl-cell align-right {color_cls}'>{fmt_currency(v)}{delta_line(prt_totals, prt_deltas, p)}</div>")
+                
+                prt_tot = add_balances(*prt_totals.values())
+                color_cls = "val-pos" if prt_tot >= 0 else "val-neg"
+                html_parts.append(f"<div class='pnl-cell align-right {color_cls}'>{fmt_currency(prt_tot)}{delta_line(prt_totals, prt_deltas)}</div>")
+                html_parts.append("</div>")
+
+            html_parts.append("</details>") 
+        html_parts.append("</details>") 
+
+    html_parts.append("</div></div>")
+    return "".join(html_parts)
+
+def render_store_html(hierarchy, stores, expand_all=False, focus=None):
+    """
+    Render a store hierarchy as the Store Comparison HTML/CSS grid.
+
+    :param focus: Optional (classification, account, partner, store) cell to open and highlight
+    """
+    store_open_attr = "open" if expand_all else ""
+
+    num_stores = len(stores)
+    store_grid_template = f"350px repeat({num_stores}, 150px) 150px"
+
+    store_html = []
+    store_html.append(f"""
+    <style>
+    /* Container handles the scroll */
+    .store-container {{ width: 100%; overflow-x: auto; border: 1px solid #CBD5E1; border-radius: 8px; background: #FFFFFF; padding-bottom: 10px; }}
+    
+    /* Wrapper guarantees background stretches 100% */
+    .store-table-wrapper {{ min-width: 100%; width: max-content; display: flex; flex-direction: column; }}
+    
+    /* Rows span exactly the wrapper's width */
+    .store-row {{ 
+        display: grid; 
+        grid-template-columns: {store_grid_template}; 
+        border-bottom: 1px solid #E2E8F0; 
+        align-items: center; 
+        transition: background 0.2s; 
+        width: 100%;
+        background-color: inherit;
+    }}
+    .store-row:hover {{ background-color: #F8FAFC; }}
+    
+    /* Header styling */
+    .store-header {{ background-color: #0F2044 !important; color: white; font-weight: bold; position: sticky; top: 0; z-index: 10; font-size: 12px; letter-spacing: 0.5px; }}
+    .store-cell {{ padding: 10px 12px; white-space: nowrap; font-size: 13px; }}
+    
+    /* Sticky first column fix: background-color must be solid, not inherit, to prevent overlap */
+    .store-cell:first-child {{ 
+        position: sticky; 
+        left: 0; 
+        background-color: #FFFFFF; 
+        z-index: 5; 
+        border-right: 1px solid #E2E8F0; 
+        overflow: hidden;
+        text-overflow: ellipsis;
+        white-space: nowrap;
+    }}
+    .store-header .store-cell:first-child {{ background-color: #0F2044; z-index: 15; }}
+    
+    .align-right {{ text-align: right; }}
+    
+    /* Value Typography */
+    .val-pos {{ color: #059669; font-weight: 600; font-family: 'DM Mono', monospace; }}
+    .val-neg {{ color: #E11D48; font-weight: 600; font-family: 'DM Mono', monospace; }}
+    .val-tot {{ color: #0F2044; font-weight: 800; font-family: 'DM Mono', monospace; background: #EEF2F9; border-radius: 4px; padding: 3px 6px; display: inline-block; }}
+    
+    /* Hierarchical Styling */
+    .lvl-1 {{ font-weight: 700; color: #0F2044; background: #F1F5F9; cursor: pointer; }}
+    .lvl-2 {{ font-weight: 600; color: #334155; background: #FFFFFF; cursor: pointer; }}
+    .lvl-3 {{ color: #64748B; background: #FFFFFF; }}
+    
+    /* Accordion Details/Summary Reset */
+    details > summary {{ list-style: none; outline: none; }}
+    details > summary::-webkit-details-marker {{ display: none; }}
+    .arrow {{ display: inline-block; width: 18px; font-size: 11px; transition: transform 0.2s; color: #64748B; margin-right: 4px; }}
+    details[open] > summary .arrow {{ transform: rotate(90deg); color: #0F2044; }}
+    .cell-focus {{ outline: 2px solid #F59E0B; outline-offset: -3px; background: #FEF3C7; }}
+    </style>
+    
+    <div class='store-container'>
+        <div class='store-table-wrapper'>
+    """)
+
+    store_html.append("<div class='store-row store-header'><div class='store-cell'>PARTICULARS</div>")
+    for s in stores:
+        store_html.append(f"<div class='store-cell align-right'>{s.upper()}</div>")
+    store_html.append("<div class='store-cell align-right'>TOTAL</div></div>")
+
+    for cls_name, cls_data in hierarchy.items():
+        store_html.append(f"<details {store_open_attr or _focus_attrs(focus, cls_name)}><summary class='store-row lvl-1'>")
+        store_html.append(f"<div class='store-cell'><span class='arrow'>▶</span> 📂 {cls_name.upper()}</div>")
+        for s in stores:
+            v = cls_data['totals'].get(s, 0)
+            store_html.append(f"<div class='store-cell align-right {'val-pos' if v >= 0 else 'val-neg'}'>{fmt_currency(v)}</div>")
+        store_html.append(f"<div class='store-cell align-right'><span class='val-tot'>{fmt_currency(add_balances(*cls_data['totals'].values()))}</span></div>")
+        store_html.append("</summary>")
+
+        for acc_name, acc_data in cls_data['accounts'].items():
+            store_html.append(f"<details {store_open_attr or _focus_attrs(focus, cls_name, acc_name)}><summary class='store-row lvl-2'>")
+            store_html.append(f"<div class='store-cell' style='padding-left: 28px;'><span class='arrow'>▶</span> 📄 {acc_name}</div>")
+            for s in stores:
+                v = acc_data['totals'].get(s, 0)
+                store_html.append(f"<div class='store-cell align-right {'val-pos' if v >= 0 else 'val-neg'}'>{fmt_currency(v)}</div>")
+            store_html.append(f"<div class='store-cell align-right' style='font-weight: 800;'>{fmt_currency(add_balances(*acc_data['totals'].values()))}</div>")
+            store_html.append("</summary>")
+
+            for partner_name, prt_totals in acc_data['partners'].items():
+                focus_col = focus[3] if focus is not None and focus[:3] == (cls_name, acc_name, partner_name) else None
+                store_html.append("<div class='store-row lvl-3'>")
+                store_html.append(f"<div class='store-cell' style='padding-left: 65px;'>• {partner_name}</div>")
+                for s in stores:
+                    v = prt_totals.get(s, 0)
+                    store_html.append(f"<div class='store-cell align-right {'val-pos' if v >= 0 else 'val-neg'}{' cell-focus' if s == focus_col else ''}'>{fmt_currency(v)}</div>")
+                store_html.append(f"<div class='store-cell align-right'>{fmt_currency(add_balances(*prt_totals.values()))}</div>")
+                store_html.append("</div>")
+
+            store_html.append("</details>") 
+        store_html.append("</details>") 
+
+    store_html.append("</div></div>")
+    return "".join(store_html)
+
+# =============================
+# LEDGER EDITOR PIVOT
+# =============================
+EDITOR_DIMENSIONS = ['Store', 'classification', 'account_name', 'partner_id_name']
+
+MONTH_NUMBERS = {
+    'January': 1, 'February': 2, 'March': 3, 'April': 4, 'May': 5, 'June': 6,
+    'July': 7, 'August': 8, 'September': 9, 'October': 10, 'November': 11, 'December': 12
+}
+
+def get_period_sort_key(period):
+    try:
+        month_name, year = period.rsplit(' ', 1)
+        month_num = MONTH_NUMBERS.get(month_name, 0)
+        return (int(year), month_num)
+    except:
+        return (9999, 99)
+
+def build_editor_pivot(editor_df, dimension_columns=EDITOR_DIMENSIONS, formatted=True):
+    """
+    Pivot ledger rows into one editable row per Store/Class/Account/Partner with a
+    formatted column per period plus a Total (plain numbers with `formatted=False`).
+
+    :return: (pivot_df, period_columns) with period_columns in calendar order
+    """
+    pivot_df = balance_sum(editor_df, dimension_columns + ['DisplayPeriod'], as_index=False)
+
+    pivot_df = pivot_df.pivot_table(
+        index=dimension_columns,
+        columns='DisplayPeriod',
+        values='Balance',
+        aggfunc='sum',
+        fill_value=0.0
+    ).reset_index()
+
+    pivot_df.columns.name = None
+    period_columns = [col for col in pivot_df.columns if col not in dimension_columns]
+
+    if period_columns:
+        period_columns = sorted(period_columns, key=get_period_sort_key)
+        pivot_df['Total'] = sum_balance_columns(pivot_df, period_columns)
+        column_order = dimension_columns + period_columns + ['Total']
+        pivot_df = pivot_df[column_order]
+
+        if formatted:
+            for col in period_columns + ['Total']:
+                pivot_df[col] = pd.to_numeric(pivot_df[col], errors='coerce').fillna(0.0).apply(fmt_currency)
+
+        pivot_df = pivot_df.sort_values(['classification', 'account_name', 'partner_id_name'])
+    return pivot_df, period_columns
+
+EDITOR_DEFAULT_SORT = ['classification', 'account_name', 'partner_id_name']
+
+def editor_wide_frame(editor_df, dimension_columns=EDITOR_DIMENSIONS):
+    """
+    Numeric per-cell sums behind the Ledger Editor pivot: one row per dimension tuple,
+    a column per period in calendar order plus a Total.
+
+    :return: (wide_df, period_columns)
+    """
+    wide = balance_sum(editor_df, dimension_columns + ['DisplayPeriod']).unstack('DisplayPeriod', fill_value=0.0)
+    period_columns = sorted(wide.columns, key=get_period_sort_key)
+    wide = wide[period_columns]
+    wide.columns.name = None
+    wide['Total'] = sum_balance_columns(wide, period_columns)
+    return wide.reset_index(), period_columns
+
+def editor_page(editor_df, page=0, page_size=100, sort_by=None, descending=False, text_filter="", overrides=None,
+                dimension_columns=EDITOR_DIMENSIONS, wide=None):
+    """
+    One page of the Ledger Editor pivot. Rows are filtered and sorted on the numeric
+    per-cell sums of the whole selection, but only the page's rows are formatted and
+    sent to the grid.
+
+    :param page: Zero-based; clamped to the last page
+    :param sort_by: A dimension, period or 'Total' column; None keeps class/account/partner order
+    :param text_filter: Case-insensitive substring matched against the dimension columns
+    :param overrides: {(store, classification, account, partner, period): value} unsaved edits,
+                      shown on the page without changing its order
+    :param wide: (wide_df, period_columns) from `editor_wide_frame`, when the caller caches it
+    :return: (page_df, period_columns, row_keys, total_rows, page)
+    """
+    if editor_df.empty:
+        return pd.DataFrame(columns=dimension_columns), [], [], 0, 0
+    wide, period_columns = wide if wide is not None else editor_wide_frame(editor_df, dimension_columns)
+
+    text_filter = text_filter.strip()
+    if text_filter:
+        mask = np.zeros(len(wide), dtype=bool)
+        for column in dimension_columns:
+            mask |= wide[column].astype(str).str.contains(text_filter, case=False, regex=False).to_numpy()
+        wide = wide[mask]
+
+    order = [c for c in EDITOR_DEFAULT_SORT if c in wide.columns]
+    if sort_by in wide.columns:
+        order = [sort_by] + [c for c in order if c != sort_by]
+    wide = wide.sort_values(order, ascending=[not descending if c == sort_by else True for c in order], kind='stable')
+
+    total_rows = len(wide)
+    page = min(max(int(page), 0), max((total_rows - 1) // page_size, 0))
+    page_df = wide.iloc[page * page_size:(page + 1) * page_size].reset_index(drop=True)
+    row_keys = list(zip(*(page_df[c] for c in dimension_columns)))
+
+    if overrides:
+        positions = {key: i for i, key in enumerate(row_keys)}
+        period_positions = {p: page_df.columns.get_loc(p) for p in period_columns}
+        for cell, value in overrides.items():
+            i, column = positions.get(cell[:-1]), period_positions.get(cell[-1])
+            if i is not None and column is not None:
+                page_df.iat[i, column] = value
+        page_df['Total'] = sum_balance_columns(page_df, period_columns)
+
+    for column in period_columns + ['Total']:
+        page_df[column] = page_df[column].apply(fmt_currency)
+    return page_df, period_columns, row_keys, total_rows, page
+
+MONTH_ABBREVIATIONS = {name[:3]: name for name in MONTH_NUMBERS}
+
+def build_upsert_variables(change, modified_at, user):
+    """Upsert mutation variables for one Ledger Editor change ({'store', 'period', 'new_value', ...})."""
+    month, raw_year = change['period'].split()
+    return {
+        "year": 2000 + int(raw_year) if len(raw_year) == 2 else int(raw_year),
+        "monthName": MONTH_ABBREVIATIONS.get(month, month),
+        "store": str(change['store']).strip(),
+        "balance": to_paise(change['new_value']) / 100 if PAISE_BALANCES else float(change['new_value']),
+        "account_name": str(change['account']).strip(),
+        "classification": str(change['classification']).strip(),
+        "partner_id_name": str(change['partner']).strip(),
+        "last_modified_at": modified_at,
+        "last_modified_user": user
+    }
+
+def upsert_change(variables):
+    """The Ledger Editor change a set of upsert variables was built from (see `build_upsert_variables`)."""
+    return {
+        'store': variables['store'], 'classification': variables['classification'],
+        'account': variables['account_name'], 'partner': variables['partner_id_name'],
+        'period': f"{variables['monthName']} {variables['year']}", 'new_value': variables['balance'],
+        'last_modified_at': variables.get('last_modified_at'), 'last_modified_user': variables.get('last_modified_user')
+    }
+
+def change_key(change):
+    """The ledger cell a Ledger Editor change targets: (store, classification, account, partner, period)."""
+    return (change['store'], change['classification'], change['account'], change['partner'], change['period'])
+
+# =============================
+# FLAT FILE EXPORTS
+# =============================
+EXPORT_FORMATS = {'csv': "text/csv", 'parquet': "application/vnd.apache.parquet"}
+LEDGER_EXPORT_COLUMNS = EDITOR_DIMENSIONS + ['Year', 'Month', 'MonthName', 'DisplayPeriod', 'Balance'] + MODIFIED_COLUMNS
+
+def export_formats():
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or pq is not None]
+
+def ledger_export_frame(df):
+    """GL rows in export column order (internal helper columns dropped)."""
+    return df[[c for c in LEDGER_EXPORT_COLUMNS if c in df.columns]]
+
+def hierarchy_export_frame(hierarchy):
+    """
+    One row per classification / account / partner node with its totals per column, plus
+    the change and change % per column and for the total when built with a period comparison.
+    """
+    columns = list(hierarchy.columns)
+    deltas = getattr(hierarchy, 'deltas', None)
+    delta_columns = [f"{c} Δ" for c in columns] if deltas is not None else []
+
+    def values(totals, *path):
+        row = [totals.get(c, 0.0) for c in columns]
+        if deltas is not None:
+            delta_totals = _node_deltas(deltas, *path) or {}
+            row += [delta_totals.get(c, 0.0) for c in columns]
+        return row
+
+    rows = []
+    for classification, cls_node in hierarchy.items():
+        rows.append(['Classification', classification, None, None] + values(cls_node['totals'], classification))
+        for account, acc_node in cls_node['accounts'].items():
+            rows.append(['Account', classification, account, None] + values(acc_node['totals'], classification, account))
+            for partner, totals in acc_node['partners'].items():
+                rows.append(['Partner', classification, account, partner] + values(totals, classification, account, partner))
+    frame = pd.DataFrame(rows, columns=['Level'] + HIERARCHY_LEVELS + columns + delta_columns)
+    frame['Total'] = sum_balance_columns(frame, columns)
+    if deltas is not None:
+        frame['Total Δ'] = sum_balance_columns(frame, delta_columns)
+        for column in columns + ['Total']:
+            prior = (frame[column] - frame[f"{column} Δ"]).abs()
+            frame[f"{column} Δ%"] = (frame[f"{column} Δ"] / prior).where(prior > 0.005)
+    return frame
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only file the Parquet writer fills; drained after every row group
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def iter_export(frame, fmt="csv", chunk_rows=100_000):
+    """
+    Encode `frame` as CSV or Parquet, yielding the bytes `chunk_rows` rows at a time
+    so the encoded file never has to be held in memory whole. Parquet (one row group
+    per chunk) needs pyarrow.
+    """
+    if fmt == "csv":
+        for start in range(0, max(len(frame), 1), chunk_rows):
+            yield frame.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0).encode("utf-8")
+        return
+    if fmt != "parquet":
+        raise ValueError(f"Unknown export format {fmt!r}")
+    if pq is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    schema = pa.Schema.from_pandas(frame, preserve_index=False)
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for start in range(0, len(frame), chunk_rows):
+            writer.write_table(pa.Table.from_pandas(frame.iloc[start:start + chunk_rows], schema=schema, preserve_index=False))
+            yield sink.drain()
+    yield sink.drain()
+
+def write_export(frame, path, fmt=None, chunk_rows=100_000):
+    """Stream `frame` to `path`; the format defaults to the file extension."""
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    with open(path, "wb") as f:
+        for chunk in iter_export(frame, fmt, chunk_rows):
+            f.write(chunk)
+    return path
+
+def export_file(frame, fmt="csv", chunk_rows=100_000):
+    """The export in a rewound temporary file, spilled to disk rather than built in memory."""
+    # Unbuffered, so callers (st.download_button) see a plain raw file
+    f = tempfile.TemporaryFile(buffering=0)
+    for chunk in iter_export(frame, fmt, chunk_rows):
+        f.write(chunk)
+    f.seek(0)
+    return f
+
+# =============================
+# CONFLICT DETECTION
+# =============================
+UPSERT_KEY_FIELDS = ("year", "monthName", "store", "account_name", "classification", "partner_id_name")
+
+def fetch_cells(brand, changes, graphql=None):
+    """
+    Current server rows for just the edited cells, through the keyed readCells query.
+    Falls back to a full read filtered locally when the endpoint has no readCells.
+
+    :return: ledger frame (same shape as `load_data`)
+    """
+    graphql = graphql or run_graphql
+    keys = [{f: v for f, v in build_upsert_variables(c, None, None).items() if f in UPSERT_KEY_FIELDS} for c in changes]
+    with instrumentation.span("fetch_cells", cells=len(keys)):
+        result = graphql(READ_CELLS_QUERIES[brand], {"keys": json.dumps(keys)})
+        if result and not result.get("errors"):
+            cells = prepare_ledger_frame((result.get("data") or {}).get(READ_CELLS_KEYS[brand]) or [], brand)
+        else:
+            full = load_data(brand) if graphql is run_graphql else load_data(brand, graphql)
+            wanted = [(c['store'], c['classification'], c['account'], c['partner'], c['period']) for c in changes]
+            cells = full[pd.MultiIndex.from_frame(full[LEDGER_KEY_COLUMNS]).isin(wanted)] if not full.empty else full
+    instrumentation.record_rows("conflict_cells", len(cells))
+    return cells
+
+def _cell_stamps(df):
+    # (summed balance, latest modification time, user who made it) per ledger cell
+    if df.empty or 'last_modified_at' not in df.columns:
+        return {}
+    stamped = df.assign(_modified=pd.to_datetime(df['last_modified_at'], utc=True, errors='coerce'))
+    latest = stamped.sort_values('_modified', na_position='first').groupby(LEDGER_KEY_COLUMNS, sort=False).tail(1)
+    sums = balance_sum(df, LEDGER_KEY_COLUMNS, sort=False)
+    return {
+        key: (float(sums[key]), modified, user)
+        for key, modified, user in zip(zip(*(latest[c] for c in LEDGER_KEY_COLUMNS)), latest['_modified'], latest['last_modified_user'])
+    }
+
+def _edited_rows(df, changes):
+    # Only the edited cells' rows matter; cheap column filters first, the exact keys come later
+    if df.empty:
+        return df
+    return df[df['DisplayPeriod'].isin({c['period'] for c in changes}) & df['account_name'].isin({c['account'] for c in changes})]
+
+def ledger_cell_stamps(df, changes):
+    """Latest `last_modified_at` of each changed cell in `df`, as a string (None for a cell with no rows)."""
+    stamps = _cell_stamps(_edited_rows(df, changes))
+    keys = [(c['store'], c['classification'], c['account'], c['partner'], c['period']) for c in changes]
+    modified = [stamps.get(key, (0.0, None, None))[1] for key in keys]
+    return [None if pd.isna(m) else m.strftime("%Y-%m-%dT%H:%M:%SZ") for m in modified]
+
+def detect_conflicts(loaded_df, server_df, changes, loaded_stamps=None):
+    """
+    Changes whose cell was modified on the server since `loaded_df` was read, i.e. the
+    latest `last_modified_at` differs between the two.
+
+    :param loaded_stamps: {cell key: `last_modified_at`} used instead of `loaded_df`'s stamp
+                          for those cells, e.g. the stamp an edit still waiting in the journal
+                          was based on, since the loaded rows already carry that edit's stamp;
+                          `loaded_df` may be None when it covers every change
+    :return: list of the conflicting changes, each with 'server_value',
+             'server_modified_at' and 'server_modified_user' added
+    """
+    loaded = {} if loaded_df is None else _cell_stamps(_edited_rows(loaded_df, changes))
+    server = _cell_stamps(server_df)
+    loaded_stamps = loaded_stamps or {}
+    conflicts = []
+    for change in changes:
+        key = change_key(change)
+        if key in loaded_stamps:
+            loaded_modified = pd.to_datetime(loaded_stamps[key], utc=True, errors='coerce')
+        else:
+            loaded_modified = loaded.get(key, (0.0, None, None))[1]
+        server_value, server_modified, server_user = server.get(key, (0.0, None, None))
+        if pd.isna(loaded_modified) and pd.isna(server_modified):
+            continue
+        if pd.isna(loaded_modified) or pd.isna(server_modified) or loaded_modified != server_modified:
+            conflicts.append(dict(
+                change, server_value=server_value, server_modified_user=server_user,
+                server_modified_at=None if pd.isna(server_modified) else server_modified.strftime("%Y-%m-%dT%H:%M:%SZ")
+            ))
+    return conflicts
+
+def server_change(conflict):
+    """The change that puts a conflicting cell (see `detect_conflicts`) back to Fabric's value."""
+    return dict(conflict, new_value=conflict['server_value'], last_modified_at=conflict['server_modified_at'],
+                last_modified_user=conflict['server_modified_user'])
+
+# =============================
+# BULK ADJUSTMENTS
+# =============================
+# Uploaded adjustment file headers (lowercase, spaces/underscores dropped) -> ledger columns.
+# 'new_value' sets a cell's balance, 'adjustment' is added to its current balance.
+ADJUSTMENT_HEADERS = {
+    'store': 'Store',
+    'classification': 'classification', 'class': 'classification',
+    'account': 'account_name', 'accountname': 'account_name', 'ledger': 'account_name',
+    'partner': 'partner_id_name', 'partneridname': 'partner_id_name', 'contraname': 'partner_id_name',
+    'period': 'DisplayPeriod', 'displayperiod': 'DisplayPeriod',
+    'balance': 'new_value', 'newbalance': 'new_value', 'newvalue': 'new_value',
+    'adjustment': 'adjustment', 'delta': 'adjustment', 'change': 'adjustment'
+}
+ADJUSTMENT_LABELS = {'Store': "store", 'classification': "classification", 'account_name': "account",
+                     'partner_id_name': "partner", 'DisplayPeriod': "period"}
+
+def read_adjustments(file, name):
+    """
+    Read an uploaded CSV / Excel adjustments file into LEDGER_KEY_COLUMNS plus one amount
+    column, 'new_value' or 'adjustment'. Every cell is read as text; `validate_adjustments`
+    parses it. Raises ValueError when a required column is missing or there are no rows.
+    """
+    if name.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            frame = pd.read_excel(file, dtype=str, engine="openpyxl")
+        except zipfile.BadZipFile:
+            raise ValueError(f"{name} is not a readable Excel workbook")
+    else:
+        frame = pd.read_csv(file, dtype=str, skipinitialspace=True)
+    frame = frame.rename(columns=lambda c: ADJUSTMENT_HEADERS.get(re.sub(r"[\s_]", "", str(c)).lower(), c))
+    missing = [ADJUSTMENT_LABELS[c] for c in LEDGER_KEY_COLUMNS if c not in frame.columns]
+    if missing:
+        raise ValueError(f"Adjustments file is missing column(s): {', '.join(missing)}")
+    amounts = [c for c in ('new_value', 'adjustment') if c in frame.columns]
+    if len(amounts) != 1:
+        raise ValueError("Adjustments file needs exactly one of a Balance or an Adjustment column")
+    if frame.empty:
+        raise ValueError(f"{name} has no adjustment rows")
+    return frame[LEDGER_KEY_COLUMNS + amounts]
+
+PERIOD_MONTHS = {**{m.lower(): m for m in MONTH_NUMBERS}, **{m[:3].lower(): m for m in MONTH_NUMBERS}}
+
+def parse_periods(values):
+    """'April 2025', 'Apr 25' or an Excel date per value -> 'April 2025'; NaN when unrecognised."""
+    parts = values.str.rsplit(' ', n=1, expand=True).reindex(columns=[0, 1])
+    months = parts[0].str.lower().map(PERIOD_MONTHS)
+    years = pd.to_numeric(parts[1], errors='coerce')
+    years = years.where(years >= 100, years + 2000)
+    named = months.notna() & years.notna()
+    periods = pd.Series(np.nan, index=values.index, dtype=object)
+    periods[named] = months[named] + " " + years[named].astype(int).astype(str)
+    dated = values.notna() & ~named
+    if dated.any():
+        periods[dated] = pd.to_datetime(values[dated], errors='coerce', format='ISO8601').dt.strftime('%B %Y')
+    return periods
+
+def validate_adjustments(adjustments, ledger_df):
+    """
+    Check every adjustment row against the ledger's stores, periods and classification /
+    account / partner tree at once, then sum the valid rows per cell and join the cells'
+    current balances. Adjustment rows for the same cell add up; Balance rows for the
+    same cell are rejected, since there is no telling which value was meant.
+
+    :param adjustments: Frame from `read_adjustments`
+    :param ledger_df: The loaded ledger the adjustments apply to
+    :return: (changes, rejected). `changes` has one row per cell whose balance changes,
+             with its first file 'Row', 'old_value', 'new_value' and 'delta'. `rejected`
+             holds the file rows that failed, as uploaded, with the reasons in 'error'.
+    """
+    amount = 'new_value' if 'new_value' in adjustments.columns else 'adjustment'
+    # Empty or all-blank columns come back from pandas as floats, even with dtype=str
+    uploaded = adjustments.astype("string").apply(lambda column: column.str.strip().replace("", pd.NA))
+    uploaded.insert(0, 'Row', np.arange(len(uploaded)) + 2)  # spreadsheet row number, below the header
+    frame = uploaded.assign(DisplayPeriod=parse_periods(uploaded['DisplayPeriod']))
+    frame['Balance'] = pd.to_numeric(frame[amount].str.replace(r"[₹,\s]", "", regex=True), errors='coerce').astype(float)
+
+    stores = ledger_df['Store'].dropna().unique()
+    periods = ledger_df['DisplayPeriod'].dropna().unique()
+    tree = pd.MultiIndex.from_frame(ledger_df[HIERARCHY_LEVELS].drop_duplicates())
+    rows = pd.MultiIndex.from_frame(frame[HIERARCHY_LEVELS])
+    known_classification = frame['classification'].isin(tree.get_level_values(0))
+    known_account = rows.droplevel(2).isin(tree.droplevel(2))
+    checks = [(uploaded[c].isna(), f"missing {label}") for c, label in ADJUSTMENT_LABELS.items()] + [
+        (uploaded['DisplayPeriod'].notna() & frame['DisplayPeriod'].isna(), "unrecognised period"),
+        (frame['Balance'].isna(), f"{'balance' if amount == 'new_value' else 'adjustment'} is not a number"),
+        (frame['Store'].notna() & ~frame['Store'].isin(stores), "unknown store"),
+        (frame['DisplayPeriod'].notna() & ~frame['DisplayPeriod'].isin(periods), "period not loaded"),
+        (frame['classification'].notna() & ~known_classification, "unknown classification"),
+        (frame['account_name'].notna() & known_classification & ~known_account, "account not under this classification"),
+        (frame['partner_id_name'].notna() & known_account & ~rows.isin(tree), "partner not under this account")
+    ]
+    if amount == 'new_value':
+        duplicate = frame[LEDGER_KEY_COLUMNS].notna().all(axis=1) & frame.duplicated(LEDGER_KEY_COLUMNS, keep=False)
+        if duplicate.any():
+            rows_of_cell = frame[duplicate].groupby(LEDGER_KEY_COLUMNS)['Row'].transform(lambda r: ", ".join(map(str, r)))
+            checks.append((duplicate, ("duplicate cell (rows " + rows_of_cell + ")").reindex(frame.index)))
+    errors = np.full(len(frame), "", dtype=object)
+    for mask, message in checks:
+        mask = np.asarray(mask, dtype=bool)
+        if not isinstance(message, str):
+            message = message.to_numpy(dtype=object)[mask]
+        errors[mask] = np.where(errors[mask] == "", message, errors[mask] + "; " + message)
+    valid = errors == ""
+    rejected = uploaded[~valid].assign(error=errors[~valid])
+    frame = frame[valid]
+
+    # Adjustment rows for the same cell add up, as ledger rows do
+    cells = balance_sum(frame, LEDGER_KEY_COLUMNS, sort=False).to_frame('amount')
+    cells['Row'] = frame.groupby(LEDGER_KEY_COLUMNS, sort=False)['Row'].min()
+    touched = ledger_df[ledger_df['DisplayPeriod'].isin(frame['DisplayPeriod'].unique())
+                        & ledger_df['account_name'].isin(frame['account_name'].unique())]
+    cells['old_value'] = balance_sum(touched, LEDGER_KEY_COLUMNS).reindex(cells.index, fill_value=0.0).to_numpy()
+    new_value = cells['amount'] if amount == 'new_value' else cells['old_value'] + cells['amount']
+    cells['new_value'] = to_paise(new_value) / 100 if PAISE_BALANCES else new_value
+    cells['delta'] = to_paise(cells['new_value'] - cells['old_value']) / 100 if PAISE_BALANCES else cells['new_value'] - cells['old_value']
+    changes = cells[cells['delta'] != 0].drop(columns='amount').reset_index().sort_values('Row', kind='stable')
+    return changes[['Row'] + LEDGER_KEY_COLUMNS + ['old_value', 'new_value', 'delta']].reset_index(drop=True), rejected.reset_index(drop=True)
+
+def adjustment_changes(changes):
+    """`validate_adjustments` changes as Ledger Editor change dicts for the save path."""
+    return [{
+        'store': store, 'classification': classification, 'account': account, 'partner': partner,
+        'period': period, 'new_value': float(new_value), 'old_value': float(old_value)
+    } for store, classification, account, partner, period, new_value, old_value in zip(
+        *(changes[c] for c in LEDGER_KEY_COLUMNS), changes['new_value'], changes['old_value'])]
+
+# =============================
+# REPORT SELECTION
+# =============================
+def select_periods(period_list, base_period, num_comparisons):
+    base_idx = period_list.index(base_period)
+    return period_list[base_idx: min(base_idx + num_comparisons + 1, len(period_list))]
+
+def select_report_frame(df, periods, store_filter="All"):
+    report_df = df[df['DisplayPeriod'].isin(periods)].copy()
+    if store_filter != "All": report_df = report_df[report_df['Store'] == store_filter]
+    return report_df
+
+def store_comparison_periods(periods):
+    """
+    Periods and label for the Store Comparison: the whole selection when a full FY is
+    selected (12+ months), otherwise only the base period.
+    """
+    if len(periods) >= 12:
+        return list(periods), "Financial Year"
+    return [periods[0]], periods[0]
+
+def store_comparison_frame(report_df, periods):
+    comp_periods, label = store_comparison_periods(periods)
+    if len(comp_periods) == len(periods):
+        return report_df.copy(), label
+    return report_df[report_df['DisplayPeriod'].isin(comp_periods)].copy(), label
+
+def build_pnl_workbook(df, periods, store_filter="All", brand="pra", expand_all=False, compare=None):
+    report_df = select_report_frame(df, periods, store_filter)
+    if report_df.empty:
+        return None
+    if compare is None:
+        hierarchy = build_hierarchy_data(report_df, periods)
+    else:
+        # The reference periods fall outside `report_df`, so reduce a cube that includes them
+        cube = build_aggregation_cube(select_report_frame(df, list(periods) + comparison_periods(periods, compare), store_filter))
+        hierarchy = hierarchy_from_cube(cube, periods, periods=periods, compare=compare)
+    return build_excel_report(hierarchy, periods, store_filter=store_filter, brand=brand, expand_all=expand_all)
+
+def build_store_workbook(df, periods, brand="pra", expand_all=False):
+    report_df = select_report_frame(df, periods)
+    if report_df.empty:
+        return None, None
+    comp_periods, label = store_comparison_periods(periods)
+    hierarchy = hierarchy_from_cube(build_aggregation_cube(report_df), group_by='Store', periods=comp_periods)
+    stores = hierarchy.columns
+    workbook = build_excel_report(hierarchy, stores, store_filter="Comparison", brand=brand, report_type="store", expand_all=expand_all)
+    return workbook, label
+
+# =============================
+# TREND METRICS
+# =============================
+TREND_WINDOWS = {'3M Avg': 3, '6M Avg': 6, '12M Avg': 12}
+TREND_TRANSFORMS = ['Monthly'] + list(TREND_WINDOWS) + ['YTD']
+ALL_STORES_SERIES = "All Stores"
+
+def _trend_transforms(wide):
+    """Every TREND_TRANSFORMS view of a months x series frame; YTD restarts each April."""
+    views = {'Monthly': wide}
+    for label, window in TREND_WINDOWS.items():
+        views[label] = wide.rolling(window, min_periods=window).mean()
+    financial_year = wide.index.year - (wide.index.month < 4)
+    views['YTD'] = wide.groupby(financial_year).cumsum()
+    return views
+
+def build_trend_data(df, revenue_classes=REVENUE_CLASSES):
+    """
+    Full monthly history per store and per classification, with rolling averages,
+    FY-to-date totals and margins, computed once per dataset for the Trend Explorer.
+    Months with no rows count as zero so rolling windows span calendar months.
+
+    :return: {'periods', 'store': {metric: {transform: frame}}, 'classification': {...}},
+             each frame indexed by month start with one column per series
+    """
+    rows = df.dropna(subset=['Year', 'Month'])
+    if rows.empty:
+        return {'periods': pd.DatetimeIndex([]), 'store': {}, 'classification': {}}
+
+    month_start = pd.to_datetime(pd.DataFrame({
+        'year': rows['Year'].astype(int), 'month': rows['Month'].astype(int), 'day': 1
+    }))
+    periods = pd.date_range(month_start.min(), month_start.max(), freq='MS')
+
+    def monthly(values, series):
+        wide = values.groupby([month_start, series]).sum().unstack(fill_value=0.0)
+        return wide.reindex(periods, fill_value=0.0)
+
+    is_revenue = rows['classification'].isin(revenue_classes)
+    revenue = monthly(rows['Balance'].where(is_revenue, 0.0), rows['Store'])
+    expenses = monthly(rows['Balance'].where(~is_revenue, 0.0), rows['Store'])
+    revenue[ALL_STORES_SERIES] = revenue.sum(axis=1)
+    expenses[ALL_STORES_SERIES] = expenses.sum(axis=1)
+
+    store = {
+        'Revenue': _trend_transforms(revenue),
+        'Expenses': _trend_transforms(expenses),
+        'Profit': _trend_transforms(revenue - expenses)
+    }
+    # Margins of averaged/cumulative figures, not averages of monthly margins
+    store['Margin %'] = {
+        t: store['Profit'][t] / store['Revenue'][t].where(store['Revenue'][t] != 0) * 100
+        for t in TREND_TRANSFORMS
+    }
+
+    balances = monthly(rows['Balance'], rows['classification'])
+    balances = balances[sorted(balances.columns, key=get_classification_order)]
+    return {'periods': periods, 'store': store, 'classification': {'Balance': _trend_transforms(balances)}}
+
+# =============================
+# ANOMALY SCAN
+# =============================
+ANOMALY_SERIES = ['Store'] + HIERARCHY_LEVELS
+ANOMALY_SIGNALS = ['Z-Score', 'MoM', 'YoY']
+
+def scan_anomalies(df, z_threshold=3.0, jump_threshold=1.0, min_amount=10000.0, min_history=6):
+    """
+    Flag unusual monthly balances across every store / classification / account /
+    partner series, in one NumPy pass over a series x month matrix. Each series
+    spans its first to last month with rows; months in between with no rows are 0.
+
+    A cell is flagged when its leave-one-out z-score (against the series' other
+    months, so an outlier cannot hide by inflating its own mean) reaches `z_threshold`,
+    or its month-over-month / year-over-year change is at least `jump_threshold`
+    relative to the earlier month. The rupee amount behind the signal must also be
+    at least `min_amount`.
+
+    :return: DataFrame of flagged cells ranked by Impact, the largest rupee amount
+             behind any of its signals
+    """
+    rows = df.dropna(subset=['Year', 'Month'])
+    columns = ANOMALY_SERIES + ['DisplayPeriod', 'PeriodSort', 'Balance', 'Expected', 'Z-Score',
+                                'MoM', 'MoM %', 'YoY', 'YoY %', 'Impact', 'Signals']
+    if rows.empty:
+        return pd.DataFrame(columns=columns)
+
+    month_pos = (rows['Year'].to_numpy(dtype=np.int64) * 12 + rows['Month'].to_numpy(dtype=np.int64) - 1)
+    first_month = month_pos.min()
+    month_pos = month_pos - first_month
+    n_months = int(month_pos.max()) + 1
+    grouped = rows.groupby(ANOMALY_SERIES, dropna=False, sort=False)
+    series_codes = grouped.ngroup().to_numpy()
+    series_keys = grouped.size().index
+    n_series = len(series_keys)
+
+    flat = series_codes * n_months + month_pos
+    values = np.bincount(flat, weights=rows['Balance'].to_numpy(dtype=float), minlength=n_series * n_months)
+    values = values.reshape(n_series, n_months)
+    has_rows = np.bincount(flat, minlength=n_series * n_months).reshape(n_series, n_months) > 0
+    month_idx = np.arange(n_months)
+    first = has_rows.argmax(axis=1)
+    last = n_months - 1 - has_rows[:, ::-1].argmax(axis=1)
+    active = (month_idx >= first[:, None]) & (month_idx <= last[:, None])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Leave-one-out moments on values centred per series, to keep the variance numerically stable
+        count = active.sum(axis=1)[:, None]
+        centred = np.where(active, values - values.sum(axis=1)[:, None] / count, 0.0)
+        others = count - 1
+        loo_mean = (centred.sum(axis=1)[:, None] - centred) / others
+        loo_var = (np.square(centred).sum(axis=1)[:, None] - np.square(centred)) / others - np.square(loo_mean)
+        loo_std = np.sqrt(np.clip(loo_var, 0.0, None))
+        deviation = centred - loo_mean
+        z_scores = np.where(active & (others >= min_history) & (loo_std > 1e-9), deviation / loo_std, np.nan)
+
+        def change(lag):
+            earlier = np.full_like(values, np.nan)
+            earlier[:, lag:] = np.where(active[:, :-lag], values[:, :-lag], np.nan)
+            delta = np.where(active, values - earlier, np.nan)
+            return delta, np.where(earlier != 0, delta / np.abs(earlier), np.nan)
+
+        mom, mom_pct = change(1)
+        yoy, yoy_pct = change(12) if n_months > 12 else (np.full_like(values, np.nan),) * 2
+
+    z_flag = (np.abs(z_scores) >= z_threshold) & (np.abs(deviation) >= min_amount)
+    mom_flag = (np.abs(mom_pct) >= jump_threshold) & (np.abs(mom) >= min_amount)
+    yoy_flag = (np.abs(yoy_pct) >= jump_threshold) & (np.abs(yoy) >= min_amount)
+    impact = np.fmax(np.fmax(np.where(z_flag, np.abs(deviation), np.nan), np.where(mom_flag, np.abs(mom), np.nan)),
+                     np.where(yoy_flag, np.abs(yoy), np.nan))
+
+    series_idx, period_idx = np.nonzero(z_flag | mom_flag | yoy_flag)
+    if not len(series_idx):
+        return pd.DataFrame(columns=columns)
+
+    absolute = period_idx + first_month
+    years, months = absolute // 12, absolute % 12 + 1
+    month_names = np.array(list(MONTH_NUMBERS))[months - 1]
+    cell = (series_idx, period_idx)
+    signals = np.stack([z_flag[cell], mom_flag[cell], yoy_flag[cell]], axis=1)
+    result = series_keys[series_idx].to_frame(index=False)
+    result = result.assign(**{
+        'DisplayPeriod': np.char.add(np.char.add(month_names, " "), years.astype(str)),
+        'PeriodSort': [f"{y}-{str(m).zfill(2)}" for y, m in zip(years, months)],
+        'Balance': values[cell],
+        'Expected': values[cell] - deviation[cell],
+        'Z-Score': z_scores[cell],
+        'MoM': mom[cell], 'MoM %': mom_pct[cell] * 100,
+        'YoY': yoy[cell], 'YoY %': yoy_pct[cell] * 100,
+        'Impact': impact[cell],
+        'Signals': [", ".join(np.array(ANOMALY_SIGNALS)[flags]) for flags in signals]
+    })
+    return result.sort_values('Impact', ascending=False, kind='stable').reset_index(drop=True)
+
+# =============================
+# ACCOUNT & PARTNER SEARCH
+# =============================
+SEARCH_FIELDS = {'account': 'account_name', 'partner': 'partner_id_name'}
+_SEARCH_WORDS = re.compile(r'[^\W_]+')
+
+class LedgerSearchIndex:
+    """
+    Prefix and substring index over the account and partner names of one dataset
+    version. Built once; each lookup touches only the names sharing the query's
+    word prefix or trigrams instead of scanning the ledger rows.
+    """
+
+    def __init__(self, df):
+        self.labels = df.index.to_numpy()
+        self.fields = {}
+        for level, column in SEARCH_FIELDS.items():
+            codes, names = pd.factorize(df[column]) if column in df.columns else (np.full(len(df), -1), pd.Index([]))
+            folded = [str(name).casefold() for name in names]
+            words = sorted((word, i) for i, name in enumerate(folded) for word in set(_SEARCH_WORDS.findall(name)) | {name})
+            trigrams = {}
+            for i, name in enumerate(folded):
+                for gram in {name[j:j + 3] for j in range(len(name) - 2)}:
+                    trigrams.setdefault(gram, []).append(i)
+            path_columns = HIERARCHY_LEVELS[:2] if level == 'account' else HIERARCHY_LEVELS
+            paths = {}
+            if len(names):
+                nodes = df.loc[codes >= 0, path_columns].assign(_code=codes[codes >= 0]).drop_duplicates()
+                for path in nodes.itertuples(index=False):
+                    paths.setdefault(path[-1], []).append(tuple(path[:-1]))
+            self.fields[level] = {
+                'codes': codes, 'names': names, 'folded': folded, 'words': words,
+                'word_keys': [w for w, _ in words], 'trigrams': trigrams, 'paths': paths
+            }
+
+    def _matching_ids(self, field, query):
+        """{name id: rank}; 0 exact, 1 name prefix, 2 word prefix, 3 substring."""
+        folded, keys = field['folded'], field['word_keys']
+        ranks = {}
+        start = bisect_left(keys, query)
+        for word, i in field['words'][start:bisect_left(keys, query + '\uffff', start)]:
+            rank = 0 if folded[i] == query else 1 if folded[i].startswith(query) else 2
+            ranks[i] = min(rank, ranks.get(i, 3))
+        if len(query) >= 3:
+            postings = sorted((field['trigrams'].get(query[j:j + 3], ()) for j in range(len(query) - 2)), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:]) if postings else set()
+            for i in candidates:
+                if i not in ranks and query in folded[i]:
+                    ranks[i] = 3
+        return ranks
+
+    def search(self, query, limit=50):
+        """
+        Hierarchy nodes whose account or partner name matches `query`, best first.
+
+        :return: list of {'level', 'name', 'classification', 'account', 'partner'};
+                 'partner' is None for account nodes
+        """
+        query = query.strip().casefold()
+        if not query:
+            return []
+        hits = []
+        for level, field in self.fields.items():
+            for i, rank in self._matching_ids(field, query).items():
+                name = field['names'][i]
+                for path in field['paths'].get(i, []):
+                    hits.append((rank, str(name), level, path))
+        hits.sort(key=lambda hit: (hit[0], hit[1].casefold(), hit[2]))
+        return [{
+            'level': level, 'name': name, 'classification': path[0], 'account': path[1],
+            'partner': path[2] if level == 'partner' else None
+        } for _, name, level, path in hits[:limit]]
+
+    def row_labels(self, query):
+        """Index labels of the rows whose account or partner name matches `query`."""
+        query = query.strip().casefold()
+        if not query:
+            return self.labels
+        mask = np.zeros(len(self.labels), dtype=bool)
+        for field in self.fields.values():
+            ids = list(self._matching_ids(field, query))
+            if ids:
+                mask |= np.isin(field['codes'], ids)
+        return self.labels[mask]
+
+def search_hierarchy(hierarchy, matches):
+    """
+    The part of `hierarchy` on the path to `matches` (from `LedgerSearchIndex.search`):
+    matched accounts with all their partners, and matched partners under their account.
+    Node totals are the unfiltered ones.
+    """
+    accounts = {(m['classification'], m['account']) for m in matches if m['level'] == 'account'}
+    partners = {}
+    for m in matches:
+        if m['level'] == 'partner':
+            partners.setdefault((m['classification'], m['account']), set()).add(m['partner'])
+
+    result = Hierarchy(hierarchy.columns, hierarchy.group_by, hierarchy.scope)
+    result.grand_totals = dict(hierarchy.grand_totals)
+    result.compare, result.reference, result.deltas = hierarchy.compare, hierarchy.reference, hierarchy.deltas
+    for classification, cls_node in hierarchy.items():
+        account_nodes = {}
+        for account, acc_node in cls_node['accounts'].items():
+            key = (classification, account)
+            if key in accounts:
+                account_nodes[account] = acc_node
+            elif key in partners:
+                account_nodes[account] = {
+                    'totals': acc_node['totals'],
+                    'partners': {p: v for p, v in acc_node['partners'].items() if p in partners[key]}
+                }
+        if account_nodes:
+            result[classification] = {'totals': cls_node['totals'], 'accounts': account_nodes}
+    return result
+
+# =============================
+# GROUP CONSOLIDATION
+# =============================
+GROUP_LABEL = "Group"
+
+def load_brands(brands, loader=None, max_workers=None):
+    """
+    Fetch several brands' ledgers concurrently, so the group view waits for the slowest
+    brand rather than the sum of all of them. Workers run in a copy of the caller's
+    context, so their Fabric calls are recorded in the current rerun trace.
+
+    :param loader: brand -> ledger frame (default `load_data`)
+    :return: {brand: ledger frame}
+    """
+    loader = loader or load_data
+    with ThreadPoolExecutor(max_workers=max_workers or len(brands)) as pool:
+        futures = {brand: pool.submit(contextvars.copy_context().run, loader, brand) for brand in brands}
+        return {brand: future.result() for brand, future in futures.items()}
+
+def group_period_frame(frames):
+    """Distinct periods across brands, shaped for `get_period_list` / `get_financial_year_range`."""
+    columns = ['Year', 'Month', 'PeriodSort', 'DisplayPeriod']
+    parts = [df[columns] for df in frames.values() if df is not None and not df.empty]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True).drop_duplicates()
+
+def build_consolidated_hierarchy(cubes, periods=None, scope=None):
+    """
+    Group P&L with one column per brand (the grids and workbook add the group total).
+
+    Reduced from each brand's aggregation cube; the brands share the common ledger
+    schema once `load_data` has applied BRAND_RENAMES, so classifications, accounts
+    and partners with the same name line up across brands.
+
+    :param cubes: {brand: build_aggregation_cube(brand frame)}
+    """
+    columns = [BRAND_NAMES.get(brand, brand) for brand in cubes]
+    leaves = {}
+    for brand, cube in cubes.items():
+        cells = cube if periods is None else cube[cube.index.get_level_values('DisplayPeriod').isin(periods)]
+        leaves[BRAND_NAMES.get(brand, brand)] = _reduction_units(cells).groupby(level=HIERARCHY_LEVELS, dropna=False, sort=False).sum()
+    leaf = pd.concat(leaves, names=['Brand']) if leaves else pd.Series(dtype=float)
+    if not leaf.empty:
+        leaf = leaf.reorder_levels(HIERARCHY_LEVELS + ['Brand'])
+    return _hierarchy_from_cells(leaf, columns, 'Brand', scope)
+
+# =============================
+# BATCH CLI (MONTH-END PACKS)
+# =============================
+_WORKER_FRAMES = {}
+
+def _init_worker(frames):
+    # Each worker receives the shared loads once, instead of once per job
+    _WORKER_FRAMES.update(frames)
+
+def _safe_filename(text):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(text)).strip('_')
+
+def _run_job(job, out_dir, expand_all, compare=None):
+    df = _WORKER_FRAMES[job['brand']]
+    brand_name = BRAND_NAMES[job['brand']]
+    stamp = datetime.now().strftime('%Y%m%d')
+    if job['kind'] == "pnl":
+        output = build_pnl_workbook(df, job['periods'], store_filter=job['store'], brand=job['brand'], expand_all=expand_all, compare=compare)
+        suffix = f"_{PERIOD_COMPARISONS[compare][0]}" if compare else ""
+        file_name = f"{brand_name}_PnL_Statement_{job['store']}_{job['label']}{suffix}_{stamp}.xlsx"
+    else:
+        output, label = build_store_workbook(df, job['periods'], brand=job['brand'], expand_all=expand_all)
+        file_name = f"{brand_name}_Store_Comparison_{label}_{stamp}.xlsx"
+    if output is None:
+        return None
+    path = os.path.join(out_dir, _safe_filename(file_name[:-5]) + ".xlsx")
+    with open(path, "wb") as f:
+        f.write(output.getvalue())
+    return path
+
+def resolve_period_selections(df, months=None, previous=0, fiscal_years=None):
+    """Expand CLI period arguments into (label, selected_periods) pairs, mirroring the sidebar."""
+    period_list = get_period_list(df)
+    selections = []
+    for base_period in months or []:
+        if base_period in period_list:
+            selections.append((base_period, select_periods(period_list, base_period, previous)))
+    for year in fiscal_years or []:
+        fy_periods = get_financial_year_range(df, year, start_month=4)
+        if fy_periods:
+            selections.append((f"FY{year}-{str(year + 1)[-2:]}", [p['display'] for p in fy_periods]))
+    if not selections and period_list:
+        selections.append((period_list[0], select_periods(period_list, period_list[0], previous)))
+    return selections
+
+def plan_jobs(frames, months=None, previous=0, fiscal_years=None, stores=None):
+    jobs = []
+    for brand, df in frames.items():
+        if df.empty:
+            continue
+        brand_stores = ["All"] + sorted(df['Store'].dropna().astype(str).unique())
+        if stores:
+            brand_stores = [s for s in brand_stores if s in stores]
+        for label, periods in resolve_period_selections(df, months, previous, fiscal_years):
+            for store in brand_stores:
+                jobs.append({'kind': "pnl", 'brand': brand, 'store': store, 'periods': periods, 'label': label})
+            jobs.append({'kind': "store", 'brand': brand, 'store': "Comparison", 'periods': periods, 'label': label})
+    return jobs
+
+def run_batch(frames, jobs, out_dir, workers=None, expand_all=False, compare=None):
+    os.makedirs(out_dir, exist_ok=True)
+    written, failed = [], []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(frames,)) as pool:
+        futures = {pool.submit(_run_job, job, out_dir, expand_all, compare): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                path = future.result()
+                if path:
+                    written.append(path)
+            except Exception as e:
+                failed.append((job, e))
+    return written, failed
+
+def write_extracts(frames, out_dir, fmt="csv", months=None, previous=0, fiscal_years=None, stores=None):
+    """
+    Flat GL rows, editor pivot and P&L totals per brand and period selection, streamed
+    to `out_dir`. Without `months`/`fiscal_years` each brand's whole history is exported.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d')
+    written = []
+    for brand, df in frames.items():
+        if df.empty:
+            continue
+        if stores and "All" not in stores:
+            df = df[df['Store'].isin(stores)]
+        if months or fiscal_years:
+            selections = resolve_period_selections(df, months, previous, fiscal_years)
+        else:
+            selections = [("All_Periods", get_period_list(df))]
+        for label, periods in selections:
+            rows = df[df['DisplayPeriod'].isin(periods)]
+            if rows.empty:
+                continue
+            pivot, _ = build_editor_pivot(rows, formatted=False)
+            totals = hierarchy_export_frame(build_hierarchy_data(rows, sorted(periods, key=get_period_sort_key)))
+            for name, frame in (("GL_Rows", ledger_export_frame(rows)), ("Ledger_Pivot", pivot), ("PnL_Totals", totals)):
+                file_name = _safe_filename(f"{BRAND_NAMES[brand]}_{name}_{label}_{stamp}") + "." + fmt
+                written.append(write_export(frame, os.path.join(out_dir, file_name), fmt))
+    return written
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate P&L and store comparison workbooks for every brand x store x period.")
+    parser.add_argument("--brand", choices=["pra", "wed", "all"], default="all")
+    parser.add_argument("--month", action="append", dest="months", help="Base period, e.g. 'March 2025' (repeatable)")
+    parser.add_argument("--previous", type=int, default=0, help="Previous periods to include with each --month")
+    parser.add_argument("--fy", action="append", type=int, dest="fiscal_years", help="Financial year start, e.g. 2024 for Apr 2024 - Mar 2025 (repeatable)")
+    parser.add_argument("--store", action="append", dest="stores", help="Restrict to these stores ('All' for the consolidated P&L)")
+    parser.add_argument("--out", default="reports", help="Output directory")
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (default: CPU count)")
+    parser.add_argument("--expand-all", action="store_true", help="Export with every outline group expanded")
+    parser.add_argument("--compare", choices=list(PERIOD_COMPARISONS),
+                        help="Add change and change %% columns against the prior month (mom) or year (yoy) to P&L workbooks")
+    parser.add_argument("--extract", choices=list(EXPORT_FORMATS),
+                        help="Write flat GL rows, editor pivot and P&L totals files instead of workbooks "
+                             "(the whole history unless --month/--fy is given)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    brands = ["pra", "wed"] if args.brand == "all" else [args.brand]
+    # One shared load per brand; the process pool reuses it for every job
+    frames = {brand: load_data(brand) for brand in brands}
+    if args.extract:
+        for path in write_extracts(frames, args.out, args.extract, args.months, args.previous, args.fiscal_years, args.stores):
+            print(f"  wrote {path}")
+        return 0
+    jobs = plan_jobs(frames, args.months, args.previous, args.fiscal_years, args.stores)
+    print(f"Generating {len(jobs)} workbook(s) into {args.out}...")
+
+    written, failed = run_batch(frames, jobs, args.out, workers=args.workers, expand_all=args.expand_all, compare=args.compare)
+    for path in sorted(written):
+        print(f"  wrote {path}")
+    for job, e in failed:
+        print(f"  FAILED {job['brand']} {job['kind']} {job['store']} {job['label']}: {e}", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
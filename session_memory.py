@@ -0,0 +1,132 @@
+"""
+Per-session ledger frames for the Streamlit app, held outside st.session_state.
+
+`SessionFrameStore` accounts each session's frames and reclaims them from idle
+sessions; a reclaimed session reloads from the shared brand cache. app.py builds
+one store per process from:
+
+    SESSION_IDLE_EVICT_SECONDS=900     idle time before a session's frames are reclaimed
+    SESSION_MEMORY_BUDGET_MB=          total budget; over it, sessions idle for
+    SESSION_MIN_IDLE_SECONDS=60        at least this long are reclaimed first
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from streamlit.runtime import Runtime
+
+from dataset_cache import estimate_nbytes
+
+def session_is_active(session_id):
+    if not session_id or not Runtime.exists():
+        return True
+    return Runtime.instance().is_active_session(session_id)
+
+class SessionFrameStore:
+    """
+    Per-session ledger frames (`original_df`, `current_df`, `editor_filtered_df`) held
+    outside st.session_state, so their memory can be accounted per session and
+    reclaimed from idle sessions without waiting for the session object to die.
+
+    Sessions idle for `idle_seconds` lose their frames; when the total held exceeds
+    `budget_bytes`, sessions idle for at least `min_idle_seconds` are reclaimed least
+    recently used first. Sessions with unsaved edits are never reclaimed. A reclaimed
+    session reloads its frames from the shared brand cache on its next rerun.
+    """
+
+    def __init__(self, idle_seconds=900, budget_bytes=None, min_idle_seconds=60, sweep_interval=30):
+        self.idle_seconds = idle_seconds
+        self.budget_bytes = budget_bytes
+        self.min_idle_seconds = min_idle_seconds
+        self.sweep_interval = sweep_interval
+        self._sessions = OrderedDict()
+        self._last_sweep = 0.0
+        self._lock = threading.RLock()
+
+    def _entry(self, session_id):
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = {
+                'frames': {}, 'nbytes': {}, 'state_bytes': 0, 'user': None,
+                'pinned': False, 'last_seen': time.monotonic(), 'evictions': 0
+            }
+        return entry
+
+    def touch(self, session_id, user=None, pinned=None, state_bytes=None):
+        """Mark a session as active (and sweep idle ones, at most every `sweep_interval`)."""
+        with self._lock:
+            entry = self._entry(session_id)
+            entry['last_seen'] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            if user is not None:
+                entry['user'] = user
+            if pinned is not None:
+                entry['pinned'] = pinned
+            if state_bytes is not None:
+                entry['state_bytes'] = state_bytes
+            due = entry['last_seen'] - self._last_sweep >= self.sweep_interval
+        if due:
+            self.sweep()
+
+    def get(self, session_id, key):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return entry['frames'].get(key) if entry is not None else None
+
+    def set(self, session_id, key, value):
+        with self._lock:
+            entry = self._entry(session_id)
+            entry['frames'][key] = value
+            entry['nbytes'][key] = estimate_nbytes(value)
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def session_bytes(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return sum(entry['nbytes'].values()) + entry['state_bytes'] if entry is not None else 0
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(sum(e['nbytes'].values()) + e['state_bytes'] for e in self._sessions.values())
+
+    def _reclaim(self, entry):
+        if entry['frames']:
+            entry['frames'].clear()
+            entry['nbytes'].clear()
+            entry['evictions'] += 1
+
+    def sweep(self):
+        """Drop closed sessions and reclaim frames from idle ones; returns how many were reclaimed."""
+        now = time.monotonic()
+        reclaimed = 0
+        with self._lock:
+            self._last_sweep = now
+            for session_id in list(self._sessions):
+                if not session_is_active(session_id):
+                    del self._sessions[session_id]
+            # Oldest activity first, so the budget pass reclaims least recently used sessions
+            for entry in self._sessions.values():
+                idle = now - entry['last_seen']
+                over_budget = self.budget_bytes is not None and self.total_bytes() > self.budget_bytes
+                if entry['pinned'] or not entry['frames']:
+                    continue
+                if idle >= self.idle_seconds or (over_budget and idle >= self.min_idle_seconds):
+                    self._reclaim(entry)
+                    reclaimed += 1
+        return reclaimed
+
+    def report(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'session': session_id[:8] if session_id else "-",
+                'user': entry['user'],
+                'idle_s': round(now - entry['last_seen']),
+                'frames_mb': round(sum(entry['nbytes'].values()) / (1024 * 1024), 2),
+                'state_mb': round(entry['state_bytes'] / (1024 * 1024), 2),
+                'pinned': entry['pinned'],
+                'evictions': entry['evictions']
+            } for session_id, entry in reversed(self._sessions.items())]
@@ -0,0 +1,30 @@
+import functools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import report_engine as engine
+from benchmarks.synthetic_gl import generate_ledger_items
+
+# Size of the `ledger` fixture unless a module asks for another with @pytest.mark.ledger(...)
+LEDGER_SIZE = dict(stores=2, accounts=5, partners=2, months=3, seed=1)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "ledger(stores, accounts, partners, months, seed): size of the `ledger` fixture")
+
+
+@functools.lru_cache(maxsize=None)
+def prepared_ledger(brand, paise, **size):
+    return engine.prepare_ledger_frame(generate_ledger_items(brand, **size), brand)
+
+
+@pytest.fixture(params=sorted(engine.BRAND_NAMES))
+def ledger(request):
+    """A prepared synthetic ledger, once per brand; each test gets its own copy."""
+    marker = request.node.get_closest_marker("ledger")
+    size = dict(LEDGER_SIZE, **(marker.kwargs if marker else {}))
+    return prepared_ledger(request.param, engine.PAISE_BALANCES, **size).copy()
@@ -0,0 +1,134 @@
+import io
+
+import pandas as pd
+import pytest
+
+import report_engine as engine
+
+pytestmark = pytest.mark.ledger(stores=3, accounts=10, partners=3, months=6)
+
+HEADER = "Store,Classification,Account,Partner,Period,{amount}\n"
+
+
+def cell(row, period=None, **overrides):
+    values = [row.Store, row.classification, row.account_name, row.partner_id_name, period or row.DisplayPeriod]
+    for position, key in enumerate(["store", "classification", "account", "partner", "period"]):
+        values[position] = overrides.get(key, values[position])
+    return values
+
+
+def read_csv(lines, amount="Adjustment"):
+    text = HEADER.format(amount=amount) + "".join(",".join(f'"{v}"' for v in line) + "\n" for line in lines)
+    return engine.read_adjustments(io.StringIO(text), "adjustments.csv")
+
+
+def current(ledger, row):
+    return engine.ledger_cell_values(ledger, [dict(zip(["store", "classification", "account", "partner", "period"], cell(row)))])[0]
+
+
+def test_reject_reasons(ledger):
+    row = ledger.iloc[0]
+    other_classification = next(c for c in ledger['classification'].unique() if c != row.classification)
+    lines = [
+        cell(row) + ["10"],
+        cell(row, store="Nowhere") + ["1"],
+        cell(row, period="Smarch 2024") + ["1"],
+        cell(row, period="January 1999") + ["1"],
+        cell(row, classification="Imaginary") + ["1"],
+        cell(row, classification=other_classification) + ["1"],
+        cell(row, partner="Ghost") + ["1"],
+        cell(row) + ["abc"],
+        ["", "", "", "", "", ""],
+    ]
+    changes, rejected = engine.validate_adjustments(read_csv(lines), ledger)
+    assert changes['Row'].tolist() == [2]
+    assert dict(zip(rejected['Row'], rejected['error'])) == {
+        3: "unknown store",
+        4: "unrecognised period",
+        5: "period not loaded",
+        6: "unknown classification",
+        7: "account not under this classification",
+        8: "partner not under this account",
+        9: "adjustment is not a number",
+        10: "missing store; missing classification; missing account; missing partner; missing period; adjustment is not a number",
+    }
+
+
+def test_adjustments_add_to_current_balance_and_sum_per_cell(ledger):
+    row = ledger.iloc[0]
+    month, year = row.DisplayPeriod.rsplit(" ", 1)
+    lines = [cell(row) + ["₹1,000.50"], cell(row, period=f"{month[:3]} {year[-2:]}") + ["-0.50"]]
+    changes, rejected = engine.validate_adjustments(read_csv(lines), ledger)
+    assert rejected.empty
+    old = current(ledger, row)
+    assert changes[['old_value', 'new_value', 'delta']].iloc[0].tolist() == pytest.approx([old, old + 1000.0, 1000.0])
+    assert engine.adjustment_changes(changes) == [{
+        'store': row.Store, 'classification': row.classification, 'account': row.account_name,
+        'partner': row.partner_id_name, 'period': row.DisplayPeriod,
+        'new_value': pytest.approx(old + 1000.0), 'old_value': pytest.approx(old)
+    }]
+
+
+def test_balance_rows_for_the_same_cell_are_rejected(ledger):
+    row, other = ledger.iloc[0], ledger.iloc[40]
+    lines = [cell(row) + ["1,000.50"], cell(other) + ["7"], cell(row) + ["5"]]
+    changes, rejected = engine.validate_adjustments(read_csv(lines, amount="Balance"), ledger)
+    assert changes['Row'].tolist() == [3]
+    assert changes['new_value'].tolist() == [7.0]
+    assert rejected['error'].tolist() == ["duplicate cell (rows 2, 4)"] * 2
+
+
+def test_unchanged_cells_are_dropped(ledger):
+    row = ledger.iloc[0]
+    changes, rejected = engine.validate_adjustments(read_csv([cell(row) + [str(current(ledger, row))]], amount="Balance"), ledger)
+    assert changes.empty and rejected.empty
+
+
+@pytest.mark.parametrize("name, data", [
+    ("header_only.csv", HEADER.format(amount="Balance").encode()),
+    ("blank.xlsx", None),
+])
+def test_empty_file_is_rejected(name, data):
+    if data is None:
+        buffer = io.BytesIO()
+        pd.DataFrame(columns=["Store", "Classification", "Account", "Partner", "Period", "Balance"]).to_excel(buffer, index=False)
+        data = buffer.getvalue()
+    with pytest.raises(ValueError, match="no adjustment rows"):
+        engine.read_adjustments(io.BytesIO(data), name)
+
+
+def test_all_blank_column_is_a_reject_not_a_crash(ledger):
+    row = ledger.iloc[0]
+    adjustments = read_csv([cell(row, partner="") + ["1"]])
+    changes, rejected = engine.validate_adjustments(adjustments.assign(partner_id_name=float("nan")), ledger)
+    assert changes.empty
+    assert rejected['error'].tolist() == ["missing partner"]
+
+
+def test_missing_columns_and_unreadable_workbook():
+    with pytest.raises(ValueError, match="missing column"):
+        engine.read_adjustments(io.StringIO("Store,Period,Balance\nS,April 2024,1\n"), "a.csv")
+    with pytest.raises(ValueError, match="exactly one"):
+        engine.read_adjustments(io.StringIO(HEADER.format(amount="Balance,Adjustment") + "a,b,c,d,e,1,2\n"), "a.csv")
+    with pytest.raises(ValueError, match="not a readable Excel"):
+        engine.read_adjustments(io.BytesIO(b"not a zip"), "a.xlsx")
+
+
+def test_excel_dates_and_gl_export_round_trip(ledger):
+    row = ledger.iloc[0]
+    month, year = row.DisplayPeriod.rsplit(" ", 1)
+    buffer = io.BytesIO()
+    pd.DataFrame({'Store': [row.Store], 'classification': [row.classification], 'account_name': [row.account_name],
+                  'partner_id_name': [row.partner_id_name],
+                  'DisplayPeriod': [pd.Timestamp(int(year), engine.MONTH_NUMBERS[month], 1)],
+                  'Balance': [123.45]}).to_excel(buffer, index=False)
+    buffer.seek(0)
+    changes, rejected = engine.validate_adjustments(engine.read_adjustments(buffer, "a.xlsx"), ledger)
+    assert rejected.empty and changes['new_value'].tolist() == [123.45]
+
+    # An edited GL rows export goes straight back in, one row per ledger cell
+    export = engine.ledger_export_frame(ledger.drop_duplicates(engine.LEDGER_KEY_COLUMNS).head(25))
+    csv = export.assign(Balance=export['Balance'] + 1).to_csv(index=False)
+    changes, rejected = engine.validate_adjustments(engine.read_adjustments(io.StringIO(csv), "rows.csv"), ledger)
+    assert rejected.empty and len(changes) == 25
+    assert changes['delta'].tolist() == pytest.approx([1.0] * 25)
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import report_engine as engine
+
+pytestmark = pytest.mark.ledger(stores=2, accounts=6, partners=2, months=14)
+
+
+def series(balances, store="Store 01", account="Rent", start=(2024, 4)):
+    """One store/account/partner series with a row per month; None leaves a month without rows."""
+    rows = []
+    for offset, balance in enumerate(balances):
+        index = start[1] - 1 + offset
+        if balance is not None:
+            rows.append({'Store': store, 'classification': "Rent and Utilities", 'account_name': account,
+                         'partner_id_name': "Landlord", 'Year': start[0] + index // 12, 'Month': index % 12 + 1,
+                         'Balance': float(balance)})
+    return pd.DataFrame(rows)
+
+
+def steady(months, level=100_000.0, seed=0):
+    return list(level + np.random.default_rng(seed).normal(0, level * 0.01, months))
+
+
+def test_planted_spike_is_ranked_first(ledger):
+    target = ledger.iloc[len(ledger) // 2]
+    cell = ((ledger['Store'] == target.Store) & (ledger['account_name'] == target.account_name)
+            & (ledger['partner_id_name'] == target.partner_id_name) & (ledger['DisplayPeriod'] == target.DisplayPeriod))
+    spiked = ledger.copy()
+    spiked.loc[cell, 'Balance'] += 50 * abs(ledger['Balance']).max()
+
+    anomalies = engine.scan_anomalies(spiked)
+    top = anomalies.iloc[0]
+    assert (top.Store, top.account_name, top.partner_id_name, top.DisplayPeriod) == (
+        target.Store, target.account_name, target.partner_id_name, target.DisplayPeriod)
+    assert "Z-Score" in top.Signals
+    assert top.Balance == pytest.approx(spiked.loc[cell, 'Balance'].sum())
+    assert anomalies['Impact'].is_monotonic_decreasing
+
+
+def test_month_over_month_jump_needs_the_minimum_amount():
+    balances = steady(8)
+    balances[7] = balances[6] * 2.5
+    anomalies = engine.scan_anomalies(series(balances))
+    jump = anomalies[anomalies['DisplayPeriod'] == "November 2024"].iloc[0]
+    assert "MoM" in jump.Signals
+    assert jump['MoM'] == pytest.approx(balances[7] - balances[6])
+    assert jump['MoM %'] == pytest.approx(150.0)
+
+    assert engine.scan_anomalies(series(balances), min_amount=1e7).empty
+
+
+def test_year_over_year_change_compares_the_same_month():
+    balances = steady(14)
+    balances[12] = balances[0] * 3
+    anomalies = engine.scan_anomalies(series(balances), z_threshold=np.inf)
+    flagged = anomalies[anomalies['Signals'].str.contains("YoY")]
+    assert flagged['DisplayPeriod'].tolist() == ["April 2025"]
+    assert flagged.iloc[0]['YoY'] == pytest.approx(balances[12] - balances[0])
+
+
+def test_months_without_rows_inside_a_series_count_as_zero():
+    balances = steady(8)
+    balances[3] = None
+    anomalies = engine.scan_anomalies(series(balances), z_threshold=np.inf)
+    gap = anomalies[anomalies['DisplayPeriod'] == "July 2024"].iloc[0]
+    assert gap.Balance == 0.0 and gap['MoM'] == pytest.approx(-balances[2])
+
+
+def test_expected_balance_leaves_the_month_out_and_spans_only_the_series():
+    fees = steady(8, level=50_000.0, seed=1)
+    # Fees starts six months after the rent series; the months before it are not zeros of its own
+    ledger = pd.concat([series(steady(14)), series(fees, account="Fees", start=(2024, 10))])
+    anomalies = engine.scan_anomalies(ledger, z_threshold=0.0, jump_threshold=np.inf, min_amount=0.0)
+    scanned = anomalies[anomalies['account_name'] == "Fees"].sort_values('PeriodSort')
+    assert len(scanned) == len(fees)
+    assert scanned.iloc[0]['Expected'] == pytest.approx(np.mean(fees[1:]))
+    assert scanned.iloc[-1]['Expected'] == pytest.approx(np.mean(fees[:-1]))
+
+
+def test_short_series_get_no_z_score():
+    balances = steady(6)
+    balances[5] *= 1.5
+    anomalies = engine.scan_anomalies(series(balances), jump_threshold=np.inf)
+    assert anomalies.empty
+    assert not engine.scan_anomalies(series(balances), jump_threshold=np.inf, min_history=5).empty
+
+
+def test_no_rows_gives_an_empty_frame_with_the_result_columns():
+    anomalies = engine.scan_anomalies(series([]).reindex(columns=engine.ANOMALY_SERIES + ['Year', 'Month', 'Balance']))
+    assert anomalies.empty
+    assert {'DisplayPeriod', 'Z-Score', 'Impact', 'Signals'} <= set(anomalies.columns)
@@ -0,0 +1,124 @@
+import pandas as pd
+import pytest
+
+import report_engine as engine
+from edit_journal import EditJournal, JournalDrainer, PENDING, SENT, CONFLICT, SUPERSEDED
+
+
+def change_for(row, new_value=1.0):
+    return dict(store=row.Store, classification=row.classification, account=row.account_name,
+                partner=row.partner_id_name, period=row.DisplayPeriod, new_value=new_value, old_value=row.Balance)
+
+
+def cell_rows(df, change):
+    return df[(df['Store'] == change['store']) & (df['classification'] == change['classification'])
+              & (df['account_name'] == change['account']) & (df['partner_id_name'] == change['partner'])
+              & (df['DisplayPeriod'] == change['period'])]
+
+
+def test_unchanged_server_has_no_conflicts(ledger):
+    changes = [change_for(ledger.iloc[0]), change_for(ledger.iloc[5])]
+    assert engine.detect_conflicts(ledger, ledger.copy(), changes) == []
+
+
+def test_newer_server_edit_is_a_conflict(ledger):
+    changes = [change_for(ledger.iloc[0]), change_for(ledger.iloc[5])]
+    server = pd.concat([ledger, cell_rows(ledger, changes[0]).head(1).assign(
+        id=-1, Balance=50.0, last_modified_at="2030-01-01T00:00:00Z", last_modified_user="bob")], ignore_index=True)
+    conflicts = engine.detect_conflicts(ledger, server, changes)
+    assert len(conflicts) == 1
+    conflict = conflicts[0]
+    assert conflict['account'] == changes[0]['account'] and conflict['period'] == changes[0]['period']
+    assert conflict['server_modified_at'] == "2030-01-01T00:00:00Z"
+    assert conflict['server_modified_user'] == "bob"
+    assert conflict['server_value'] == pytest.approx(cell_rows(ledger, changes[0])['Balance'].sum() + 50.0)
+
+    # Once the server edit is taken into the loaded frame it is no longer a conflict
+    patched, _ = engine.apply_ledger_changes(ledger, [engine.server_change(conflict)])
+    assert engine.detect_conflicts(patched, server, changes) == []
+
+
+def test_cell_new_on_the_server_is_a_conflict(ledger):
+    row = ledger.iloc[0]
+    change = change_for(row)
+    loaded = ledger.drop(cell_rows(ledger, change).index)
+    conflicts = engine.detect_conflicts(loaded, ledger, [change])
+    assert [c['account'] for c in conflicts] == [row.account_name]
+
+
+def test_cell_missing_everywhere_is_not_a_conflict(ledger):
+    change = dict(change_for(ledger.iloc[0]), partner="Nobody")
+    assert engine.detect_conflicts(ledger, ledger, [change]) == []
+
+
+def test_loaded_stamps_are_read_per_cell(ledger):
+    row = ledger.iloc[0]
+    change = change_for(row)
+    assert engine.ledger_cell_stamps(ledger, [change, dict(change, partner="Nobody")]) == [
+        cell_rows(ledger, change)['last_modified_at'].max(), None]
+
+
+def test_own_unsent_edit_is_not_a_conflict(ledger, tmp_path):
+    journal = EditJournal(str(tmp_path / "journal.sqlite3"))
+    first = change_for(ledger.iloc[0], new_value=10.0)
+    base = engine.ledger_cell_stamps(ledger, [first])
+    # Saved while Fabric keeps the old stamp until the drainer sends it; the session's rows take the new one
+    journal.enqueue("pra", "a@b.com", [engine.build_upsert_variables(first, "2030-01-01T00:00:00Z", "a@b.com")], base)
+    local, _ = engine.apply_ledger_changes(ledger, [dict(first, last_modified_at="2030-01-01T00:00:00Z", last_modified_user="a@b.com")])
+    server = ledger
+    second = dict(first, new_value=20.0)
+
+    assert len(engine.detect_conflicts(local, server, [second])) == 1
+    unsent = journal.unsent_base_stamps("pra", "a@b.com")
+    assert engine.detect_conflicts(local, server, [second], loaded_stamps=unsent) == []
+    # Another user's unsent edits don't count, and a real server change still does
+    assert journal.unsent_base_stamps("pra", "c@d.com") == {}
+    changed = pd.concat([server, cell_rows(server, first).head(1).assign(
+        id=-1, Balance=5.0, last_modified_at="2030-02-01T00:00:00Z", last_modified_user="bob")], ignore_index=True)
+    conflicts = engine.detect_conflicts(local, changed, [second], loaded_stamps=unsent)
+    assert [c['server_modified_user'] for c in conflicts] == ["bob"]
+
+
+def test_unchecked_save_is_checked_before_it_is_sent(ledger, tmp_path, monkeypatch):
+    journal = EditJournal(str(tmp_path / "journal.sqlite3"))
+    changes = [change_for(ledger.iloc[0], new_value=10.0), change_for(ledger.iloc[5], new_value=20.0)]
+    # Saved while Fabric couldn't be read; meanwhile bob changed the first cell
+    journal.enqueue("pra", "a@b.com", [engine.build_upsert_variables(c, "2030-01-01T00:00:00Z", "a@b.com") for c in changes],
+                    engine.ledger_cell_stamps(ledger, changes), checked=False)
+    server = pd.concat([ledger, cell_rows(ledger, changes[0]).head(1).assign(
+        id=-1, Balance=5.0, last_modified_at="2030-02-01T00:00:00Z", last_modified_user="bob")], ignore_index=True)
+    reads = []
+    monkeypatch.setattr(engine, "fetch_cells", lambda brand, changes, graphql=None: reads.append(len(changes)) or server)
+    sent, applied = [], []
+
+    drainer = JournalDrainer(journal, send=lambda brand, payload: sent.append(payload["balance"]),
+                             on_applied=lambda brand, changes: applied.extend(changes))
+    assert drainer.drain_once() == (1, 0)
+    assert reads == [2] and sent == [20.0]
+    assert journal.status_counts() == {CONFLICT: 1, SENT: 1}
+    held = journal.rows(statuses=(CONFLICT,))[0]
+    assert held["variables"]["balance"] == 10.0 and "bob" in held["last_error"]
+    # The cache learns Fabric's value for the held-back cell and the sent value for the other
+    assert [(c['new_value'], c['last_modified_user']) for c in applied] == [
+        (pytest.approx(cell_rows(server, changes[0])['Balance'].sum()), "bob"), (20.0, "a@b.com")]
+
+    # Overwriting sends it as it is, without another check
+    monkeypatch.setattr(engine, "fetch_cells", lambda *a, **k: pytest.fail("checked again"))
+    assert journal.resolve_conflicts(brand="pra", user="a@b.com", overwrite=True) == 1
+    assert drainer.drain_once() == (1, 0)
+    assert sent == [20.0, 10.0]
+
+
+def test_conflict_rows_can_be_dropped_or_superseded(ledger, tmp_path):
+    journal = EditJournal(str(tmp_path / "journal.sqlite3"))
+    change = change_for(ledger.iloc[0])
+    for balance in (1.0, 2.0):
+        journal.enqueue("pra", "a@b.com", [engine.build_upsert_variables(dict(change, new_value=balance), "2030-01-01T00:00:00Z", "a@b.com")],
+                        checked=False)
+        journal.mark_conflict(journal.due()[0]["id"], dict(server_value=5.0, server_modified_user="bob", server_modified_at=None))
+    # The second save superseded the first held-back one
+    assert journal.status_counts() == {CONFLICT: 1, SUPERSEDED: 1}
+    assert journal.resolve_conflicts(brand="pra", user="c@d.com") == 0
+    assert journal.resolve_conflicts(brand="pra", user="a@b.com") == 1
+    assert journal.status_counts() == {SUPERSEDED: 2}
+    assert journal.due() == [] and journal.unsent_base_stamps("pra", "a@b.com") == {}
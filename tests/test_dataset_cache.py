@@ -0,0 +1,244 @@
+import threading
+
+import pandas as pd
+import pytest
+
+import dataset_cache
+import report_engine as engine
+from dataset_cache import BrandDatasetCache, DatasetHandle
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dataset_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def frame(rows=10):
+    return pd.DataFrame({'Balance': [float(i) for i in range(rows)]})
+
+
+def counting_loader(rows=10):
+    calls = []
+
+    def load(brand):
+        calls.append(brand)
+        return frame(rows)
+    return load, calls
+
+
+def test_second_lookup_is_served_from_the_cache(clock):
+    cache = BrandDatasetCache()
+    load, calls = counting_loader()
+    first = cache.get_or_load("pra", load)
+    assert cache.get_or_load("pra", load) is first
+    assert calls == ["pra"]
+
+
+def test_least_recently_used_brand_is_evicted(clock):
+    cache = BrandDatasetCache(max_entries=2)
+    load, calls = counting_loader()
+    cache.get_or_load("pra", load)
+    cache.get_or_load("wed", load)
+    cache.get_or_load("pra", load)  # pra is now the most recent
+    cache.get_or_load("grp", load)
+    assert cache.get("wed") is None
+    assert cache.get("pra") is not None and cache.get("grp") is not None
+    assert calls == ["pra", "wed", "grp"]
+
+
+def test_memory_budget_evicts_but_keeps_the_requested_brand(clock):
+    size = dataset_cache.estimate_nbytes(frame(1000))
+    cache = BrandDatasetCache(max_bytes=int(size * 1.5))
+    load, calls = counting_loader(1000)
+    cache.get_or_load("pra", load)
+    cache.get_or_load("wed", load)
+    assert cache.get("pra") is None and cache.get("wed") is not None
+
+    # A single brand over budget is still served; its aggregates are trimmed instead
+    tiny = BrandDatasetCache(max_bytes=1)
+    assert len(tiny.get_or_load("pra", load)) == 1000
+    handle = tiny.handle("pra")
+    assert tiny.derived(handle, ('x',), lambda: "built") == "built"
+    assert tiny.get("pra") is not None
+    assert tiny.total_bytes() == dataset_cache.estimate_nbytes(frame(1000))
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = BrandDatasetCache(ttl=300)
+    load, calls = counting_loader()
+    cache.get_or_load("pra", load)
+    handle = cache.handle("pra")
+    clock[0] += 299
+    cache.get_or_load("pra", load)
+    clock[0] += 2
+    cache.get_or_load("pra", load)
+    assert calls == ["pra", "pra"]
+    assert cache.handle("pra") != handle
+
+
+def test_empty_reads_are_not_cached(clock):
+    cache = BrandDatasetCache()
+    calls = []
+    cache.get_or_load("pra", lambda brand: calls.append(brand) or pd.DataFrame())
+    assert calls == ["pra"]
+    assert cache.get("pra") is None and cache.handle("pra") is None
+
+
+def test_concurrent_misses_share_one_load(clock):
+    cache = BrandDatasetCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_load(brand):
+        calls.append(brand)
+        started.set()
+        release.wait(5)
+        return frame()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("pra", slow_load))) for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == ["pra"]
+    assert len(results) == 4 and all(r is results[0] for r in results)
+
+
+def test_invalidate_drops_one_or_every_brand(clock):
+    cache = BrandDatasetCache()
+    load, calls = counting_loader()
+    cache.get_or_load("pra", load)
+    cache.get_or_load("wed", load)
+    cache.invalidate("pra")
+    assert cache.get("pra") is None and cache.get("wed") is not None
+    cache.invalidate()
+    assert cache.get("wed") is None
+
+
+def test_derived_values_are_memoised_per_handle_and_key(clock):
+    cache = BrandDatasetCache()
+    load, _ = counting_loader()
+    cache.get_or_load("pra", load)
+    handle = cache.handle("pra")
+    builds = []
+
+    def build(value):
+        return lambda: builds.append(value) or value
+
+    assert cache.derived(handle, ('a',), build(1)) == 1
+    assert cache.derived(DatasetHandle("pra", handle.version), ('a',), build(2)) == 1
+    assert cache.derived(handle, ('b',), build(3)) == 3
+    assert cache.derived(None, ('a',), build(4)) == 4
+    assert builds == [1, 3, 4]
+
+    # A reload gets a new handle and starts without aggregates
+    cache.invalidate("pra")
+    cache.get_or_load("pra", load)
+    assert cache.derived(cache.handle("pra"), ('a',), build(5)) == 5
+
+
+def test_aggregates_of_an_older_version_are_kept_apart(clock):
+    cache = BrandDatasetCache()
+    load, _ = counting_loader()
+    cache.get_or_load("pra", load)
+    old = cache.handle("pra")
+    cache.invalidate("pra")
+    cache.get_or_load("pra", load)
+    new = cache.handle("pra")
+    builds = []
+
+    def build(value):
+        return lambda: builds.append(value) or value
+
+    # A session still on the old load memoises its aggregates instead of rebuilding every rerun
+    assert cache.derived(old, ('a',), build("old")) == "old"
+    assert cache.derived(old, ('a',), build("again")) == "old"
+    # ...without leaking them into the current version
+    assert cache.derived(new, ('a',), build("new")) == "new"
+    assert builds == ["old", "new"]
+
+    cache.invalidate("pra")
+    assert cache.derived(old, ('a',), build("rebuilt")) == "rebuilt"
+
+
+def test_older_aggregates_go_first_when_over_budget(clock):
+    load, _ = counting_loader(1000)
+    budget = dataset_cache.estimate_nbytes(frame(1000)) + 50_000
+    cache = BrandDatasetCache(max_bytes=budget)
+    cache.get_or_load("pra", load)
+    old = cache.handle("pra")
+    cache.derived(old, ('a',), lambda: "old")
+    cache.invalidate("wed")  # unrelated brand: older aggregates stay
+    cache.put("pra", frame(1000))
+    cache.derived(cache.handle("pra"), ('big',), lambda: "x" * 60_000)
+    assert cache.get("pra") is not None
+    assert cache.derived(old, ('a',), lambda: "rebuilt") == "rebuilt"
+
+
+def period_hierarchy(df):
+    periods = engine.get_period_list(df)[:2]
+    return engine.hierarchy_from_cube(engine.build_aggregation_cube(df), periods, periods=periods,
+                                      scope={'periods': periods, 'store': "All"})
+
+
+def cell_edit(df, new_value=999.0):
+    row = df[df['DisplayPeriod'] == engine.get_period_list(df)[0]].iloc[0]
+    return [{'store': row.Store, 'classification': row.classification, 'account': row.account_name,
+             'partner': row.partner_id_name, 'period': row.DisplayPeriod, 'new_value': new_value}]
+
+
+def never_built():
+    raise AssertionError("should have been patched, not rebuilt")
+
+
+def test_accepted_edits_become_a_new_version_without_touching_the_old(clock, ledger):
+    cache = BrandDatasetCache()
+    cache.put("pra", ledger)
+    old = cache.handle("pra")
+    hierarchy = cache.derived(old, ('pnl',), lambda: period_hierarchy(ledger))
+    cache.derived(old, ('flat',), lambda: "flat")
+    before = dict(hierarchy.grand_totals)
+    changes = cell_edit(ledger)
+
+    new = cache.apply_changes("pra", changes)
+    assert new is not None and new != old and cache.handle("pra") == new
+    # Readers of the old version keep an untouched hierarchy
+    assert hierarchy.grand_totals == before
+    patched = cache.derived(new, ('pnl',), never_built)
+    assert patched is not hierarchy
+    rebuilt = period_hierarchy(engine.apply_ledger_changes(ledger, changes)[0])
+    assert patched.grand_totals == pytest.approx(rebuilt.grand_totals)
+    # Flat aggregates are rebuilt for the new version
+    assert cache.derived(new, ('flat',), lambda: "rebuilt") == "rebuilt"
+    assert engine.ledger_cell_values(cache.get("pra"), changes) == [999.0]
+
+    assert cache.apply_changes("wed", changes) is None
+
+
+def test_unsent_edits_stay_out_of_the_shared_entry(clock, ledger):
+    cache = BrandDatasetCache()
+    cache.put("pra", ledger)
+    shared = cache.handle("pra")
+    hierarchy = cache.derived(shared, ('pnl',), lambda: period_hierarchy(ledger))
+    before = dict(hierarchy.grand_totals)
+    changes = cell_edit(ledger)
+
+    local_df, local = cache.local_version(shared, ledger, changes)
+    assert local != shared and cache.handle("pra") == shared
+    assert engine.ledger_cell_values(local_df, changes) == [999.0]
+    assert engine.ledger_cell_values(cache.get("pra"), changes) != [999.0]
+    # The session-local version starts from a patched copy of the shared hierarchy
+    patched = cache.derived(local, ('pnl',), never_built)
+    assert patched.grand_totals == pytest.approx(period_hierarchy(local_df).grand_totals)
+    assert cache.derived(shared, ('pnl',), never_built) is hierarchy
+    assert hierarchy.grand_totals == before
+
+    # Without a cached version only the frame is patched
+    uncached_df, handle = cache.local_version(None, ledger, changes)
+    assert handle is None and engine.ledger_cell_values(uncached_df, changes) == [999.0]
@@ -0,0 +1,140 @@
+import json
+import sqlite3
+
+import pytest
+
+import edit_journal
+from edit_journal import EditJournal, JournalDrainer, PENDING, SENT, FAILED, SUPERSEDED
+
+
+def variables(store="Store 01", balance=10.0, **overrides):
+    return {"year": 2025, "monthName": "Apr", "store": store, "balance": balance, "account_name": "Rent",
+            "classification": "Rent and Utilities", "partner_id_name": "Landlord", **overrides}
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return EditJournal(str(tmp_path / "journal.sqlite3"), max_attempts=3)
+
+
+def statuses(journal):
+    return {row["id"]: row["status"] for row in journal.rows(statuses=(PENDING, SENT, FAILED, SUPERSEDED))}
+
+
+def test_enqueue_supersedes_unsent_edits_to_the_same_cell(journal):
+    journal.enqueue("pra", "a@b.com", [variables(balance=1.0), variables(store="Store 02", balance=2.0)])
+    journal.enqueue("pra", "a@b.com", [variables(balance=3.0)])
+    journal.enqueue("wed", "a@b.com", [variables(balance=4.0)])
+
+    rows = journal.rows(statuses=(PENDING, SUPERSEDED))
+    by_status = {}
+    for row in rows:
+        by_status.setdefault(row["status"], []).append((row["brand"], row["variables"]["balance"]))
+    assert by_status[SUPERSEDED] == [("pra", 1.0)]
+    assert sorted(by_status[PENDING]) == [("pra", 2.0), ("pra", 3.0), ("wed", 4.0)]
+    # Only the newest value of each cell is ever due
+    assert [json.loads(row["variables"])["balance"] for row in journal.due()] == [2.0, 3.0, 4.0]
+
+
+def test_failed_edit_is_superseded_by_a_newer_save(journal):
+    journal.enqueue("pra", "a@b.com", [variables(balance=1.0)])
+    row_id = journal.due()[0]["id"]
+    for _ in range(journal.max_attempts):
+        journal.mark_error(row_id, "boom")
+    assert statuses(journal)[row_id] == FAILED
+
+    journal.enqueue("pra", "a@b.com", [variables(balance=5.0)])
+    assert statuses(journal)[row_id] == SUPERSEDED
+
+
+def test_mark_error_backs_off_then_fails(journal):
+    journal.enqueue("pra", None, [variables()])
+    row = journal.due()[0]
+
+    journal.mark_error(row["id"], RuntimeError("Fabric 503"))
+    assert journal.due() == []  # backed off
+    stored = journal.rows()[0]
+    assert (stored["status"], stored["attempts"], stored["last_error"]) == (PENDING, 1, "Fabric 503")
+
+    journal.mark_error(row["id"], "again")
+    journal.mark_error(row["id"], "and again")
+    assert journal.status_counts() == {FAILED: 1}
+    # Errors reported for a row that is no longer pending change nothing
+    journal.mark_error(row["id"], "late")
+    assert journal.rows(statuses=(FAILED,))[0]["attempts"] == 3
+
+    assert journal.retry_failed(brand="pra") == 1
+    assert [r["id"] for r in journal.due()] == [row["id"]]
+
+
+def test_mark_sent_only_applies_to_pending_rows(journal):
+    journal.enqueue("pra", None, [variables(balance=1.0)])
+    first = journal.due()[0]["id"]
+    journal.enqueue("pra", None, [variables(balance=2.0)])
+    journal.mark_sent(first)  # superseded before the send was acknowledged
+    assert statuses(journal)[first] == SUPERSEDED
+
+
+def test_drainer_sends_in_journal_order_and_records_failures(journal):
+    journal.enqueue("pra", None, [variables(store="Store 01"), variables(store="Store 02"), variables(store="Store 03")])
+    sent = []
+
+    def send(brand, payload):
+        if payload["store"] == "Store 02":
+            raise RuntimeError("rejected")
+        sent.append(payload["store"])
+
+    assert JournalDrainer(journal, send=send).drain_once() == (2, 1)
+    assert sent == ["Store 01", "Store 03"]
+    assert journal.status_counts() == {SENT: 2, PENDING: 1}
+
+
+def test_drainer_reports_accepted_edits_per_brand(journal):
+    journal.enqueue("pra", None, [variables(store="Store 01", balance=1.5), variables(store="Store 02")])
+    journal.enqueue("wed", None, [variables(store="Store 03", last_modified_at="2025-05-01T00:00:00Z")])
+    applied = []
+
+    def send(brand, payload):
+        if payload["store"] == "Store 02":
+            raise RuntimeError("rejected")
+
+    JournalDrainer(journal, send=send, on_applied=lambda brand, changes: applied.append((brand, changes))).drain_once()
+    assert [(brand, [c['store'] for c in changes]) for brand, changes in applied] == [("pra", ["Store 01"]), ("wed", ["Store 03"])]
+    change = applied[0][1][0]
+    assert (change['account'], change['partner'], change['period'], change['new_value']) == ("Rent", "Landlord", "Apr 2025", 1.5)
+    assert applied[1][1][0]['last_modified_at'] == "2025-05-01T00:00:00Z"
+
+
+def test_failed_conflict_check_backs_off_like_a_failed_send(journal):
+    journal.enqueue("pra", None, [variables(store="Store 01")], checked=False)
+    journal.enqueue("pra", None, [variables(store="Store 02")])
+    sent = []
+
+    def check(brand, variables_list, base_stamps):
+        raise RuntimeError("Fabric 503")
+
+    assert JournalDrainer(journal, send=lambda brand, payload: sent.append(payload["store"]), check=check).drain_once() == (1, 1)
+    assert sent == ["Store 02"]
+    row = journal.rows()[0]
+    assert (row["status"], row["attempts"], row["last_error"]) == (PENDING, 1, "Fabric 503")
+
+
+def test_older_journal_files_gain_new_columns(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.executescript(edit_journal.SCHEMA.replace("    base_modified_at TEXT,\n", "")
+                           .replace("    checked INTEGER NOT NULL DEFAULT 1,\n", ""))
+    journal = EditJournal(path)
+    journal.enqueue("pra", "a@b.com", [variables()], ["2025-04-30T00:00:00Z"])
+    assert journal.rows()[0]["base_modified_at"] == "2025-04-30T00:00:00Z"
+    assert journal.rows()[0]["checked"] == 1
+    assert journal.unsent_base_stamps("pra", "a@b.com") == {
+        ("Store 01", "Rent and Utilities", "Rent", "Landlord", "Apr 2025"): "2025-04-30T00:00:00Z"}
+
+
+def test_drain_cli_loads_dotenv(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr("dotenv.load_dotenv", lambda *a, **k: calls.append(True))
+    monkeypatch.setattr(JournalDrainer, "drain_once", lambda self: (0, 0))
+    assert edit_journal.main(["--journal", str(tmp_path / "j.sqlite3"), "--drain"]) == 0
+    assert calls
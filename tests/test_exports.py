@@ -0,0 +1,62 @@
+import io
+
+import pandas as pd
+import pytest
+
+import report_engine as engine
+
+needs_pyarrow = pytest.mark.skipif(engine.pq is None, reason="Parquet export needs pyarrow")
+
+
+def read_back(data, fmt):
+    if fmt == "csv":
+        return pd.read_csv(io.BytesIO(data))
+    return pd.read_parquet(io.BytesIO(data))
+
+
+def test_csv_chunks_concatenate_to_one_file(ledger):
+    export = engine.ledger_export_frame(ledger)
+    chunks = list(engine.iter_export(export, "csv", chunk_rows=7))
+    assert len(chunks) == -(-len(export) // 7)
+    header = b",".join(c.encode() for c in export.columns)
+    assert chunks[0].startswith(header)
+    assert all(not chunk.startswith(header) for chunk in chunks[1:])
+    assert b"".join(chunks) == export.to_csv(index=False).encode("utf-8")
+
+
+def test_empty_frame_exports_the_header_only(ledger):
+    export = engine.ledger_export_frame(ledger).head(0)
+    data = b"".join(engine.iter_export(export, "csv"))
+    assert read_back(data, "csv").columns.tolist() == export.columns.tolist()
+
+
+@needs_pyarrow
+def test_parquet_writes_one_row_group_per_chunk(ledger):
+    export = engine.ledger_export_frame(ledger)
+    data = b"".join(engine.iter_export(export, "parquet", chunk_rows=10))
+    metadata = engine.pq.ParquetFile(io.BytesIO(data)).metadata
+    assert metadata.num_row_groups == -(-len(export) // 10)
+    pd.testing.assert_frame_equal(read_back(data, "parquet"), export.reset_index(drop=True))
+
+
+def test_unknown_format_is_rejected(ledger):
+    with pytest.raises(ValueError):
+        list(engine.iter_export(ledger, "xlsx"))
+
+
+def test_parquet_without_pyarrow_is_reported(ledger, monkeypatch):
+    monkeypatch.setattr(engine, "pq", None)
+    assert engine.export_formats() == ["csv"]
+    with pytest.raises(RuntimeError, match="pyarrow"):
+        list(engine.iter_export(ledger, "parquet"))
+
+
+@pytest.mark.parametrize("fmt", ["csv", pytest.param("parquet", marks=needs_pyarrow)])
+def test_write_export_and_export_file_round_trip(ledger, tmp_path, fmt):
+    export = engine.ledger_export_frame(ledger)
+    path = engine.write_export(export, str(tmp_path / f"rows.{fmt}"), chunk_rows=5)
+    with open(path, "rb") as f:
+        written = f.read()
+    spooled = engine.export_file(export, fmt, chunk_rows=5)
+    assert spooled.read() == written
+    assert len(read_back(written, fmt)) == len(export)
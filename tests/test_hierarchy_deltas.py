@@ -0,0 +1,86 @@
+import pytest
+
+import report_engine as engine
+
+pytestmark = pytest.mark.ledger(stores=3, accounts=8, partners=3, months=14, seed=11)
+
+
+def assert_same_hierarchy(patched, rebuilt):
+    assert set(patched.columns) == set(rebuilt.columns)
+    assert patched.grand_totals == pytest.approx(rebuilt.grand_totals)
+    assert set(patched) == set(rebuilt)
+    for classification, cls_node in rebuilt.items():
+        patched_cls = patched[classification]
+        assert patched_cls['totals'] == pytest.approx(cls_node['totals'])
+        assert set(patched_cls['accounts']) == set(cls_node['accounts'])
+        for account, acc_node in cls_node['accounts'].items():
+            patched_acc = patched_cls['accounts'][account]
+            assert patched_acc['totals'] == pytest.approx(acc_node['totals'])
+            assert set(patched_acc['partners']) == set(acc_node['partners'])
+            for partner, totals in acc_node['partners'].items():
+                assert patched_acc['partners'][partner] == pytest.approx(totals)
+    if rebuilt.deltas is not None:
+        assert_same_hierarchy(patched.deltas, rebuilt.deltas)
+
+
+def sample_changes(ledger, periods, new_store_period=None):
+    rows = ledger[ledger['DisplayPeriod'].isin(periods)]
+    first, other = rows.iloc[0], rows.iloc[len(rows) // 2]
+    # The reference (prior) month of the first shown period, so MoM deltas move the other way
+    prior = engine.shift_period(periods[-1], 1)
+    prior_row = ledger[ledger['DisplayPeriod'] == prior].iloc[0]
+    return [
+        {'store': first.Store, 'classification': first.classification, 'account': first.account_name,
+         'partner': first.partner_id_name, 'period': first.DisplayPeriod, 'new_value': 1234.56},
+        {'store': other.Store, 'classification': first.classification, 'account': first.account_name,
+         'partner': 'New Partner', 'period': periods[0], 'new_value': -50.25},
+        {'store': 'New Store', 'classification': other.classification, 'account': other.account_name,
+         'partner': other.partner_id_name, 'period': new_store_period or periods[1], 'new_value': 999.0},
+        {'store': prior_row.Store, 'classification': prior_row.classification, 'account': prior_row.account_name,
+         'partner': prior_row.partner_id_name, 'period': prior, 'new_value': 0.0},
+    ]
+
+
+@pytest.mark.parametrize("compare", [None, "mom", "yoy"])
+def test_period_hierarchy_delta_update_matches_rebuild(ledger, compare):
+    periods = engine.get_period_list(ledger)[:3]
+    scope = {'periods': periods, 'store': "All"}
+    build = lambda df: engine.hierarchy_from_cube(engine.build_aggregation_cube(df), periods, periods=periods,
+                                                  scope=scope, compare=compare)
+    hierarchy = build(ledger)
+    patched_df, deltas = engine.apply_ledger_changes(ledger, sample_changes(ledger, periods))
+    for delta in deltas:
+        engine.apply_ledger_delta(hierarchy, **delta)
+    assert_same_hierarchy(hierarchy, build(patched_df))
+
+
+def test_store_hierarchy_new_store_column_is_backfilled(ledger):
+    periods = engine.get_period_list(ledger)[:3]
+    comp_periods, _ = engine.store_comparison_periods(periods)
+    scope = {'periods': comp_periods, 'store': "All"}
+    build = lambda df: engine.hierarchy_from_cube(engine.build_aggregation_cube(df), group_by='Store',
+                                                  periods=comp_periods, scope=scope)
+    hierarchy = build(ledger)
+    patched_df, deltas = engine.apply_ledger_changes(ledger, sample_changes(ledger, periods, comp_periods[0]))
+    for delta in deltas:
+        engine.apply_ledger_delta(hierarchy, **delta)
+    assert 'New Store' in hierarchy.columns
+    for cls_node in hierarchy.values():
+        assert 'New Store' in cls_node['totals']
+        for acc_node in cls_node['accounts'].values():
+            assert 'New Store' in acc_node['totals']
+            assert all('New Store' in totals for totals in acc_node['partners'].values())
+    assert_same_hierarchy(hierarchy, build(patched_df))
+
+
+def test_store_filtered_hierarchy_ignores_other_stores(ledger):
+    periods = engine.get_period_list(ledger)[:2]
+    store = ledger['Store'].iloc[0]
+    scope = {'periods': periods, 'store': store}
+    build = lambda df: engine.hierarchy_from_cube(engine.build_aggregation_cube(df), periods, periods=periods,
+                                                  store_filter=store, scope=scope)
+    hierarchy = build(ledger)
+    patched_df, deltas = engine.apply_ledger_changes(ledger, sample_changes(ledger, periods))
+    for delta in deltas:
+        engine.apply_ledger_delta(hierarchy, **delta)
+    assert_same_hierarchy(hierarchy, build(patched_df))
@@ -0,0 +1,105 @@
+import random
+from decimal import Decimal
+
+import numpy as np
+import openpyxl
+import pytest
+
+import report_engine as engine
+from benchmarks.synthetic_gl import generate_ledger_items
+
+
+@pytest.fixture
+def paise(monkeypatch):
+    monkeypatch.setattr(engine, "PAISE_BALANCES", True)
+
+
+def ledger_items(seed=3):
+    items = generate_ledger_items("pra", stores=4, accounts=30, partners=6, months=6, seed=seed)
+    rng = random.Random(seed)
+    for item in items:
+        item['Balance'] = round(rng.uniform(-5e5, 5e5), 2)
+    return items
+
+
+def exact_period_totals(items, df):
+    totals = {}
+    for item, period in zip(items, df['DisplayPeriod']):
+        totals[period] = totals.get(period, Decimal(0)) + Decimal(str(item['Balance']))
+    return totals
+
+
+def test_to_paise_rounds_half_away_from_zero():
+    assert engine.to_paise(12.345) == 1235
+    assert engine.to_paise(-12.345) == -1235
+    assert engine.to_paise(np.float64(0.1)) == 10
+    assert engine.to_paise(7) == 700
+    assert engine.to_paise([1.005, -2.5, 0.0]).tolist() == [101, -250, 0]
+    assert engine.to_paise([0.125]).dtype == np.int64
+
+
+def test_flag_off_keeps_float_balances():
+    df = engine.prepare_ledger_frame(ledger_items(), "pra")
+    assert engine.PAISE_COLUMN not in df.columns
+
+
+def test_totals_are_exact(paise):
+    items = ledger_items()
+    df = engine.prepare_ledger_frame(items, "pra")
+    assert df[engine.PAISE_COLUMN].dtype == np.int64
+    periods = engine.get_period_list(df)
+    exact = exact_period_totals(items, df)
+
+    from_rows = engine.build_hierarchy_data(df, periods)
+    from_cube = engine.hierarchy_from_cube(engine.build_aggregation_cube(df), periods, periods=periods)
+    for hierarchy in (from_rows, from_cube):
+        assert {p: Decimal(str(v)) for p, v in hierarchy.grand_totals.items()} == exact
+    assert engine.total_balance(df) == float(sum(exact.values()))
+    assert engine.add_balances(0.1, 0.2) == 0.3
+
+
+def test_edits_keep_paise_in_sync_and_patch_exactly(paise):
+    df = engine.prepare_ledger_frame(ledger_items(seed=5), "pra")
+    periods = engine.get_period_list(df)[:3]
+    hierarchy = engine.build_hierarchy_data(df, periods, scope={'periods': periods, 'store': "All"})
+    row = df[df['DisplayPeriod'] == periods[0]].iloc[0]
+    changes = [
+        {'store': row.Store, 'classification': row.classification, 'account': row.account_name,
+         'partner': row.partner_id_name, 'period': row.DisplayPeriod, 'new_value': 100.005},
+        {'store': row.Store, 'classification': row.classification, 'account': row.account_name,
+         'partner': 'New Partner', 'period': periods[1], 'new_value': 0.1},
+    ]
+    patched, deltas = engine.apply_ledger_changes(df, changes)
+    assert (patched[engine.PAISE_COLUMN] == engine.to_paise(patched['Balance'])).all()
+    assert engine.ledger_cell_values(patched, changes) == [100.01, 0.1]
+
+    for delta in deltas:
+        engine.apply_ledger_delta(hierarchy, **delta)
+    rebuilt = engine.build_hierarchy_data(patched, periods)
+    # Exact equality, not approx: every level was summed in whole paise
+    assert hierarchy.grand_totals == rebuilt.grand_totals
+    assert dict(hierarchy) == dict(rebuilt)
+    assert engine.build_upsert_variables(changes[0], None, None)["balance"] == 100.01
+
+
+def test_editor_totals_are_exact(paise):
+    df = engine.prepare_ledger_frame(ledger_items(), "pra")
+    wide, period_columns = engine.editor_wide_frame(df)
+    expected = engine.to_paise(wide[period_columns]).sum(axis=1) / 100
+    assert wide['Total'].tolist() == expected.tolist()
+
+
+def test_excel_delta_totals_are_exact(paise):
+    df = engine.prepare_ledger_frame(ledger_items(), "pra")
+    periods = engine.get_period_list(df)[:5]
+    hierarchy = engine.hierarchy_from_cube(engine.build_aggregation_cube(df), periods, periods=periods, compare="mom")
+    ws = openpyxl.load_workbook(engine.build_excel_report(hierarchy, periods, expand_all=True)).active
+    header_row = next(row for row in ws.iter_rows(values_only=True) if row[0] == "Account Hierarchy")
+    period_columns = [i for i, h in enumerate(header_row) if h and h.endswith(" Δ MoM") and not h.startswith("Total")]
+    total_column = header_row.index("Total Δ MoM")
+    checked = 0
+    for row in ws.iter_rows(values_only=True):
+        if isinstance(row[total_column], (int, float)):
+            assert Decimal(str(row[total_column])) == sum(Decimal(str(row[i])) for i in period_columns)
+            checked += 1
+    assert checked > 10
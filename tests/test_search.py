@@ -0,0 +1,76 @@
+import re
+
+import pandas as pd
+import pytest
+
+import report_engine as engine
+
+pytestmark = pytest.mark.ledger(stores=2, accounts=30, partners=6, months=2)
+
+
+def named_rows(*names):
+    """One row per (classification, account, partner) triple."""
+    return pd.DataFrame([{'classification': c, 'account_name': a, 'partner_id_name': p, 'Balance': 1.0} for c, a, p in names])
+
+
+def naive_row_labels(df, query):
+    query = query.strip().casefold()
+
+    def matches(name):
+        name = str(name).casefold()
+        words = re.findall(r'[^\W_]+', name)
+        return (len(query) >= 3 and query in name) or name.startswith(query) or any(w.startswith(query) for w in words)
+
+    mask = df['account_name'].map(matches) | df['partner_id_name'].map(matches)
+    return df.index[mask].tolist()
+
+
+def test_row_labels_match_a_full_scan(ledger):
+    index = engine.LedgerSearchIndex(ledger)
+    names = pd.concat([ledger['account_name'], ledger['partner_id_name']]).drop_duplicates().tolist()
+    queries = ["", "x", "le", "Ledger", "LEDGER 00", "dger 01", "zzz"]
+    queries += [name[1:6] for name in names[::7]] + [name.split()[-1] for name in names[::5]]
+    for query in queries:
+        expected = ledger.index.tolist() if not query.strip() else naive_row_labels(ledger, query)
+        assert sorted(index.row_labels(query).tolist()) == sorted(expected), query
+
+
+def test_matches_are_ranked_exact_then_prefix_then_word_then_substring():
+    df = named_rows(("Rent and Utilities", "Parent Co Charges", "Landlord"),
+                    ("Rent and Utilities", "Office Rent", "Landlord"),
+                    ("Rent and Utilities", "Rent Deposit", "Landlord"),
+                    ("Rent and Utilities", "Rent", "Landlord"))
+    hits = engine.LedgerSearchIndex(df).search("  RENT ")
+    assert [hit['name'] for hit in hits] == ["Rent", "Rent Deposit", "Office Rent", "Parent Co Charges"]
+    assert all(hit['level'] == 'account' and hit['partner'] is None for hit in hits)
+    assert engine.LedgerSearchIndex(df).search("rent", limit=2)[-1]['name'] == "Rent Deposit"
+
+
+def test_partner_hits_carry_every_account_they_sit_under():
+    df = named_rows(("Admin Expenses", "Courier", "Blue Dart"),
+                    ("Logistics", "Freight", "Blue Dart"),
+                    ("Logistics", "Freight", "Gati"))
+    index = engine.LedgerSearchIndex(df)
+    hits = index.search("blue")
+    assert [(h['level'], h['classification'], h['account'], h['partner']) for h in hits] == [
+        ('partner', "Admin Expenses", "Courier", "Blue Dart"), ('partner', "Logistics", "Freight", "Blue Dart")]
+    assert index.row_labels("dart").tolist() == [0, 1]
+    assert index.search("") == [] and index.search("nothing") == []
+
+
+def test_search_hierarchy_keeps_only_the_paths_to_matches(ledger):
+    periods = engine.get_period_list(ledger)
+    hierarchy = engine.build_hierarchy_data(ledger, periods)
+    index = engine.LedgerSearchIndex(ledger)
+    partner = ledger['partner_id_name'].iloc[0]
+    matches = index.search(partner, limit=1000)
+    assert matches and all(m['level'] == 'partner' for m in matches if m['name'] == partner)
+
+    found = engine.search_hierarchy(hierarchy, matches)
+    kept = {(c, a, p) for c, node in found.items() for a, acc in node['accounts'].items() for p in acc['partners']}
+    expected = {(m['classification'], m['account'], m['partner']) for m in matches}
+    assert kept == expected
+    # Totals are the unfiltered ones
+    assert found.grand_totals == hierarchy.grand_totals
+    c, a, _ = next(iter(kept))
+    assert found[c]['accounts'][a]['totals'] == hierarchy[c]['accounts'][a]['totals']
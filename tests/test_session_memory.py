@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+
+import session_memory
+from session_memory import SessionFrameStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_memory.time, "monotonic", lambda: now[0])
+    return now
+
+
+def frame(rows=1000):
+    return pd.DataFrame({'Balance': [float(i) for i in range(rows)]})
+
+
+def store_with(sessions, **options):
+    store = SessionFrameStore(sweep_interval=10 ** 9, **options)
+    for session_id in sessions:
+        store.touch(session_id)
+        store.set(session_id, 'current_df', frame())
+    return store
+
+
+def test_frames_are_kept_per_session(clock):
+    store = store_with(["a", "b"])
+    assert store.get("a", 'current_df') is not store.get("b", 'current_df')
+    assert store.get("a", 'original_df') is None and store.get("c", 'current_df') is None
+    assert store.total_bytes() == store.session_bytes("a") + store.session_bytes("b") > 0
+
+
+def test_idle_sessions_are_reclaimed(clock):
+    store = store_with(["a", "b"], idle_seconds=900)
+    clock[0] += 600
+    store.touch("b")
+    clock[0] += 300
+    assert store.sweep() == 1
+    assert store.get("a", 'current_df') is None
+    assert store.get("b", 'current_df') is not None
+    # A reclaimed session is not counted again until it holds frames once more
+    assert store.sweep() == 0
+    assert [row['evictions'] for row in store.report()] == [0, 1]
+
+
+def test_over_budget_reclaims_least_recently_used_sessions_first(clock):
+    store = store_with(["a", "b", "c"], idle_seconds=900, min_idle_seconds=60)
+    store.budget_bytes = store.session_bytes("a") * 2
+    clock[0] += 30
+    assert store.sweep() == 0  # over budget, but nobody has been idle for min_idle_seconds
+    clock[0] += 60
+    store.touch("a")
+    assert store.sweep() == 1
+    assert [store.get(s, 'current_df') is None for s in ("a", "b", "c")] == [False, True, False]
+
+
+def test_sessions_with_unsaved_edits_are_never_reclaimed(clock):
+    store = store_with(["a"], idle_seconds=900, budget_bytes=0)
+    store.touch("a", pinned=True)
+    clock[0] += 10 ** 6
+    assert store.sweep() == 0
+    assert store.get("a", 'current_df') is not None
+
+
+def test_closed_sessions_are_dropped(clock, monkeypatch):
+    store = store_with(["a", "b"])
+    monkeypatch.setattr(session_memory, "session_is_active", lambda session_id: session_id != "a")
+    store.sweep()
+    assert [row['session'] for row in store.report()] == ["b"]
+    assert store.session_bytes("a") == 0
+
+
+def test_touch_sweeps_at_most_every_interval(clock):
+    store = SessionFrameStore(idle_seconds=60, sweep_interval=30)
+    store.touch("a")
+    store.set("a", 'current_df', frame())
+    clock[0] += 61
+    store.touch("b")
+    assert store.get("a", 'current_df') is None
+    store.set("a", 'current_df', frame())  # still idle, but the last sweep was just now
+    clock[0] += 20
+    store.touch("b")
+    assert store.get("a", 'current_df') is not None
+    clock[0] += 10
+    store.touch("b")
+    assert store.get("a", 'current_df') is None
+
+
+def test_report_lists_most_recent_sessions_first(clock):
+    store = store_with(["a", "b"])
+    store.touch("a", user="a@b.com", state_bytes=2 * 1024 * 1024)
+    clock[0] += 5
+    rows = store.report()
+    assert [row['session'] for row in rows] == ["a", "b"]
+    assert rows[0]['user'] == "a@b.com" and rows[0]['state_mb'] == 2.0 and rows[0]['idle_s'] == 5
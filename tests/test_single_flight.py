@@ -0,0 +1,99 @@
+import threading
+import time
+
+import report_engine as engine
+from benchmarks.synthetic_gl import generate_ledger_items
+from report_engine import SingleFlight
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+
+def run_concurrently(flight, callers, key, fn):
+    """Start `callers` threads calling `flight.do(key, fn)`; returns (threads, results, errors)."""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def blocking(value=None, error=None):
+    """Work that blocks until released, counting its runs."""
+    release, calls = threading.Event(), []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        if error is not None:
+            raise error
+        return value if value is not None else object()
+    return work, release, calls
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    work, release, calls = blocking()
+    threads, results, errors = run_concurrently(flight, 5, "pra", work)
+    wait_for(lambda: flight.coalesced == 4)
+    assert flight.in_flight() == 1
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert errors == [] and len(calls) == 1
+    assert len(results) == 5 and all(result is results[0] for result in results)
+    assert flight.in_flight() == 0
+
+
+def test_errors_reach_every_waiter_and_are_not_kept():
+    flight = SingleFlight("test")
+    work, release, calls = blocking(error=RuntimeError("Fabric 503"))
+    threads, results, errors = run_concurrently(flight, 3, "pra", work)
+    wait_for(lambda: flight.coalesced == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [] and [str(e) for e in errors] == ["Fabric 503"] * 3
+    # The next call runs again
+    assert flight.do("pra", lambda: "ok") == "ok"
+
+
+def test_different_keys_and_later_calls_run_separately():
+    flight = SingleFlight("test")
+    work, release, calls = blocking()
+    threads, _, _ = run_concurrently(flight, 1, "pra", work)
+    wait_for(lambda: flight.in_flight() == 1)
+    assert flight.do("wed", lambda: "wed") == "wed"
+    release.set()
+    threads[0].join()
+    assert [flight.do("pra", lambda: n) for n in range(2)] == [0, 1]
+    assert flight.coalesced == 0
+
+
+def test_concurrent_ledger_loads_share_one_fabric_read(monkeypatch):
+    monkeypatch.setattr(engine, "fabric_reads", SingleFlight("fabric_read"))
+    items = generate_ledger_items("pra", stores=1, accounts=3, partners=1, months=2)
+    work, release, calls = blocking(value={"data": {engine.READ_DATA_KEYS["pra"]: items}})
+    graphql = lambda query: work()
+
+    loads = []
+    load_threads = [threading.Thread(target=lambda: loads.append(engine.load_data("pra", graphql))) for _ in range(3)]
+    for thread in load_threads:
+        thread.start()
+    wait_for(lambda: engine.fabric_reads.coalesced == 2)
+    release.set()
+    for thread in load_threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(loads) == 3 and all(df is loads[0] for df in loads) and len(loads[0]) == len(items)
@@ -0,0 +1,52 @@
+import json
+
+import pandas as pd
+import pytest
+
+import report_engine as engine
+from benchmarks.synthetic_gl import generate_ledger_items
+
+
+def chunked(body, size):
+    return (body[i:i + size] for i in range(0, len(body), size))
+
+
+@pytest.mark.parametrize("brand", ["pra", "wed"])
+@pytest.mark.parametrize("chunk_size", [7, 4096, 1 << 20])
+def test_streaming_matches_legacy(brand, chunk_size):
+    items = generate_ledger_items(brand, stores=2, accounts=6, partners=3, months=4, seed=7)
+    items[3]['account_name' if brand == 'pra' else 'Ledger'] = 'Rent "Main}" ₹ store'
+    items[5]['Balance'] = None
+    body = json.dumps({"data": {engine.READ_DATA_KEYS[brand]: items}}).encode("utf-8")
+
+    legacy = engine.prepare_ledger_frame(json.loads(body)["data"][engine.READ_DATA_KEYS[brand]], brand)
+    streamed = engine.decode_read_stream(chunked(body, chunk_size), brand)
+    pd.testing.assert_frame_equal(streamed[legacy.columns], legacy)
+
+
+def test_null_rows_decode_to_empty_frame():
+    body = json.dumps({"data": {engine.READ_DATA_KEYS["pra"]: None}}).encode()
+    assert engine.decode_read_stream(chunked(body, 5), "pra").empty
+
+
+@pytest.mark.parametrize("result", [
+    {"errors": [{"message": "Token expired"}], "data": None},
+    {"data": {engine.READ_DATA_KEYS["pra"]: None}, "errors": [{"message": "Token expired"}]},
+])
+def test_graphql_errors_raise_on_both_paths(result):
+    body = json.dumps(result).encode()
+    with pytest.raises(engine.GraphQLError, match="Token expired"):
+        engine.decode_read_stream(chunked(body, 8), "pra")
+    with pytest.raises(engine.GraphQLError, match="Token expired"):
+        engine._load_data("pra", graphql=lambda query, variables=None: result)
+
+
+def test_missing_rows_key_raises():
+    with pytest.raises(engine.GraphQLError, match="has no"):
+        engine.decode_read_stream(chunked(b'{"data": {}}', 4), "pra")
+
+
+def test_truncated_body_raises():
+    body = json.dumps({"data": {engine.READ_DATA_KEYS["pra"]: [{"Store": "S1", "Balance": 1.0}] * 3}}).encode()
+    with pytest.raises(ValueError, match="Truncated"):
+        engine.decode_read_stream(chunked(body[:-20], 16), "pra")
@@ -0,0 +1,31 @@
+import pytest
+
+import report_engine as engine
+from benchmarks.synthetic_gl import generate_ledger_items, generate_read_response, month_sequence
+
+pytestmark = pytest.mark.ledger(stores=3, accounts=7, partners=2, months=14, seed=4)
+
+
+def test_month_sequence_crosses_years():
+    assert month_sequence(3, start_year=2021, start_month=11) == [(2021, 11), (2021, 12), (2022, 1)]
+
+
+def test_same_seed_gives_the_same_rows():
+    first = generate_ledger_items("pra", stores=2, accounts=4, partners=2, months=3, seed=9)
+    assert first == generate_ledger_items("pra", stores=2, accounts=4, partners=2, months=3, seed=9)
+    assert first != generate_ledger_items("pra", stores=2, accounts=4, partners=2, months=3, seed=10)
+
+
+def test_wedtree_rows_use_its_field_names():
+    row = generate_ledger_items("wed", stores=1, accounts=1, partners=1, months=1)[0]
+    assert {"Ledger", "ContraName"} <= set(row) and "account_name" not in row
+    response = generate_read_response("wed", stores=1, accounts=1, partners=1, months=1)
+    assert response["data"][engine.READ_DATA_KEYS["wed"]] == [row]
+
+
+def test_prepared_ledger_has_every_cell_once(ledger):
+    assert len(ledger) == 3 * 7 * 2 * 14
+    assert not ledger.duplicated(engine.LEDGER_KEY_COLUMNS).any()
+    assert ledger['Store'].nunique() == 3 and ledger['DisplayPeriod'].nunique() == 14
+    assert set(ledger['classification']) <= set(engine.CLASSIFICATION_ORDER)
+    assert ledger['last_modified_at'].notna().all()